@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+Compares the JSON backends on /users pages against the previous stdlib path
+
+  python benchmarks/bench_json.py --users 1000 --repeat 50
+
+'baseline' is what the client did before serializer.py: json.dumps() to a
+str for request bodies and requests' response.json(), which decodes the
+body to text before json.loads(). Every installed backend is timed
+encoding a page to bytes and decoding it straight from the bytes.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from zscalertools.serializer import get_serializer, available
+from test.mock_zia import MockZiaServer
+
+def _best(function, repeat):
+  best = float('inf')
+  for _ in range(repeat):
+    start = time.perf_counter()
+    function()
+    best = min(best, time.perf_counter() - start)
+  return best
+
+def run(args):
+  page = list(MockZiaServer(users=args.users, departments=500, groups=1000, locations=0).users.values())
+  body = json.dumps(page).encode('utf-8')
+  results = [{
+    'backend': 'baseline',
+    'encode_seconds': _best(lambda: json.dumps(page), args.repeat),
+    'decode_seconds': _best(lambda: json.loads(body.decode('utf-8')), args.repeat),
+  }]
+  for name in available():
+    serializer = get_serializer(name)
+    results.append({
+      'backend': name,
+      'encode_seconds': _best(lambda: serializer.dumps(page), args.repeat),
+      'decode_seconds': _best(lambda: serializer.loads(body), args.repeat),
+    })
+  return len(body), results
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument('--users', type=int, default=1000, help='users per page')
+  parser.add_argument('--repeat', type=int, default=50)
+  parser.add_argument('--output', help='write the results as JSON to this file')
+  args = parser.parse_args(argv)
+
+  size, results = run(args)
+  baseline = results[0]
+  print("{} users, {:.1f} KiB per page".format(args.users, size / 1024))
+  for result in results:
+    print("{:<10} encode {:>8.2f}ms ({:>5.1f}x)  decode {:>8.2f}ms ({:>5.1f}x)  {:>7.1f} MiB/s decoded".format(
+      result['backend'], result['encode_seconds'] * 1000, baseline['encode_seconds'] / result['encode_seconds'],
+      result['decode_seconds'] * 1000, baseline['decode_seconds'] / result['decode_seconds'],
+      size / result['decode_seconds'] / 2 ** 20))
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump({'users': args.users, 'page_bytes': size, 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+  sys.exit(main())
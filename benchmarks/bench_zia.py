@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+"""
+Benchmarks the zscalertools hot paths against the local mock ZIA server
+
+  python benchmarks/bench_zia.py --users 100000 --latency 0.05 --output results.json
+  python benchmarks/bench_zia.py --compare baseline.json --tolerance 0.2
+
+Every scenario reports wall time, records per second, peak Python memory
+(tracemalloc) and the number of HTTP requests the server saw. With
+--compare the run fails (exit code 1) when a scenario is slower than the
+baseline by more than --tolerance.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from zscalertools.ratelimit import RateLimiter, DEFAULT_RATE_LIMITS
+from test.mock_zia import MockZiaServer
+
+def _measure(server, name, function, records=None):
+  server.reset_counters()
+  tracemalloc.start()
+  start = time.perf_counter()
+  result = function()
+  seconds = time.perf_counter() - start
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+  count = records(result) if records else result
+  return {
+    'scenario': name,
+    'seconds': round(seconds, 4),
+    'records': count,
+    'records_per_second': round(count / seconds, 1) if seconds else None,
+    'peak_memory_bytes': peak,
+    'requests': server.request_count,
+    'throttled': server.statuses[429],
+  }
+
+def _percentile(values, percent):
+  values = sorted(values)
+  return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+def _timed_calls(function, count, workers):
+  """
+  Runs function(i) count times on `workers` threads, returning the latencies of the calls that succeeded
+  """
+  from concurrent.futures import ThreadPoolExecutor
+
+  def timed(i):
+    started = time.perf_counter()
+    try:
+      function(i)
+    except Exception:
+      return None
+    return time.perf_counter() - started
+
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    return [seconds for seconds in executor.map(timed, range(count)) if seconds is not None]
+
+def _user_data_count(result):
+  return sum(len(records) for records in result)
+
+def run(args):
+  results = []
+  quotas = {'GET': (args.get_quota, 10)} if args.get_quota else None
+  with MockZiaServer(users=args.users, departments=args.departments, groups=args.groups, locations=args.locations,
+                     latency=args.latency, quotas=quotas, max_page_size=args.page_size) as server:
+
+    def client(**kwargs):
+      api = server.client(page_size=args.page_size, serializer=args.serializer, **kwargs)
+      api.login()
+      return api
+
+    for concurrency in (1, args.concurrency):
+      for stream in (False, True):
+        api = client(concurrency=concurrency)
+        name = 'pull_all_user_data concurrency={} stream={}'.format(concurrency, stream)
+        results.append(_measure(server, name, lambda: api.pull_all_user_data(stream=stream), _user_data_count))
+
+    api = client(concurrency=args.concurrency)
+    results.append(_measure(server, 'pull_all_user_data compact=True', lambda: api.pull_all_user_data(compact=True),
+                            _user_data_count))
+
+    api = client(concurrency=args.concurrency)
+    results.append(_measure(server, 'iter_users stream=True', lambda: sum(1 for user in api.iter_users(stream=True))))
+
+    api = client(concurrency=args.concurrency)
+    results.append(_measure(server, 'get_location_tree', lambda: len(api.get_location_tree())))
+
+    api = client(concurrency=args.concurrency)
+    results.append(_measure(server, 'snapshot with locations',
+                            lambda: sum(1 for location in api.snapshot(locations=True).locations())))
+
+    api = client(concurrency=args.concurrency)
+    baseline = api.pull_changes()
+    results.append(_measure(server, 'pull_changes', lambda: api.pull_changes(baseline.state),
+                            lambda changes: sum(changes.state.counts().values())))
+
+    # tail latency of single record reads while a share of requests fail with a 503
+    api = client(concurrency=args.concurrency)
+    server.error_rate = args.error_rate
+    ids = list(server.users)[:args.reads]
+    latencies = []
+    result = _measure(server, 'get_user error_rate={}'.format(args.error_rate),
+                      lambda: latencies.extend(_timed_calls(lambda i: api.get_user(ids[i]), len(ids), args.concurrency)),
+                      lambda _: len(latencies))
+    server.error_rate = 0.0
+    if latencies:
+      result['latency_p50'] = round(_percentile(latencies, 50), 4)
+      result['latency_p99'] = round(_percentile(latencies, 99), 4)
+    result['failed'] = len(ids) - len(latencies)
+    results.append(result)
+
+    # writes are paced by the default limiter the same way they are against ZIA
+    limiter = RateLimiter(DEFAULT_RATE_LIMITS if args.rate_limit else ())
+    api = client(concurrency=args.concurrency, rate_limiter=limiter)
+    desired = api.get_users(pageSize=args.writes)
+    for user in desired:
+      user['comments'] = 'benchmark {}'.format(time.time())
+    results.append(_measure(server, 'bulk_sync_users writes={}'.format(len(desired)),
+                            lambda: api.bulk_sync_users(desired, activate=False), lambda report: len(report.results)))
+  return results
+
+def compare(results, baseline, tolerance):
+  """
+  Returns the scenarios that got slower than `baseline` by more than `tolerance`
+  """
+  previous = {result['scenario']: result for result in baseline['results']}
+  regressions = []
+  for result in results:
+    before = previous.get(result['scenario'])
+    if before is None or not before['seconds']:
+      continue
+    change = (result['seconds'] - before['seconds']) / before['seconds']
+    result['change'] = round(change, 3)
+    if change > tolerance:
+      regressions.append(result)
+  return regressions
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument('--users', type=int, default=20000)
+  parser.add_argument('--departments', type=int, default=500)
+  parser.add_argument('--groups', type=int, default=1000)
+  parser.add_argument('--locations', type=int, default=200)
+  parser.add_argument('--page-size', type=int, default=1000)
+  parser.add_argument('--concurrency', type=int, default=4)
+  parser.add_argument('--latency', type=float, default=0.02, help='seconds added to every mock response')
+  parser.add_argument('--get-quota', type=int, default=0, help='GET requests allowed per 10s before the mock answers 429')
+  parser.add_argument('--reads', type=int, default=200, help='get_user calls made by the error rate scenario')
+  parser.add_argument('--error-rate', type=float, default=0.1, help='share of get_user requests the mock fails with a 503')
+  parser.add_argument('--writes', type=int, default=50, help='users updated by the bulk_sync_users scenario')
+  parser.add_argument('--serializer', help="JSON backend ('orjson', 'ujson' or 'json'), the fastest installed by default")
+  parser.add_argument('--rate-limit', action='store_true', help='pace writes with DEFAULT_RATE_LIMITS (1 per second)')
+  parser.add_argument('--output', help='write the results as JSON to this file')
+  parser.add_argument('--compare', help='baseline JSON written by a previous --output')
+  parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown against --compare (0.2 = 20%%)')
+  args = parser.parse_args(argv)
+
+  results = run(args)
+  regressions = []
+  if args.compare:
+    with open(args.compare) as f:
+      regressions = compare(results, json.load(f), args.tolerance)
+
+  for result in results:
+    print("{:<50} {:>9.3f}s {:>12} rec/s {:>8.1f} MiB peak {:>6} requests{}{}".format(
+      result['scenario'], result['seconds'], result['records_per_second'], result['peak_memory_bytes'] / 2 ** 20,
+      result['requests'], " ({:+.0%})".format(result['change']) if 'change' in result else "",
+      "  p50 {latency_p50:.3f}s p99 {latency_p99:.3f}s failed {failed}".format(**result) if 'latency_p99' in result else ""))
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump({'python': platform.python_version(), 'options': vars(args), 'results': results}, f, indent=2)
+
+  for result in regressions:
+    print("REGRESSION {} is {:.0%} slower than the baseline".format(result['scenario'], result['change']))
+  return 1 if regressions else 0
+
+if __name__ == '__main__':
+  sys.exit(main())
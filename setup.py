@@ -21,5 +21,10 @@ setuptools.setup(
   install_requires=[
     'requests',
   ],
+  extras_require={
+    'async': ['aiohttp'],
+    'fast': ['orjson'],
+    'parquet': ['pyarrow'],
+  },
   python_requires='>=3.6',
 )
\ No newline at end of file
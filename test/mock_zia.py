@@ -0,0 +1,444 @@
+#!/usr/bin/env python
+
+import re
+import json
+import math
+import time
+import hashlib
+import random
+import threading
+import collections
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from zscalertools.ratelimit import endpoint
+
+class MockZiaServer:
+  """
+  Local stand-in for the ZIA API used by the offline tests and benchmarks
+
+  Serves /authenticatedSession, /users, /departments, /groups, /locations
+  (with /lite, /{id}/sublocations and /bulkDelete) and /status(/activate)
+  over plain HTTP from generated data, with page/pageSize pagination, a
+  session cookie, configurable latency and 429 responses carrying Retry-After.
+  Single record GETs carry an ETag and answer a matching If-None-Match with a 304.
+
+    with MockZiaServer(users=10000, latency=0.05) as server:
+      api = server.client()
+      users, departments, groups = api.pull_all_user_data()
+
+  Attributes
+  ----------
+  users, departments, groups, locations : int
+    number of records generated
+  sublocations : int
+    sub-locations generated under every `sublocation_every`th location
+  latency : float or tuple
+    seconds added to every response, a (min, max) tuple draws uniformly
+  throttle_every : int
+    answer every Nth request with a 429 (0 disables)
+  quotas : dict
+    HTTP method -> (calls, period) enforced over a sliding window, requests over quota get a 429
+  retry_after : int
+    Retry-After seconds sent with throttle_every 429s
+  error_rate : float
+    share of requests answered with a 503, drawn from the seeded random generator
+  max_page_size : int
+    largest pageSize honoured, bigger requests are truncated like ZIA does
+  session_idle_timeout : float
+    seconds after which an unused session cookie is rejected with a 401 (None never expires)
+  activation_delay : float
+    seconds /status reports INPROGRESS after /status/activate
+  """
+
+  def __init__(self, users=1000, departments=50, groups=100, locations=50, sublocations=3, sublocation_every=2,
+               latency=0.0, throttle_every=0, quotas=None, retry_after=0, error_rate=0.0, max_page_size=1000,
+               session_idle_timeout=None, activation_delay=0.0, seed=0):
+    self.latency = latency
+    self.throttle_every = throttle_every
+    self.quotas = dict(quotas or {})
+    self.retry_after = retry_after
+    self.error_rate = error_rate
+    self.max_page_size = max_page_size
+    self.session_idle_timeout = session_idle_timeout
+    self.activation_delay = activation_delay
+    self.lock = threading.Lock()
+    self.requests = collections.Counter()
+    self.statuses = collections.Counter()
+    self.sessions = {}
+    self.logins = 0
+    self.activations = 0
+    self._request_count = 0
+    self._windows = collections.defaultdict(collections.deque)
+    self._random = random.Random(seed)
+    self._activation_done = 0
+    self._pending_changes = False
+    self._generate(users, departments, groups, locations, sublocations, sublocation_every)
+    self._httpd = None
+    self._thread = None
+
+  def _generate(self, users, departments, groups, locations, sublocations, sublocation_every):
+    rnd = self._random
+    self.departments = collections.OrderedDict()
+    for i in range(departments):
+      id = 1000 + i
+      self.departments[id] = {'id': id, 'name': 'Department {}'.format(i), 'comments': ''}
+    self.groups = collections.OrderedDict()
+    for i in range(groups):
+      id = 200000 + i
+      self.groups[id] = {'id': id, 'name': 'Group {}'.format(i)}
+    department_list = list(self.departments.values())
+    group_list = list(self.groups.values())
+    self.users = collections.OrderedDict()
+    for i in range(users):
+      id = 5000000 + i
+      user = {
+        'id': id,
+        'name': 'User {}'.format(i),
+        'email': 'user{}@example.com'.format(i),
+        'comments': '',
+        'tempAuthEmail': '',
+        'adminUser': False,
+      }
+      if department_list:
+        user['department'] = dict(rnd.choice(department_list))
+      if group_list:
+        user['groups'] = [dict(group) for group in rnd.sample(group_list, min(len(group_list), rnd.randint(1, 3)))]
+      self.users[id] = user
+    self._next_user_id = 5000000 + users
+    self.locations = collections.OrderedDict()
+    next_sublocation_id = 9000000
+    for i in range(locations):
+      id = 7000000 + i
+      location = {
+        'id': id,
+        'name': 'Location {}'.format(i),
+        'ipAddresses': ['10.{}.{}.0-10.{}.{}.255'.format(i // 256, i % 256, i // 256, i % 256)],
+        'authRequired': True,
+        'sslScanEnabled': bool(i % 2),
+      }
+      self.locations[id] = location
+      if sublocations and sublocation_every and i % sublocation_every == 0:
+        location['childCount'] = sublocations
+        for j in range(sublocations):
+          self.locations[next_sublocation_id] = {
+            'id': next_sublocation_id,
+            'name': 'Location {} - Sub {}'.format(i, j),
+            'parentId': id,
+            'ipAddresses': ['10.{}.{}.{}'.format(i // 256, i % 256, j + 1)],
+          }
+          next_sublocation_id += 1
+    self._next_location_id = 7000000 + locations
+
+  @property
+  def cloud(self):
+    """
+    Value to pass as `cloud` to zia.api, e.g. 'http://127.0.0.1:8080'
+    """
+    return 'http://{}:{}'.format(*self._httpd.server_address[:2])
+
+  def start(self):
+    self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), _make_handler(self))
+    self._httpd.daemon_threads = True
+    self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+    self._thread.start()
+    return self
+
+  def stop(self):
+    if self._httpd is not None:
+      self._httpd.shutdown()
+      self._httpd.server_close()
+      self._httpd = None
+
+  def __enter__(self):
+    return self.start()
+
+  def __exit__(self, exc_type, exc, tb):
+    self.stop()
+
+  def client(self, **kwargs):
+    """
+    Returns a zia.api pointed at this server, rate limiting is off unless a rate_limiter is given
+    """
+    from zscalertools import zia
+    from zscalertools.ratelimit import RateLimiter
+    kwargs.setdefault('rate_limiter', RateLimiter(()))
+    return zia.api(self.cloud, 'admin@example.com', 'password', 'abcdefghijklmnopqrstuvwxyz', **kwargs)
+
+  def async_client(self, **kwargs):
+    from zscalertools import zia
+    from zscalertools.ratelimit import RateLimiter
+    kwargs.setdefault('rate_limiter', RateLimiter(()))
+    return zia.AsyncApi(self.cloud, 'admin@example.com', 'password', 'abcdefghijklmnopqrstuvwxyz', **kwargs)
+
+  def expire_sessions(self):
+    with self.lock:
+      self.sessions.clear()
+
+  def reset_counters(self):
+    with self.lock:
+      self.requests.clear()
+      self.statuses.clear()
+      self._request_count = 0
+
+  @property
+  def request_count(self):
+    return sum(self.requests.values())
+
+  # request handling, called from the handler threads
+
+  def _delay(self):
+    latency = self.latency
+    if isinstance(latency, (tuple, list)):
+      with self.lock:
+        latency = self._random.uniform(*latency)
+    if latency:
+      time.sleep(latency)
+
+  def _throttle(self, method):
+    """
+    Returns the Retry-After seconds when the request must be rejected, None otherwise
+    """
+    with self.lock:
+      self._request_count += 1
+      if self.throttle_every and self._request_count % self.throttle_every == 0:
+        return self.retry_after
+      quota = self.quotas.get(method)
+      if quota is None:
+        return None
+      calls, period = quota
+      now = time.time()
+      window = self._windows[method]
+      while window and window[0] <= now - period:
+        window.popleft()
+      if len(window) >= calls:
+        return max(0, int(math.ceil(window[0] + period - now)))
+      window.append(now)
+      return None
+
+  def _fail(self):
+    if not self.error_rate:
+      return False
+    with self.lock:
+      return self._random.random() < self.error_rate
+
+  def _session_valid(self, session_id):
+    with self.lock:
+      last_used = self.sessions.get(session_id)
+      if last_used is None:
+        return False
+      now = time.time()
+      if self.session_idle_timeout is not None and now - last_used > self.session_idle_timeout:
+        del self.sessions[session_id]
+        return False
+      self.sessions[session_id] = now
+      return True
+
+  def _page(self, records, query):
+    page = int(query.get('page', ['1'])[0])
+    page_size = min(int(query.get('pageSize', ['100'])[0]), self.max_page_size)
+    start = (page - 1) * page_size
+    return records[start:start + page_size]
+
+  def _filter(self, records, query, *fields):
+    for field in fields:
+      if field in query:
+        value = query[field][0].lower()
+        records = [record for record in records if value in str(record.get('name', '')).lower()]
+    return records
+
+  def handle(self, method, path, query, body):
+    """
+    Returns (status, body, headers) for one API call
+    """
+    if path == '/authenticatedSession':
+      if method == 'POST':
+        if not body or not body.get('apiKey') or body.get('password') != 'password':
+          return 401, {'code': 'AUTHENTICATION_FAILED', 'message': 'Invalid credentials'}, {}
+        with self.lock:
+          self.logins += 1
+          session_id = 'mock{:08d}'.format(self.logins)
+          self.sessions[session_id] = time.time()
+        return 200, {'authType': 'ADMIN_LOGIN', 'obfuscateApiKey': False, 'passwordExpiryTime': 0,
+                     'passwordExpiryDays': 0}, {'Set-Cookie': 'JSESSIONID={}; Path=/; HttpOnly'.format(session_id)}
+      if method == 'DELETE':
+        return 200, {'status': 'success'}, {}
+
+    if path == '/status':
+      with self.lock:
+        if time.time() < self._activation_done:
+          return 200, {'status': 'INPROGRESS'}, {}
+        return 200, {'status': 'PENDING' if self._pending_changes else 'ACTIVE'}, {}
+    if path == '/status/activate' and method == 'POST':
+      with self.lock:
+        self.activations += 1
+        self._pending_changes = False
+        self._activation_done = time.time() + self.activation_delay
+      return 200, {'status': 'INPROGRESS' if self.activation_delay else 'ACTIVE'}, {}
+
+    for collection, records, bulk_limit in (('/users', self.users, 500), ('/locations', self.locations, 100)):
+      if path == collection + '/bulkDelete' and method == 'POST':
+        ids = body.get('ids', []) if body else []
+        if len(ids) > bulk_limit:
+          return 400, {'code': 'INVALID_INPUT_ARGUMENT', 'message': 'Maximum {} ids allowed'.format(bulk_limit)}, {}
+        with self.lock:
+          deleted = [id for id in ids if records.pop(id, None) is not None]
+          self._pending_changes = True
+        return 200, {'ids': deleted}, {}
+
+    if path == '/users':
+      if method == 'GET':
+        with self.lock:
+          users = list(self.users.values())
+        users = self._filter(users, query, 'name')
+        if 'dept' in query:
+          users = [user for user in users if query['dept'][0] == user.get('department', {}).get('name')]
+        if 'group' in query:
+          users = [user for user in users if query['group'][0] in [group['name'] for group in user.get('groups', [])]]
+        return 200, self._page(users, query), {}
+      if method == 'POST':
+        with self.lock:
+          user = dict(body)
+          user['id'] = self._next_user_id
+          self._next_user_id += 1
+          user.pop('password', None)
+          self.users[user['id']] = user
+          self._pending_changes = True
+        return 200, user, {}
+
+    for collection, records in (('/departments', self.departments), ('/groups', self.groups)):
+      if path == collection and method == 'GET':
+        with self.lock:
+          values = list(records.values())
+        return 200, self._page(self._filter(values, query, 'search', 'name'), query), {}
+
+    if path == '/locations':
+      if method == 'GET':
+        with self.lock:
+          parents = [location for location in self.locations.values() if 'parentId' not in location]
+        return 200, self._page(self._filter(parents, query, 'search'), query), {}
+      if method == 'POST':
+        with self.lock:
+          location = dict(body)
+          location['id'] = self._next_location_id
+          self._next_location_id += 1
+          self.locations[location['id']] = location
+          self._pending_changes = True
+        return 200, location, {}
+
+    if path == '/locations/lite' and method == 'GET':
+      include_sub = query.get('includeSubLocations', ['false'])[0] == 'true'
+      include_parents = query.get('includeParentLocations', ['false'])[0] == 'true'
+      with self.lock:
+        locations = list(self.locations.values())
+      lite = []
+      for location in locations:
+        is_sub = 'parentId' in location
+        if is_sub and not include_sub:
+          continue
+        if include_parents and not include_sub and not location.get('childCount'):
+          continue
+        entry = {'id': location['id'], 'name': location['name']}
+        if is_sub:
+          entry['parentId'] = location['parentId']
+        lite.append(entry)
+      return 200, self._page(self._filter(lite, query, 'search'), query), {}
+
+    match = re.match(r'^/locations/(\d+)/sublocations$', path)
+    if match and method == 'GET':
+      parent_id = int(match.group(1))
+      with self.lock:
+        if parent_id not in self.locations:
+          return 404, {'code': 'RESOURCE_NOT_FOUND'}, {}
+        children = [location for location in self.locations.values() if location.get('parentId') == parent_id]
+      return 200, self._page(children, query), {}
+
+    match = re.match(r'^/(users|departments|groups|locations)/(\d+)$', path)
+    if match:
+      records = getattr(self, match.group(1))
+      id = int(match.group(2))
+      with self.lock:
+        if id not in records:
+          return 404, {'code': 'RESOURCE_NOT_FOUND', 'message': 'Resource does not exist'}, {}
+        if method == 'GET':
+          return 200, records[id], {'ETag': _etag(records[id])}
+        if method == 'PUT' and match.group(1) in ('users', 'locations'):
+          record = dict(body)
+          record['id'] = id
+          records[id] = record
+          self._pending_changes = True
+          return 200, record, {}
+        if method == 'DELETE' and match.group(1) in ('users', 'locations'):
+          del records[id]
+          self._pending_changes = True
+          return 204, None, {}
+
+    return 404, {'code': 'RESOURCE_NOT_FOUND', 'message': 'Unknown endpoint'}, {}
+
+def _etag(record):
+  return '"{}"'.format(hashlib.sha1(json.dumps(record, sort_keys=True).encode('utf-8')).hexdigest())
+
+def _make_handler(server):
+
+  class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+      pass
+
+    def _send(self, status, body, headers):
+      data = json.dumps(body).encode('utf-8') if body is not None else b''
+      self.send_response(status)
+      if data:
+        self.send_header('Content-Type', 'application/json')
+      self.send_header('Content-Length', str(len(data)))
+      for name, value in headers.items():
+        self.send_header(name, value)
+      self.end_headers()
+      self.wfile.write(data)
+
+    def _dispatch(self, method):
+      url = urlparse(self.path)
+      path = url.path
+      if path.startswith('/api/v1'):
+        path = path[len('/api/v1'):]
+      path = path.rstrip('/') or '/'
+      length = int(self.headers.get('Content-Length') or 0)
+      raw = self.rfile.read(length) if length else b''
+      body = json.loads(raw.decode('utf-8')) if raw else None
+      with server.lock:
+        server.requests[(method, endpoint(path))] += 1
+      server._delay()
+      status, response, headers = self._respond(method, path, parse_qs(url.query), body)
+      if status == 200 and 'ETag' in headers and headers['ETag'] == self.headers.get('If-None-Match'):
+        status, response = 304, None
+      with server.lock:
+        server.statuses[status] += 1
+      self._send(status, response, headers)
+
+    def _respond(self, method, path, query, body):
+      retry_after = server._throttle(method)
+      if retry_after is not None:
+        return 429, {'message': 'Rate Limit exceeded', 'Retry-After': '{} seconds'.format(retry_after)}, \
+               {'Retry-After': str(retry_after)}
+      if server._fail():
+        return 503, {'code': 'SERVICE_UNAVAILABLE', 'message': 'Service Unavailable'}, {}
+      if path != '/authenticatedSession':
+        match = re.search(r'JSESSIONID=([^;\s]+)', self.headers.get('Cookie', ''))
+        if not match or not server._session_valid(match.group(1)):
+          return 401, {'code': 'NOT_AUTHENTICATED', 'message': 'Session is not valid'}, {}
+      return server.handle(method, path, query, body)
+
+    def do_GET(self):
+      self._dispatch('GET')
+
+    def do_POST(self):
+      self._dispatch('POST')
+
+    def do_PUT(self):
+      self._dispatch('PUT')
+
+    def do_DELETE(self):
+      self._dispatch('DELETE')
+
+  return Handler
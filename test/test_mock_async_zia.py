@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+import asyncio
+import unittest
+
+from zscalertools import zia, models
+from zscalertools.ratelimit import RateLimiter
+
+from test.mock_zia import MockZiaServer
+
+class TestMockAsyncZia(unittest.TestCase):
+  """
+  Offline tests of zia.AsyncApi against the local mock ZIA server
+  """
+
+  @classmethod
+  def setUpClass(cls):
+    cls.server = MockZiaServer(users=2500, departments=20, groups=30, locations=12).start()
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.server.stop()
+
+  def setUp(self):
+    self.server.reset_counters()
+
+  def run_client(self, operation, **kwargs):
+    async def run():
+      async with self.server.async_client(**kwargs) as client:
+        return await operation(client)
+    return asyncio.run(run())
+
+  def test_login_logout(self):
+    async def operation(client):
+      login = await client.login()
+      await client.logout()
+      return login
+    self.assertEqual(self.run_client(operation)['authType'], 'ADMIN_LOGIN')
+
+  def test_iter_users(self):
+    async def operation(client):
+      await client.login()
+      return [user async for user in client.iter_users(pageSize=500)]
+    users = self.run_client(operation)
+    self.assertEqual([user['id'] for user in users], list(self.server.users))
+
+  def test_pull_all_user_data(self):
+    async def operation(client):
+      await client.login()
+      return await client.pull_all_user_data()
+    users, departments, groups = self.run_client(operation, page_size=1500)
+    self.assertEqual((len(users), len(departments), len(groups)), (2500, 20, 30))
+    self.assertEqual(self.server.requests[('GET', '/departments')], 1)
+
+  def test_pull_all_user_data_compact(self):
+    async def operation(client):
+      await client.login()
+      return await client.pull_all_user_data(compact=True)
+    data = self.run_client(operation)
+    self.assertIsInstance(data, models.UserData)
+    self.assertEqual((len(data.users), len(data.departments), len(data.groups)), (2500, 20, 30))
+    user = data.users[0]
+    self.assertIn(user.department, data.departments)
+    self.assertIs(user.department, next(department for department in data.departments if department.id == user.department.id))
+
+  def test_bulk_helpers(self):
+    ids = list(self.server.users)[:5]
+    parents = [location['id'] for location in self.server.locations.values() if location.get('childCount')][:2]
+
+    async def operation(client):
+      await client.login()
+      users = await client.get_users_by_ids(ids)
+      added = await client.add_users([{'name': 'Async {}'.format(i), 'email': 'async{}@example.com'.format(i)}
+                                      for i in range(3)])
+      updated = await client.update_users([dict(user, comments='updated') for user in added])
+      deleted = await client.delete_users([user['id'] for user in added])
+      sublocations = await client.get_sublocations_by_ids(parents)
+      return users, added, updated, deleted, sublocations
+
+    users, added, updated, deleted, sublocations = self.run_client(operation)
+    self.assertEqual([user['id'] for user in users], ids)
+    self.assertEqual([user['name'] for user in added], ['Async 0', 'Async 1', 'Async 2'])
+    self.assertEqual({user['comments'] for user in updated}, {'updated'})
+    self.assertEqual(deleted, [None, None, None])
+    self.assertTrue(all(user['id'] not in self.server.users for user in added))
+    self.assertEqual([len(children) for children in sublocations], [3, 3])
+
+  def test_bad_credentials(self):
+    async def operation():
+      async with zia.AsyncApi(self.server.cloud, 'admin@example.com', 'wrong', 'abcdefghijklmnopqrstuvwxyz',
+                              rate_limiter=RateLimiter(())) as client:
+        with self.assertRaises(zia.ZiaSessionException):
+          await client.login()
+        with self.assertRaises(zia.ZiaSessionException):
+          await client.get_user(next(iter(self.server.users)))
+    asyncio.run(operation())
+    # one rejected login per call, never a login loop
+    self.assertEqual(self.server.requests[('POST', '/authenticatedSession')], 2)
+
+  def test_expired_session(self):
+    ids = list(self.server.users)[:8]
+
+    async def operation(client):
+      await client.login()
+      self.server.expire_sessions()
+      logins = self.server.logins
+      users = await asyncio.gather(*[client.get_user(id) for id in ids])
+      return users, self.server.logins - logins
+
+    users, logins = self.run_client(operation, concurrency=8)
+    self.assertEqual([user['id'] for user in users], ids)
+    self.assertEqual(logins, 1)
+
+if __name__ == '__main__':
+  unittest.main()
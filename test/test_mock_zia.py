@@ -0,0 +1,497 @@
+#!/usr/bin/env python
+
+import os
+import time
+import csv
+import gzip
+import json
+import tempfile
+import collections
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from zscalertools.activation import ActivationCoordinator, ActivationPending
+from zscalertools.cache import MemoryCache, SqliteCache
+from zscalertools.export import Exporter, STATE_FILE
+from zscalertools.metrics import Metrics
+from zscalertools.pool import TenantPool
+from zscalertools.ratelimit import RateLimit, RateLimiter, endpoint
+from zscalertools.retries import RetryPolicy, RetryBudget
+from zscalertools.session import SessionManager
+
+from test.mock_zia import MockZiaServer
+
+class RecordingRateLimiter(RateLimiter):
+  """
+  Counts the requests that were paced, keyed like MockZiaServer.requests
+  """
+
+  def __init__(self, limits):
+    super().__init__(limits)
+    self.calls = collections.Counter()
+
+  def reserve(self, method, api_path):
+    self.calls[(method, endpoint(api_path))] += 1
+    return super().reserve(method, api_path)
+
+class TestMockZia(unittest.TestCase):
+  """
+  Offline tests against the local mock ZIA server, no tenant or test_api.yml needed
+  """
+
+  @classmethod
+  def setUpClass(cls):
+    cls.server = MockZiaServer(users=2500, departments=20, groups=30, locations=12).start()
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.server.stop()
+
+  def setUp(self):
+    self.server.reset_counters()
+    self.server.throttle_every = 0
+    self.api = self.server.client(page_size=1000)
+
+  def test_login_logout(self):
+    login = self.api.login()
+    self.assertEqual(login['authType'], 'ADMIN_LOGIN')
+    self.assertEqual(self.api.logout()['status'], 'success')
+
+  def test_iter_users(self):
+    users = list(self.api.iter_users())
+    streamed_users = list(self.api.iter_users(stream=True))
+    self.assertEqual(len(users), 2500)
+    self.assertEqual(users, streamed_users)
+
+  def test_pull_all_user_data(self):
+    users, departments, groups = self.api.pull_all_user_data()
+    self.assertEqual((len(users), len(departments), len(groups)), (2500, 20, 30))
+    self.assertEqual(len({user['id'] for user in users}), 2500)
+
+  def test_pull_all_user_data_compact(self):
+    users, departments, groups = self.api.pull_all_user_data()
+    compact = self.api.pull_all_user_data(compact=True)
+    self.assertEqual(list(compact.users.to_dicts()), users)
+    self.assertEqual(len(compact.departments), len(departments))
+    user = compact.users.by_id(users[10]['id'])
+    self.assertEqual(user['email'], users[10]['email'])
+    self.assertIs(user.department, compact.users.by_id(users[10]['id']).department)
+
+  def test_serializers(self):
+    api = self.server.client(serializer='json')
+    self.assertEqual(api.get_users(pageSize=50), self.api.get_users(pageSize=50))
+    user = api.add_user({'name': 'Serializer User', 'email': 'serializer@example.com'})
+    self.assertIsNone(api.delete_user(user['id']))
+
+  def test_page_size_above_server_max(self):
+    self.assertEqual(len(list(self.api.iter_users(pageSize=2000))), 2500)
+    users, departments, groups = self.server.client(page_size=1500).pull_all_user_data()
+    self.assertEqual(len(users), 2500)
+    small = self.server.client(max_page_size=self.server.max_page_size // 2)
+    self.assertEqual(len(list(small.iter_users())), 2500)
+
+  def test_prefetch_window(self):
+    self.api.pull_all_user_data()
+    # single page listings are fetched with one request, only users open the window
+    self.assertEqual(self.server.requests[('GET', '/departments')], 1)
+    self.assertEqual(self.server.requests[('GET', '/groups')], 1)
+    # page 1, a full window after it and at most one refill before the short page 3 arrives
+    self.assertLessEqual(self.server.requests[('GET', '/users')], 2 + self.api.concurrency)
+
+  def test_paged_reads_are_gated(self):
+    limiter = RecordingRateLimiter(())
+    api = self.server.client(rate_limiter=limiter)
+    api.login()
+    api._throttle(0.5)
+    started = time.time()
+    self.assertEqual(len(list(api.iter_users(pageSize=500))), 2500)
+    self.assertGreaterEqual(time.time() - started, 0.5)
+    self.assertEqual(limiter.calls[('GET', '/users')], self.server.requests[('GET', '/users')])
+
+  def test_throttled_pages(self):
+    self.server.throttle_every = 3
+    users = list(self.api.iter_users(pageSize=500))
+    self.assertEqual(len(users), 2500)
+    self.assertGreater(self.server.statuses[429], 0)
+
+  def test_expired_session(self):
+    self.api.get_status()
+    self.server.expire_sessions()
+    self.assertIn('status', self.api.get_status())
+    self.assertEqual(self.server.statuses[401], 1)
+
+  def test_session_file(self):
+    with tempfile.TemporaryDirectory() as directory:
+      session_file = os.path.join(directory, 'session.json')
+      logins = self.server.logins
+      first = self.server.client(session_manager=SessionManager(session_file=session_file))
+      first.get_status()
+      self.assertEqual(os.stat(session_file).st_mode & 0o777, 0o600)
+      # a second process reuses the saved cookie instead of logging in
+      second = self.server.client(session_manager=SessionManager(session_file=session_file))
+      self.assertIn('status', second.get_status())
+      self.assertEqual(self.server.logins - logins, 1)
+      # a session saved for another admin is ignored
+      other = self.server.client(session_manager=SessionManager(session_file=session_file))
+      other.username = 'other@example.com'
+      other.get_status()
+      self.assertEqual(self.server.logins - logins, 2)
+
+  def test_expired_session_single_login(self):
+    ids = list(self.server.users)[:8]
+    self.api.get_status()
+    self.server.expire_sessions()
+    logins = self.server.logins
+    with ThreadPoolExecutor(max_workers=8) as executor:
+      users = list(executor.map(self.api.get_user, ids))
+    self.assertEqual([user['id'] for user in users], ids)
+    self.assertEqual(self.server.logins - logins, 1)
+
+  def test_session_max_age(self):
+    api = self.server.client(session_manager=SessionManager(max_age=0.3, margin=0))
+    logins = self.server.logins
+    api.get_status()
+    api.get_status()
+    self.assertEqual(self.server.logins - logins, 1)
+    time.sleep(0.4)
+    api.get_status()
+    # renewed before the request instead of after a 401
+    self.assertEqual(self.server.logins - logins, 2)
+    self.assertEqual(self.server.statuses[401], 0)
+
+  def test_sublocations(self):
+    locations = self.api.get_locations()
+    parent = next(location for location in locations if location.get('childCount'))
+    self.assertEqual(len(self.api.get_sublocations(parent['id'])), parent['childCount'])
+
+  def test_location_tree(self):
+    tree = self.api.get_location_tree()
+    parents = self.api.get_locations()
+    self.assertEqual(len(tree.parents), len(parents))
+    for parent in parents:
+      self.assertEqual(len(tree.children(parent['id'])), parent.get('childCount', 0))
+    self.assertEqual(self.server.requests[('GET', '/locations/{id}/sublocations')],
+                     sum(1 for parent in parents if parent.get('childCount')))
+
+  def test_location_tree_uses_lite(self):
+    server = MockZiaServer(users=0, locations=6).start()
+    try:
+      # a stale childCount does not cost a request when lite lists no sub-locations
+      parent = next(location for location in server.locations.values() if location.get('childCount'))
+      for id in [id for id, location in server.locations.items() if location.get('parentId') == parent['id']]:
+        del server.locations[id]
+      tree = server.client().get_location_tree()
+      self.assertEqual(tree.children(parent['id']), [])
+      self.assertEqual(server.requests[('GET', '/locations/{id}/sublocations')], 2)
+      server.reset_counters()
+      with tempfile.TemporaryDirectory() as directory:
+        self.assertEqual(Exporter(server.client(), directory, kinds=('sublocations',)).run(), {'sublocations': 6})
+      self.assertEqual(server.requests[('GET', '/locations/{id}/sublocations')], 2)
+      # without lite every parent with a childCount is read
+      server.reset_counters()
+      handle = server.handle
+      server.handle = lambda method, path, query, body: ((500, {'code': 'UNEXPECTED_ERROR'}, {})
+                                                         if path == '/locations/lite' else handle(method, path, query, body))
+      self.assertEqual(len(server.client().get_location_tree()), len(tree))
+      self.assertEqual(server.requests[('GET', '/locations/{id}/sublocations')], 3)
+    finally:
+      server.stop()
+
+  def test_cached_locations_lite(self):
+    api = self.server.client(cache=MemoryCache())
+    self.assertEqual(api.get_locations_lite(), api.get_locations_lite())
+    self.assertEqual(api.cache_stats()['hits'], 1)
+
+  def test_shared_cache(self):
+    cache = MemoryCache()
+    other = MockZiaServer(users=10, locations=0).start()
+    try:
+      id = next(iter(other.users))
+      other.users[id] = dict(other.users[id], name='Other Tenant')
+      first, second = self.server.client(cache=cache), other.client(cache=cache)
+      self.assertEqual(first.get_user(id)['name'], self.server.users[id]['name'])
+      # the same path on another tenant is a different entry
+      self.assertEqual(second.get_user(id)['name'], 'Other Tenant')
+      self.assertEqual(second.get_user(id)['name'], 'Other Tenant')
+      self.assertEqual(other.requests[('GET', '/users/{id}')], 1)
+      second.update_user(id, other.users[id])
+      self.assertEqual(len(cache), 1)
+      # only the other tenant's copy was dropped
+      second.get_user(id)
+      first.get_user(id)
+      self.assertEqual(other.requests[('GET', '/users/{id}')], 2)
+      self.assertEqual(self.server.requests[('GET', '/users/{id}')], 1)
+    finally:
+      other.stop()
+
+  def test_cache_write_through(self):
+    api = self.server.client(cache=MemoryCache())
+    id = next(iter(self.server.users))
+    user = api.get_user(id)
+    self.assertEqual(api.get_user(id), user)
+    api.update_user(id, dict(user, comments='cached'))
+    # the write dropped the entry, the next read is a miss that goes back to the server
+    self.assertEqual(api.get_user(id)['comments'], 'cached')
+    self.assertEqual(self.server.requests[('GET', '/users/{id}')], 2)
+    self.assertEqual((api.cache_stats()['hits'], api.cache_stats()['misses']), (1, 2))
+    api.update_user(id, user)
+
+  def test_cache_etag_revalidation(self):
+    # a zero TTL makes every entry stale, so each read is revalidated
+    api = self.server.client(cache=MemoryCache(ttl=0))
+    id = next(iter(self.server.departments))
+    department = api.get_department(id)
+    self.assertEqual(api.get_department(id), department)
+    self.assertEqual(self.server.statuses[304], 1)
+    self.assertEqual(api.cache_stats()['revalidations'], 1)
+    self.server.departments[id] = dict(department, name='Renamed')
+    try:
+      self.assertEqual(api.get_department(id)['name'], 'Renamed')
+      self.assertEqual((self.server.statuses[304], api.cache_stats()['misses']), (1, 2))
+    finally:
+      self.server.departments[id] = department
+
+  def test_sqlite_cache(self):
+    with tempfile.TemporaryDirectory() as directory:
+      path = os.path.join(directory, 'cache.db')
+      id = next(iter(self.server.groups))
+      first = SqliteCache(path)
+      group = self.server.client(cache=first).get_group(id)
+      first.close()
+      second = SqliteCache(path)
+      try:
+        api = self.server.client(cache=second)
+        self.assertEqual(api.get_group(id), group)
+        self.assertEqual(api.cache_stats()['hits'], 1)
+        self.assertEqual(self.server.requests[('GET', '/groups/{id}')], 1)
+        self.assertEqual(len(second), 1)
+      finally:
+        second.close()
+
+  def test_metrics(self):
+    metrics = Metrics()
+    api = self.server.client(metrics=metrics)
+    api.get_users(pageSize=10)
+    self.assertEqual(metrics.snapshot()[('/users', 'GET')]['count'], 1)
+
+  def test_metrics_retries_and_waits(self):
+    metrics = Metrics(buckets=(0.5, 60))
+    kinds = collections.Counter()
+    metrics.add_listener(lambda event: kinds.update([event.kind]))
+    api = self.server.client(metrics=metrics, rate_limiter=RateLimiter([RateLimit('GET', None, 5, 1)]))
+    api.get_status()
+    self.server.expire_sessions()
+    api.get_status()
+    self.server.reset_counters()
+    self.server.throttle_every = 2
+    for _ in range(3):
+      api.get_users(pageSize=10)
+    snapshot = metrics.snapshot()
+    self.assertEqual(snapshot['retries'], {('get_status', 'session'): 1, ('get_users', 'throttle'): 2})
+    status, users = snapshot[('/status', 'GET')], snapshot[('/users', 'GET')]
+    self.assertEqual((status['statuses'], status['unauthorized']), ({200: 2, 401: 1}, 1))
+    self.assertEqual((users['statuses'], users['throttled'], users['errors']), ({200: 3, 429: 2}, 2, 2))
+    self.assertGreater(users['throttle_wait'], 0)
+    self.assertGreater(users['rate_limit_wait'], 0)
+    self.assertEqual(users['latency_buckets'], {0.5: 5, 60: 0, float('inf'): 0})
+    self.assertEqual((kinds['request'], kinds['retry'], kinds['throttle_wait']), (10, 3, 2))
+    lines = metrics.to_prometheus().splitlines()
+    self.assertIn('zia_client_responses_total{endpoint="/users",method="GET",status="429"} 2', lines)
+    self.assertIn('zia_client_responses_total{endpoint="/status",method="GET",status="401"} 1', lines)
+    self.assertIn('zia_client_request_duration_seconds_bucket{endpoint="/users",method="GET",le="+Inf"} 5', lines)
+    self.assertIn('zia_client_request_duration_seconds_count{endpoint="/users",method="GET"} 5', lines)
+    self.assertIn('zia_client_retries_total{operation="get_users",reason="throttle"} 2', lines)
+    self.assertIn('# TYPE zia_client_throttle_wait_seconds_total counter', lines)
+
+  def test_pull_changes(self):
+    server = MockZiaServer(users=100, locations=4).start()
+    try:
+      api = server.client()
+      changes = api.pull_changes()
+      self.assertEqual(len(changes.users.added), 100)
+      user = api.get_users(pageSize=1)[0]
+      user['comments'] = 'changed'
+      api.update_user(user['id'], user)
+      changes = api.pull_changes(changes.state)
+      self.assertEqual([changed['id'] for changed in changes.users.changed], [user['id']])
+      self.assertFalse(changes.users.added or changes.users.removed)
+      # a pull_all_user_data() baseline has no locations, they become a fresh baseline
+      changes = api.pull_changes(api.pull_all_user_data())
+      self.assertEqual(changes.baselined, ['locations'])
+      self.assertFalse(changes)
+      self.assertEqual(len(changes.state['locations']), 4)
+      changes = api.pull_changes(changes.state)
+      self.assertEqual(changes.baselined, [])
+      self.assertFalse(changes)
+    finally:
+      server.stop()
+
+  def test_pull_changes_compact_baseline(self):
+    server = MockZiaServer(users=100, locations=0).start()
+    try:
+      api = server.client()
+      changes = api.pull_changes(api.pull_all_user_data(compact=True))
+      self.assertFalse(changes)
+      self.assertEqual(changes.state.counts(), api.pull_changes(api.pull_all_user_data()).state.counts())
+    finally:
+      server.stop()
+
+  def test_bulk_sync_users(self):
+    server = MockZiaServer(users=20, locations=0).start()
+    try:
+      api = server.client(activation=ActivationCoordinator(debounce=0))
+      desired = api.get_users(pageSize=10)
+      desired[0]['comments'] = 'updated'
+      desired.append({'name': 'New User', 'email': 'new.user@example.com', 'password': 'Passw0rd!'})
+      report = api.bulk_sync_users(desired, delete_missing=True)
+      self.assertTrue(report.ok)
+      summary = report.summary()
+      self.assertEqual(summary['create']['ok'], 1)
+      self.assertEqual(summary['update']['ok'], 1)
+      self.assertEqual(summary['delete']['ok'], 10)
+      self.assertEqual(len(api.get_users()), 11)
+      self.assertEqual(server.activations, 1)
+    finally:
+      server.stop()
+
+  def test_request_activation(self):
+    server = MockZiaServer(users=10, locations=0, activation_delay=0.3).start()
+    try:
+      api = server.client(activation=ActivationCoordinator(debounce=0.2, poll_interval=0.1))
+      api.login()
+      with ThreadPoolExecutor(max_workers=8) as executor:
+        statuses = list(executor.map(lambda i: api.request_activation(), range(8)))
+      self.assertEqual(statuses, [{'status': 'ACTIVE'}] * 8)
+      self.assertEqual(server.activations, 1)
+      self.assertEqual(api.activation.stats()['requests'], 8)
+    finally:
+      server.stop()
+
+  def test_activation_per_tenant(self):
+    other = MockZiaServer(users=10, locations=0).start()
+    server = MockZiaServer(users=10, locations=0).start()
+    try:
+      coordinator = ActivationCoordinator(debounce=0.2, poll_interval=0.1)
+      clients = [server.client(activation=coordinator), other.client(activation=coordinator)]
+      with ThreadPoolExecutor(max_workers=4) as executor:
+        statuses = list(executor.map(lambda i: clients[i % 2].request_activation(), range(4)))
+      self.assertEqual(statuses, [{'status': 'ACTIVE'}] * 4)
+      # one activation per tenant, each with its own client
+      self.assertEqual((server.activations, other.activations), (1, 1))
+    finally:
+      server.stop()
+      other.stop()
+
+  def test_activation_pending(self):
+    server = MockZiaServer(users=10, locations=0, activation_delay=0.3).start()
+    try:
+      api = server.client(activation=ActivationCoordinator(debounce=0, poll_interval=0.1))
+      future = api.request_activation(wait=False)
+      while server.activations == 0:
+        time.sleep(0.01)
+      user = next(iter(server.users.values()))
+      api.update_user(user['id'], dict(user, comments='changed during activation'))
+      with self.assertRaises(ActivationPending) as raised:
+        future.result(5)
+      self.assertEqual(raised.exception.status, {'status': 'PENDING'})
+    finally:
+      server.stop()
+
+  def test_retry_policy(self):
+    server = MockZiaServer(users=10, locations=0).start()
+    try:
+      api = server.client(retry_policy=RetryPolicy(tries=3, base_delay=0.01, max_delay=0.05, budget=RetryBudget()))
+      api.login()
+      server.error_rate = 1.0
+      with self.assertRaises(Exception):
+        api.get_user(5000000)
+      self.assertEqual(server.requests[('GET', '/users/{id}')], 3)
+      with self.assertRaises(Exception):
+        api.add_user({'name': 'New User', 'email': 'new.user@example.com'})
+      self.assertEqual(server.requests[('POST', '/users')], 1)
+      server.error_rate = 0.0
+      with self.assertRaises(Exception):
+        api.get_user(1)
+      self.assertEqual(server.requests[('GET', '/users/{id}')], 4)
+    finally:
+      server.stop()
+
+  def test_retry_budget_per_client(self):
+    failing = MockZiaServer(users=10, locations=0, error_rate=1.0).start()
+    try:
+      broken = failing.client(retry_policy=RetryPolicy(base_delay=0.001, max_delay=0.001))
+      healthy = self.server.client()
+      self.assertIsNot(broken.retry_policy.budget, healthy.retry_policy.budget)
+      for _ in range(10):
+        with self.assertRaises(Exception):
+          broken.get_status()
+      # the outage spent only the failing client's retries
+      self.assertGreater(broken.retry_policy.budget.exhausted, 0)
+      self.assertEqual(healthy.retry_policy.budget.tokens, healthy.retry_policy.budget.reserve)
+    finally:
+      failing.stop()
+
+  def test_tenant_pool(self):
+    other = MockZiaServer(users=10, locations=0).start()
+    try:
+      tenants = [
+        {'name': 'first', 'cloud': self.server.cloud, 'username': 'admin@example.com', 'password': 'password',
+         'apikey': 'abcdefghijklmnop', 'rate_limiter': RateLimiter(())},
+        {'name': 'second', 'cloud': other.cloud, 'username': 'admin@example.com', 'password': 'password',
+         'apikey': 'abcdefghijklmnop', 'rate_limiter': RateLimiter(())},
+        {'name': 'invalid', 'cloud': other.cloud, 'username': 'other@example.com', 'password': 'wrong',
+         'apikey': 'abcdefghijklmnop', 'rate_limiter': RateLimiter(())},
+      ]
+      with TenantPool(tenants) as pool:
+        results = pool.run(lambda api: len(list(api.iter_users())))
+        self.assertEqual(dict(results.succeeded()), {'first': 2500, 'second': 10})
+        self.assertEqual(list(results.failed()), ['invalid'])
+        self.assertFalse(results.ok)
+    finally:
+      other.stop()
+
+  def test_tenant_pool_processes(self):
+    tenants = [{'name': name, 'cloud': self.server.cloud, 'username': 'admin@example.com', 'password': 'password',
+                'apikey': 'abcdefghijklmnop', 'page_size': 1000} for name in ('first', 'second')]
+    with TenantPool(tenants, processes=True) as pool:
+      results = pool.run('get_status')
+      self.assertTrue(results.ok)
+    # every worker logged its own session out again
+    self.assertEqual(self.server.requests[('POST', '/authenticatedSession')], 2)
+    self.assertEqual(self.server.requests[('DELETE', '/authenticatedSession')], 2)
+
+  def test_export(self):
+    with tempfile.TemporaryDirectory() as directory:
+      counts = self.api.export(directory, format='csv', compression='gzip')
+      self.assertEqual(counts, {'users': 2500, 'departments': 20, 'groups': 30, 'locations': 12, 'sublocations': 18})
+      self.assertFalse(os.path.exists(os.path.join(directory, STATE_FILE)))
+      with gzip.open(os.path.join(directory, 'users.csv.gz'), 'rt', newline='') as f:
+        rows = list(csv.DictReader(f))
+      self.assertEqual(len(rows), 2500)
+      user = self.server.users[int(rows[0]['id'])]
+      self.assertEqual(rows[0]['department.name'], user['department']['name'])
+      self.assertEqual(rows[0]['groups.id'], ';'.join(str(group['id']) for group in user['groups']))
+
+  def test_export_resume(self):
+    api = self.server.client(concurrency=1)
+    with tempfile.TemporaryDirectory() as directory:
+      exporter = Exporter(api, directory, kinds=('users',), pageSize=500, compression='gzip')
+      pages = exporter._units
+      def interrupted(kind, start):
+        for unit in pages(kind, start):
+          if unit[0] == 3:
+            raise KeyboardInterrupt
+          yield unit
+      exporter._units = interrupted
+      with self.assertRaises(KeyboardInterrupt):
+        exporter.run()
+      self.server.reset_counters()
+      self.assertEqual(api.export(directory, kinds=('users',), pageSize=500, compression='gzip'), {'users': 2500})
+      with gzip.open(os.path.join(directory, 'users.ndjson.gz')) as f:
+        ids = [json.loads(line)['id'] for line in f]
+      self.assertEqual(sorted(ids), sorted(self.server.users))
+      # pages 3 to 5 and the empty page 6, pages 1 and 2 are not fetched again
+      self.assertEqual(self.server.requests[('GET', '/users')], 4)
+
+if __name__ == '__main__':
+  unittest.main()
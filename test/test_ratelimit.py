@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+import os
+import json
+import time
+import tempfile
+import unittest
+
+from zscalertools.ratelimit import RateLimit, RateLimiter, endpoint
+from zscalertools.zia import ZiaThrottleException, _retry_after
+
+class TestRateLimiter(unittest.TestCase):
+  """
+  Offline checks of the client-side token buckets, hourly caps and Retry-After parsing
+  """
+
+  def test_pacing(self):
+    limiter = RateLimiter([RateLimit('GET', None, 20, 1)])
+    started = time.time()
+    for _ in range(10):
+      limiter.acquire('GET', '/users')
+    # the first call uses the burst token, the other nine are paced at 20/s
+    self.assertAlmostEqual(time.time() - started, 9 / 20.0, delta=0.15)
+
+  def test_endpoint_and_method_keys(self):
+    limiter = RateLimiter([RateLimit('GET', '/users/{id}', 1, 10), RateLimit('GET', None, 100, 1)])
+    self.assertEqual(endpoint('/users/1234?page=2'), '/users/{id}')
+    self.assertEqual(limiter.reserve('GET', '/users/1'), 0)
+    # the endpoint bucket covers every id, the method bucket every GET
+    self.assertGreater(limiter.reserve('GET', '/users/2'), 9)
+    self.assertLess(limiter.reserve('GET', '/groups'), 0.1)
+    self.assertEqual(limiter.reserve('POST', '/users/3'), 0)
+
+  def test_hourly_cap(self):
+    limiter = RateLimiter([RateLimit('POST', None, 1, 1), RateLimit('POST', '/users', 50, 3600)])
+    # the cap does not pace, the per-method bucket does
+    delays = [limiter.reserve('POST', '/users') for _ in range(50)]
+    self.assertAlmostEqual(delays[-1], 49, delta=0.5)
+    capped = RateLimiter([RateLimit('POST', '/users', 50, 3600)])
+    self.assertEqual([capped.reserve('POST', '/users') for _ in range(50)], [0] * 50)
+    self.assertGreater(capped.reserve('POST', '/users'), 3590)
+    self.assertEqual(capped.reserve('POST', '/departments'), 0)
+
+  def test_hourly_cap_shared(self):
+    with tempfile.TemporaryDirectory() as directory:
+      lock_file = os.path.join(directory, 'limits.json')
+      limits = [RateLimit('POST', None, 3, 3600)]
+      first, second = RateLimiter(limits, lock_file=lock_file), RateLimiter(limits, lock_file=lock_file)
+      self.assertEqual([first.reserve('POST', '/users'), second.reserve('POST', '/users'), first.reserve('POST', '/users')], [0] * 3)
+      self.assertGreater(second.reserve('POST', '/users'), 3590)
+
+  def test_disabled(self):
+    limiter = RateLimiter(())
+    self.assertEqual([limiter.reserve('GET', '/users') for _ in range(5)], [0] * 5)
+
+  def test_lock_file_shared(self):
+    with tempfile.TemporaryDirectory() as directory:
+      lock_file = os.path.join(directory, 'limits.json')
+      limits = [RateLimit('POST', None, 1, 10)]
+      first, second = RateLimiter(limits, lock_file=lock_file), RateLimiter(limits, lock_file=lock_file)
+      self.assertEqual(first.reserve('POST', '/users'), 0)
+      self.assertGreater(second.reserve('POST', '/users'), 9)
+      self.assertEqual(os.stat(lock_file).st_mode & 0o777, 0o600)
+
+  def test_retry_after(self):
+    self.assertEqual(_retry_after(ZiaThrottleException('{}')), 2)
+    self.assertEqual(_retry_after(ZiaThrottleException('not json')), 2)
+    self.assertEqual(_retry_after(ZiaThrottleException('{}', '5')), 6)
+    body = json.dumps({'message': 'Rate Limit exceeded', 'Retry-After': '12 seconds'})
+    self.assertEqual(_retry_after(ZiaThrottleException(body)), 13)
+    # the header wins over the body
+    self.assertEqual(_retry_after(ZiaThrottleException(body, '3')), 4)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+
+import unittest
+
+from zscalertools.delta import record_hash
+from zscalertools.serializer import get_serializer, available
+
+RECORDS = [
+  {'id': 1, 'name': 'Jane', 'adminUser': False, 'comments': None},
+  {'name': 'Zoë 日本 😀', 'b': [3, 2, 1], 'a': {'y': 1, 'x': '/path\\"quoted"\n\t\x01'}},
+  {'id': 2, 'large': 1e16, 'small': 1.5e-07, 'tenth': 0.1, 'third': 1 / 3.0, 'zero': -0.0, 'whole': 2.0},
+  {'id': 3, 'nan': float('nan'), 'inf': float('inf'), 'ninf': float('-inf')},
+  {'id': 4, 'nested': [{'weight': 12.5e20}, [1e-300]], 'big': 2 ** 63 - 1, 'negative': -2 ** 63},
+  {'id': 5, 'wide': 2 ** 70},
+]
+
+class TestSerializer(unittest.TestCase):
+  """
+  Every installed JSON backend must agree on canonical() so delta state files move between hosts
+  """
+
+  def test_canonical_across_backends(self):
+    reference = get_serializer('json')
+    for name in available():
+      serializer = get_serializer(name)
+      for record in RECORDS:
+        self.assertEqual(serializer.canonical(record), reference.canonical(record), (name, record))
+        self.assertEqual(record_hash(record, serializer), record_hash(record, reference))
+
+  def test_canonical_key_order(self):
+    for name in available():
+      serializer = get_serializer(name)
+      self.assertEqual(serializer.canonical({'b': 1, 'a': 2.5}), serializer.canonical({'a': 2.5, 'b': 1}))
+
+  def test_round_trip(self):
+    record = RECORDS[1]
+    for name in available():
+      serializer = get_serializer(name)
+      self.assertEqual(serializer.loads(serializer.dumps(record)), record)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+import unittest
+
+from zscalertools.models import UserData
+from zscalertools.snapshot import Snapshot
+
+from test.mock_zia import MockZiaServer
+
+DEPARTMENTS = [{'id': 1, 'name': 'Finance'}, {'id': 2, 'name': 'Engineering'}]
+GROUPS = [{'id': 10, 'name': 'VPN Users'}, {'id': 11, 'name': 'Admins'}]
+USERS = [
+  {'id': 100, 'name': 'Jane', 'email': 'Jane@Example.com', 'department': DEPARTMENTS[0], 'groups': [GROUPS[0]]},
+  {'id': 101, 'name': 'John', 'email': 'john@example.com', 'department': DEPARTMENTS[0], 'groups': [GROUPS[1]]},
+  {'id': 102, 'name': 'Ada', 'email': 'ada@example.com', 'department': DEPARTMENTS[1], 'groups': GROUPS},
+  {'id': 103, 'name': 'Nobody', 'email': 'nobody@example.com'},
+]
+LOCATIONS = [
+  {'id': 1000, 'name': 'HQ', 'ipAddresses': ['10.0.0.0-10.0.255.255', '2001:db8::/32']},
+  {'id': 1001, 'name': 'HQ - Floor 1', 'parentId': 1000, 'ipAddresses': ['10.0.1.0/24']},
+  {'id': 1002, 'name': 'HQ - Printer', 'parentId': 1000, 'ipAddresses': ['10.0.1.5']},
+  {'id': 1003, 'name': 'Branch', 'ipAddresses': ['192.168.0.1', 'not an address']},
+]
+
+class TestSnapshot(unittest.TestCase):
+  """
+  Offline checks of the indexed SQLite snapshot
+  """
+
+  def setUp(self):
+    self.snapshot = Snapshot().load(USERS, DEPARTMENTS, GROUPS, LOCATIONS)
+
+  def tearDown(self):
+    self.snapshot.close()
+
+  def ids(self, records):
+    return [record['id'] for record in records]
+
+  def test_find_users(self):
+    self.assertEqual(self.ids(self.snapshot.find_users(dept='Finance')), [100, 101])
+    self.assertEqual(self.ids(self.snapshot.find_users(dept='Finance', group='VPN Users')), [100])
+    self.assertEqual(self.ids(self.snapshot.find_users(dept=2, group=11)), [102])
+    self.assertEqual(self.snapshot.find_users(dept='Finance', group='Missing'), [])
+    self.assertEqual(self.ids(self.snapshot.find_users(name='JOHN')), [101])
+
+  def test_user_by_email(self):
+    self.assertEqual(self.snapshot.user_by_email('jane@example.com')['id'], 100)
+    self.assertEqual(self.snapshot.user_by_email('ADA@EXAMPLE.COM')['id'], 102)
+    self.assertIsNone(self.snapshot.user_by_email('missing@example.com'))
+    self.assertEqual(self.ids(self.snapshot.user_groups(102)), [10, 11])
+
+  def test_locations_by_ip(self):
+    # most specific range first
+    self.assertEqual(self.ids(self.snapshot.locations_by_ip('10.0.1.5')), [1002, 1001, 1000])
+    self.assertEqual(self.ids(self.snapshot.locations_by_ip('10.0.1.6')), [1001, 1000])
+    self.assertEqual(self.ids(self.snapshot.locations_by_ip('10.0.200.1')), [1000])
+    self.assertEqual(self.ids(self.snapshot.locations_by_ip('192.168.0.1')), [1003])
+    self.assertEqual(self.ids(self.snapshot.locations_by_ip('2001:db8::1')), [1000])
+    self.assertEqual(self.snapshot.locations_by_ip('2001:db9::1'), [])
+    self.assertEqual(self.snapshot.locations_by_ip('10.1.0.0'), [])
+    self.assertEqual(self.ids(self.snapshot.sublocations(1000)), [1001, 1002])
+
+  def test_load_compact(self):
+    with Snapshot() as snapshot:
+      snapshot.load(*UserData.from_records(USERS, DEPARTMENTS, GROUPS))
+      self.assertEqual(snapshot.counts(), {'users': 4, 'departments': 2, 'groups': 2, 'locations': 0})
+      self.assertEqual(snapshot.user(102), USERS[2])
+      self.assertEqual(snapshot.group(10), GROUPS[0])
+      self.assertEqual(self.ids(snapshot.find_users(dept='Finance', group='VPN Users')), [100])
+    with MockZiaServer(users=50, departments=5, groups=5, locations=0) as server, Snapshot() as snapshot:
+      snapshot.load(*server.client().pull_all_user_data(compact=True))
+      self.assertEqual(snapshot.counts()['users'], 50)
+
+  def test_refresh_replaces_data(self):
+    with MockZiaServer(users=50, departments=5, groups=5, locations=4) as server:
+      api = server.client()
+      with Snapshot() as snapshot:
+        snapshot.refresh(api)
+        self.assertEqual(snapshot.counts(), {'users': 50, 'departments': 5, 'groups': 5, 'locations': 10})
+        removed = next(iter(server.users))
+        del server.users[removed]
+        del server.locations[next(id for id, location in server.locations.items() if 'parentId' in location)]
+        first = snapshot.refreshed
+        snapshot.refresh(api)
+        self.assertEqual(snapshot.counts(), {'users': 49, 'departments': 5, 'groups': 5, 'locations': 9})
+        self.assertIsNone(snapshot.user(removed))
+        self.assertGreaterEqual(snapshot.refreshed, first)
+
+if __name__ == '__main__':
+  unittest.main()
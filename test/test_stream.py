@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+import json
+import unittest
+
+from zscalertools.zia import _iter_json_array
+
+BODY = '[12.5, 3,1e5 ,4.5e10,\n-0.25E-3, true, null, "a,]b", {"id": 1, "v": [1.5, 2]}, [7e2], false, 10]'
+
+class FakeResponse:
+  """
+  Stands in for a streamed requests.Response, cutting the body at every chunk_size bytes
+  """
+
+  def __init__(self, body):
+    self.body = body.encode('utf-8')
+    self.encoding = 'utf-8'
+    self.closed = False
+
+  def iter_content(self, chunk_size):
+    for start in range(0, len(self.body), chunk_size):
+      yield self.body[start:start + chunk_size]
+
+  def close(self):
+    self.closed = True
+
+class TestIterJsonArray(unittest.TestCase):
+  """
+  Offline checks of the incremental page decoder used by stream=True
+  """
+
+  def test_chunk_boundaries(self):
+    expected = json.loads(BODY)
+    for chunk_size in range(1, 8):
+      response = FakeResponse(BODY)
+      self.assertEqual(list(_iter_json_array(response, chunk_size=chunk_size)), expected, chunk_size)
+      self.assertTrue(response.closed)
+
+  def test_split_numbers(self):
+    for body in ('[12.5, 3]', '[1e5]', '[4.5e10]', '[1]', '[]', '  [ ]  '):
+      for chunk_size in range(1, 4):
+        self.assertEqual(list(_iter_json_array(FakeResponse(body), chunk_size=chunk_size)), json.loads(body), (body, chunk_size))
+
+  def test_invalid(self):
+    for body in ('{"id": 1}', '[1, 2', '[12.]', ''):
+      with self.assertRaises(ValueError):
+        list(_iter_json_array(FakeResponse(body), chunk_size=3))
+
+if __name__ == '__main__':
+  unittest.main()
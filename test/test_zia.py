@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 from zscalertools import zia
+from zscalertools.cache import MemoryCache
 import logging
 import yaml
 import unittest
@@ -8,7 +9,10 @@ from pathlib import Path
 
 logging.basicConfig(level=logging.DEBUG)
 
-stream = open(Path(__file__).parent / 'test_api.yml', 'r')
+config_file = Path(__file__).parent / 'test_api.yml'
+if not config_file.exists():
+  raise unittest.SkipTest("{} not found, live ZIA tests skipped".format(config_file))
+stream = open(config_file, 'r')
 config = yaml.load(stream, yaml.SafeLoader)
 stream.close()
 
@@ -22,10 +26,20 @@ class TestSequenceFunctions(unittest.TestCase):
     logout = self.api.logout()
     self.assertEqual(logout['status'], 'success')
   
+  def test_iter_users(self):
+    users = list(self.api.iter_users(pageSize=100))
+    streamed_users = list(self.api.iter_users(pageSize=100, stream=True))
+    self.assertEqual(len(users), len(streamed_users))
+
   def test_locations_lite(self):
     locations_lite = self.api.get_locations_lite()
     self.assertTrue('id', locations_lite)
 
+  def test_cached_locations_lite(self):
+    api = zia.api(config['url'], config['username'], config['password'], config['cloud_api_key'], cache=MemoryCache())
+    self.assertEqual(api.get_locations_lite(), api.get_locations_lite())
+    self.assertEqual(api.cache_stats()['hits'], 1)
+
   def test_locations(self):
     locations = self.api.get_locations()
     self.assertTrue('id', locations)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+
+import time
+import threading
+import collections
+from concurrent.futures import Future
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# /status value once every change has been activated
+DONE_STATUS = 'ACTIVE'
+
+# /status value when changes are waiting to be activated
+PENDING_STATUS = 'PENDING'
+
+class ActivationTimeout(Exception):
+  pass
+
+class ActivationPending(Exception):
+  """
+  The activation finished but /status reports PENDING: newer changes, made
+  after the activation was issued, are still waiting to be activated
+
+  Attributes
+  ----------
+  status : dict
+    the /status response
+  """
+
+  def __init__(self, status):
+    super().__init__("Activation finished but newer changes are pending - {}".format(status))
+    self.status = status
+
+class _Batch:
+  __slots__ = ('future', 'api', 'first_request', 'last_request')
+
+  def __init__(self, api, now):
+    self.future = Future()
+    self.api = api
+    self.first_request = now
+    self.last_request = now
+
+class ActivationCoordinator:
+  """
+  Coalesces activation requests from many threads into one /status/activate
+
+  Each request() joins the pending batch of its tenant and admin. Once no
+  request has arrived for `debounce` seconds (or `max_delay` after the
+  first one) a single activation is issued, /status is polled with a
+  growing interval while it reports INPROGRESS, and every request of the
+  batch is resolved at once with the final ACTIVE status. If /status
+  reports PENDING instead, the batch fails with ActivationPending: the
+  activation ran, but changes made meanwhile are still pending. Requests
+  that arrive while an activation is in flight form the next batch, since
+  their changes may not be included. Clients with the same cloud and
+  username share batches; other clients sharing the coordinator get
+  batches of their own, activated with their own credentials.
+
+    coordinator = ActivationCoordinator(debounce=5)
+    api = zia.api(cloud, username, password, apikey, activation=coordinator)
+    api.update_user(id, user)
+    api.request_activation()                # blocks until ACTIVE
+    future = api.request_activation(wait=False)
+
+  Attributes
+  ----------
+  debounce : float
+    quiet period in seconds before a batch is activated
+  max_delay : float
+    longest a request waits for the batch to close, however busy it is
+  poll_interval : float
+    first delay in seconds between /status polls
+  poll_backoff : float
+    factor the poll delay grows by after every INPROGRESS answer
+  max_poll_interval : float
+    cap on the poll delay
+  timeout : float
+    seconds after the activation call before the batch fails with ActivationTimeout
+  """
+
+  def __init__(self, debounce=2.0, max_delay=30.0, poll_interval=0.5, poll_backoff=1.5, max_poll_interval=10.0,
+               timeout=600.0):
+    self.debounce = debounce
+    self.max_delay = max_delay
+    self.poll_interval = poll_interval
+    self.poll_backoff = poll_backoff
+    self.max_poll_interval = max_poll_interval
+    self.timeout = timeout
+    self._condition = threading.Condition()
+    self._thread = None
+    self._batches = collections.OrderedDict()
+    self._flush = False
+    self._closed = False
+    self._stats = {'requests': 0, 'activations': 0, 'polls': 0}
+
+  def request(self, api, wait=True, timeout=None):
+    """
+    Adds a request to the pending batch of `api`'s cloud and username, using
+    `api` for the activation call. Returns the final /status response, or
+    with wait=False a concurrent.futures.Future that resolves to it.
+    """
+    with self._condition:
+      if self._closed:
+        raise RuntimeError("Activation coordinator is closed")
+      now = time.time()
+      key = (api.url, api.username)
+      batch = self._batches.get(key)
+      if batch is None:
+        batch = self._batches[key] = _Batch(api, now)
+      batch.last_request = now
+      batch.api = api
+      self._stats['requests'] += 1
+      if self._thread is None:
+        self._thread = threading.Thread(target=self._run, name='zia-activation', daemon=True)
+        self._thread.start()
+      self._condition.notify_all()
+    if not wait:
+      return batch.future
+    return batch.future.result(timeout)
+
+  def flush(self):
+    """
+    Activates the pending batches now instead of waiting for the debounce period
+    """
+    with self._condition:
+      self._flush = True
+      self._condition.notify_all()
+
+  def close(self):
+    """
+    Activates anything still pending and stops the worker thread
+    """
+    with self._condition:
+      self._closed = True
+      self._condition.notify_all()
+      thread = self._thread
+    if thread is not None:
+      thread.join()
+
+  def stats(self):
+    """
+    Returns counts of requests, activation calls and /status polls
+    """
+    with self._condition:
+      return dict(self._stats)
+
+  def _ready_at(self, batch):
+    return min(batch.last_request + self.debounce, batch.first_request + self.max_delay)
+
+  def _next_batch(self):
+    with self._condition:
+      while True:
+        if not self._batches:
+          self._flush = False
+          if self._closed:
+            return None
+          self._condition.wait()
+          continue
+        key = min(self._batches, key=lambda key: self._ready_at(self._batches[key]))
+        ready_at = self._ready_at(self._batches[key])
+        now = time.time()
+        if self._flush or self._closed or now >= ready_at:
+          return self._batches.pop(key)
+        self._condition.wait(ready_at - now)
+
+  def _run(self):
+    while True:
+      batch = self._next_batch()
+      if batch is None:
+        return
+      try:
+        batch.future.set_result(self._activate(batch.api))
+      except Exception as e:
+        logger.error("Activation Coordinator - activation failed - {}".format(e))
+        batch.future.set_exception(e)
+
+  def _activate(self, api):
+    logger.info("Zscaler Helper - Activating changes")
+    with self._condition:
+      self._stats['activations'] += 1
+    status = api.activate_status()
+    deadline = time.time() + self.timeout
+    delay = self.poll_interval
+    while not (isinstance(status, dict) and status.get('status') == DONE_STATUS):
+      if isinstance(status, dict) and status.get('status') == PENDING_STATUS:
+        raise ActivationPending(status)
+      if time.time() + delay > deadline:
+        raise ActivationTimeout("Activation still {} after {} seconds".format(
+          status.get('status') if isinstance(status, dict) else status, self.timeout))
+      time.sleep(delay)
+      delay = min(delay * self.poll_backoff, self.max_poll_interval)
+      with self._condition:
+        self._stats['polls'] += 1
+      status = api.get_status()
+    logger.info("Zscaler Helper - Activation Complete - {}".format(status))
+    return status
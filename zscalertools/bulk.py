@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+import collections
+
+USER_BULK_DELETE_LIMIT = 500
+LOCATION_BULK_DELETE_LIMIT = 100
+
+# fields that are write-only or assigned by ZIA and never compared
+_IGNORED_USER_FIELDS = ('id', 'password', 'adminUser', 'isNonEditable', 'deleted')
+
+def chunks(items, size):
+  """
+  Splits a list into consecutive lists of at most `size` items
+  """
+  items = list(items)
+  for i in range(0, len(items), size):
+    yield items[i:i + size]
+
+def user_key(user):
+  """
+  Key used to match a desired user to an existing ZIA user, the email
+  address (case insensitive) or the login name when no email is set
+  """
+  return (user.get('email') or user.get('name') or '').lower()
+
+def _normalize(value):
+  if isinstance(value, dict) and 'id' in value:
+    return value['id']
+  if isinstance(value, list):
+    return sorted(_normalize(item) for item in value)
+  return value
+
+def user_changes(current, desired):
+  """
+  Returns the fields of `desired` whose value differs from `current`, nested
+  department/groups objects are compared by id only
+  """
+  return [field for field, value in desired.items()
+          if field not in _IGNORED_USER_FIELDS and _normalize(value) != _normalize(current.get(field))]
+
+class BulkResult:
+  """
+  Outcome of one record in a bulk operation
+
+  Attributes
+  ----------
+  action : str
+    'create', 'update', 'delete' or 'activate'
+  key : str
+    the user key (email/name) or the ID the action applied to
+  id : int
+    ZIA ID of the record, None for a failed create
+  response : object
+    decoded API response for successful actions
+  error : Exception
+    the exception raised for failed actions
+  """
+  __slots__ = ('action', 'key', 'id', 'response', 'error')
+
+  def __init__(self, action, key, id=None, response=None, error=None):
+    self.action = action
+    self.key = key
+    self.id = id
+    self.response = response
+    self.error = error
+
+  @property
+  def ok(self):
+    return self.error is None
+
+  def __repr__(self):
+    return "BulkResult({!r}, {!r}, id={!r}, ok={!r})".format(self.action, self.key, self.id, self.ok)
+
+class BulkSyncReport:
+  """
+  Per record report returned by api.bulk_sync_users()
+
+  Attributes
+  ----------
+  results : list of BulkResult
+    one entry per create, update and delete that was attempted
+  unchanged : list
+    keys of desired users that already matched ZIA
+  activation : BulkResult
+    final /status of the request_activation() call, None when nothing was activated
+  """
+
+  def __init__(self):
+    self.results = []
+    self.unchanged = []
+    self.activation = None
+
+  def add(self, result):
+    self.results.append(result)
+    return result
+
+  @property
+  def succeeded(self):
+    return [result for result in self.results if result.ok]
+
+  @property
+  def failed(self):
+    return [result for result in self.results if not result.ok]
+
+  @property
+  def ok(self):
+    return not self.failed and (self.activation is None or self.activation.ok)
+
+  def summary(self):
+    """
+    Returns counts per action, e.g. {'create': {'ok': 10, 'failed': 1}, 'unchanged': 200}
+    """
+    counts = collections.OrderedDict()
+    for result in self.results:
+      action = counts.setdefault(result.action, {'ok': 0, 'failed': 0})
+      action['ok' if result.ok else 'failed'] += 1
+    counts['unchanged'] = len(self.unchanged)
+    return counts
+
+  def __repr__(self):
+    return "BulkSyncReport({})".format(dict(self.summary()))
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+import copy
+import json
+import time
+import sqlite3
+import threading
+import collections
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+class CacheEntry(collections.namedtuple('CacheEntry', ['value', 'etag', 'stored', 'fresh'])):
+  """
+  A cached response body, its ETag, when it was stored and whether it is still within the TTL
+  """
+  __slots__ = ()
+
+class _CacheStats:
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.reset()
+
+  def reset(self):
+    self.hits = 0
+    self.misses = 0
+    self.revalidations = 0
+    self.stores = 0
+    self.invalidations = 0
+    self.evictions = 0
+
+  def incr(self, name, count=1):
+    with self._lock:
+      setattr(self, name, getattr(self, name) + count)
+
+  def stats(self):
+    with self._lock:
+      lookups = self.hits + self.misses + self.revalidations
+      return {
+        'hits': self.hits,
+        'misses': self.misses,
+        'revalidations': self.revalidations,
+        'stores': self.stores,
+        'invalidations': self.invalidations,
+        'evictions': self.evictions,
+        'hit_ratio': float(self.hits + self.revalidations) / lookups if lookups else 0.0,
+      }
+
+class MemoryCache(_CacheStats):
+  """
+  Thread-safe in-memory LRU response cache with a TTL
+
+  Attributes
+  ----------
+  maxsize : int
+    maximum number of responses kept, the least recently used is evicted first
+  ttl : float
+    seconds a response is served without contacting ZIA, stale entries with
+    an ETag are revalidated with If-None-Match instead of being refetched
+  """
+
+  def __init__(self, maxsize=1024, ttl=300):
+    super().__init__()
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self._entries = collections.OrderedDict()
+    self._entries_lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._entries)
+
+  def get(self, key):
+    with self._entries_lock:
+      entry = self._entries.get(key)
+      if entry is None:
+        return None
+      self._entries.move_to_end(key)
+    value, etag, stored = entry
+    return CacheEntry(copy.deepcopy(value), etag, stored, time.time() - stored < self.ttl)
+
+  def set(self, key, value, etag=None):
+    self.incr('stores')
+    with self._entries_lock:
+      self._entries[key] = (copy.deepcopy(value), etag, time.time())
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.maxsize:
+        self._entries.popitem(last=False)
+        self.incr('evictions')
+
+  def touch(self, key):
+    with self._entries_lock:
+      entry = self._entries.get(key)
+      if entry is not None:
+        self._entries[key] = (entry[0], entry[1], time.time())
+
+  def invalidate(self, match):
+    """
+    Drops every entry whose key satisfies match(key)
+    """
+    with self._entries_lock:
+      keys = [key for key in self._entries if match(key)]
+      for key in keys:
+        del self._entries[key]
+    self.incr('invalidations', len(keys))
+    return len(keys)
+
+  def clear(self):
+    with self._entries_lock:
+      self._entries.clear()
+
+class SqliteCache(_CacheStats):
+  """
+  Response cache persisted to a SQLite database so it survives between runs
+
+  Attributes
+  ----------
+  path : str
+    database file, created when missing
+  ttl : float
+    seconds a response is served without contacting ZIA
+  maxsize : int
+    maximum number of responses kept, the oldest are evicted first (None for unbounded)
+  """
+
+  def __init__(self, path, ttl=300, maxsize=None):
+    super().__init__()
+    self.path = path
+    self.ttl = ttl
+    self.maxsize = maxsize
+    self._conn_lock = threading.Lock()
+    self._conn = sqlite3.connect(path, check_same_thread=False)
+    with self._conn:
+      self._conn.execute("CREATE TABLE IF NOT EXISTS response_cache "
+                         "(key TEXT PRIMARY KEY, value TEXT NOT NULL, etag TEXT, stored REAL NOT NULL)")
+      self._conn.execute("CREATE INDEX IF NOT EXISTS response_cache_stored ON response_cache (stored)")
+
+  def __len__(self):
+    with self._conn_lock:
+      return self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+  def get(self, key):
+    with self._conn_lock:
+      row = self._conn.execute("SELECT value, etag, stored FROM response_cache WHERE key = ?", (key,)).fetchone()
+    if row is None:
+      return None
+    value, etag, stored = row
+    return CacheEntry(json.loads(value), etag, stored, time.time() - stored < self.ttl)
+
+  def set(self, key, value, etag=None):
+    self.incr('stores')
+    with self._conn_lock, self._conn:
+      self._conn.execute("INSERT OR REPLACE INTO response_cache (key, value, etag, stored) VALUES (?, ?, ?, ?)",
+                         (key, json.dumps(value), etag, time.time()))
+      if self.maxsize:
+        evicted = self._conn.execute("DELETE FROM response_cache WHERE key IN (SELECT key FROM response_cache "
+                                     "ORDER BY stored DESC LIMIT -1 OFFSET ?)", (self.maxsize,)).rowcount
+        if evicted > 0:
+          self.incr('evictions', evicted)
+
+  def touch(self, key):
+    with self._conn_lock, self._conn:
+      self._conn.execute("UPDATE response_cache SET stored = ? WHERE key = ?", (time.time(), key))
+
+  def invalidate(self, match):
+    """
+    Drops every entry whose key satisfies match(key)
+    """
+    with self._conn_lock, self._conn:
+      keys = [(key,) for (key,) in self._conn.execute("SELECT key FROM response_cache") if match(key)]
+      self._conn.executemany("DELETE FROM response_cache WHERE key = ?", keys)
+    self.incr('invalidations', len(keys))
+    return len(keys)
+
+  def clear(self):
+    with self._conn_lock, self._conn:
+      self._conn.execute("DELETE FROM response_cache")
+
+  def close(self):
+    self._conn.close()
+
+def cache_scope(url, username):
+  """
+  Key prefix that keeps the entries of one tenant and admin apart from every
+  other client using the same (possibly persisted) cache
+  """
+  return "{}|{}".format(username, url)
+
+def invalidation_match(api_path, scope=''):
+  """
+  Returns a key predicate for the cache entries a write to `api_path` makes
+  stale: the resource itself and everything below it, plus the listings of
+  the collection it belongs to ('/users?...', '/locations/lite'). Writes that
+  do not name a single resource (POST '/users', '/users/bulkDelete') drop the
+  whole collection. Only keys under `scope` are matched.
+  """
+  segments = api_path.split('?', 1)[0].strip('/').split('/')
+  collection = '/' + segments[0]
+  resource = '{}/{}'.format(collection, segments[1]) if len(segments) > 1 and segments[1].isdigit() else None
+
+  def match(key):
+    if not key.startswith(scope):
+      return False
+    path = key[len(scope):].split('?', 1)[0].rstrip('/')
+    if path == collection:
+      return True
+    if not path.startswith(collection + '/'):
+      return False
+    if resource is None or path == resource or path.startswith(resource + '/'):
+      return True
+    return not path[len(collection) + 1:].split('/')[0].isdigit()
+  return match
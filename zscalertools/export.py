@@ -0,0 +1,410 @@
+#!/usr/bin/env python
+
+import os
+import io
+import csv
+import bz2
+import gzip
+import json
+import lzma
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+from . import locations as location_tree
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('ndjson', 'csv', 'parquet')
+
+KINDS = ('users', 'departments', 'groups', 'locations', 'sublocations')
+
+STATE_FILE = '.export-state.json'
+
+EXTRA_COLUMN = '_extra'
+
+_PATHS = {
+  'users': '/users?',
+  'departments': '/departments?',
+  'groups': '/groups?',
+  'locations': '/locations?',
+}
+
+_COMPRESSORS = {
+  None: (lambda data: data, ''),
+  'gzip': (gzip.compress, '.gz'),
+  'bz2': (bz2.compress, '.bz2'),
+  'xz': (lzma.compress, '.xz'),
+}
+
+_PARQUET_COMPRESSION = ('snappy', 'gzip', 'zstd', 'brotli', 'lz4')
+
+def flatten(record, separator='.', list_separator=';'):
+  """
+  Flattens nested objects into scalar columns for CSV/Parquet:
+  {'department': {'id': 1, 'name': 'IT'}} becomes department.id / department.name,
+  a list of objects such as groups becomes groups.id / groups.name holding
+  the joined values ('1;2') and a list of scalars (ipAddresses) is joined.
+  """
+  row = {}
+  _flatten_into(row, None, record, separator, list_separator)
+  return row
+
+def _flatten_into(row, prefix, value, separator, list_separator):
+  if isinstance(value, dict):
+    for key, item in value.items():
+      _flatten_into(row, key if prefix is None else prefix + separator + key, item, separator, list_separator)
+  elif isinstance(value, list):
+    if not value:
+      return
+    if all(isinstance(item, dict) for item in value):
+      keys = []
+      for item in value:
+        keys.extend(key for key in item if key not in keys)
+      for key in keys:
+        row[prefix + separator + key] = list_separator.join(_text(item.get(key)) for item in value)
+    else:
+      row[prefix] = list_separator.join(_text(item) for item in value)
+  else:
+    row[prefix] = value
+
+def _text(value):
+  if value is None:
+    return ''
+  if isinstance(value, (dict, list)):
+    return json.dumps(value, separators=(',', ':'))
+  if isinstance(value, bool):
+    return 'true' if value else 'false'
+  return str(value)
+
+def _column_type(values):
+  values = [value for value in values if value is not None]
+  if values and all(isinstance(value, bool) for value in values):
+    return 'bool'
+  if values and all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+    return 'int'
+  if values and all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+    return 'float'
+  return 'string'
+
+def _matches(value, kind):
+  if value is None:
+    return True
+  if kind == 'bool':
+    return isinstance(value, bool)
+  if kind == 'int':
+    return isinstance(value, int) and not isinstance(value, bool)
+  if kind == 'float':
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+  return isinstance(value, str)
+
+class _FileWriter:
+  """
+  NDJSON/CSV output, one compressed member appended per page so the file can
+  be truncated back to the last completed page and appended to on resume
+  (gzip, bzip2 and xz readers all read concatenated members)
+  """
+
+  def __init__(self, path, compression, state):
+    self.path = path
+    self.compress = _COMPRESSORS[compression][0]
+    self.state = state
+    if state['offset']:
+      with open(path, 'r+b') as f:
+        f.truncate(state['offset'])
+    elif os.path.exists(path):
+      os.remove(path)
+    self.file = open(path, 'ab')
+
+  def write(self, data):
+    if data:
+      self.file.write(self.compress(data))
+    self.file.flush()
+    os.fsync(self.file.fileno())
+    self.state['offset'] = self.file.tell()
+
+  def close(self):
+    self.file.close()
+
+class _NdjsonWriter(_FileWriter):
+
+  def __init__(self, path, compression, state, serializer, flatten_records):
+    super().__init__(path, compression, state)
+    self.serializer = serializer
+    self.flatten_records = flatten_records
+
+  def write_records(self, records):
+    self.write(b''.join(self.serializer.dumps(flatten(record) if self.flatten_records else record) + b'\n'
+                        for record in records))
+
+class _CsvWriter(_FileWriter):
+
+  def write_records(self, records):
+    rows = [flatten(record) for record in records]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if self.state['columns'] is None:
+      columns = []
+      for row in rows:
+        columns.extend(key for key in row if key not in columns)
+      self.state['columns'] = columns + [EXTRA_COLUMN]
+      writer.writerow(self.state['columns'])
+    columns = self.state['columns'][:-1]
+    known = set(columns)
+    for row in rows:
+      extra = {key: value for key, value in row.items() if key not in known}
+      writer.writerow([_csv_value(row.get(column)) for column in columns] +
+                      [json.dumps(extra, separators=(',', ':')) if extra else ''])
+    self.write(buffer.getvalue().encode('utf-8'))
+
+def _csv_value(value):
+  if value is None:
+    return ''
+  if isinstance(value, bool):
+    return 'true' if value else 'false'
+  return value
+
+class _ParquetWriter:
+  """
+  Parquet output as a directory of part files, each part is written to a
+  temporary name and renamed once complete so a resumed run never sees a
+  truncated file
+  """
+
+  def __init__(self, path, compression, state, pages_per_part):
+    try:
+      import pyarrow
+      import pyarrow.parquet
+    except ImportError:
+      raise ImportError("Parquet export requires pyarrow, install it with 'pip install pyarrow'")
+    self.pyarrow = pyarrow
+    self.parquet = pyarrow.parquet
+    self.path = path
+    self.compression = compression or 'snappy'
+    self.state = state
+    self.pages_per_part = pages_per_part
+    self.rows = []
+    self.pages = 0
+    os.makedirs(path, exist_ok=True)
+    for name in os.listdir(path):
+      # parts after the last checkpoint belong to pages that will be fetched again
+      if name.endswith('.tmp') or (name.startswith('part-') and int(name[5:10]) >= state['parts']):
+        os.remove(os.path.join(path, name))
+
+  def _schema(self):
+    types = {'bool': self.pyarrow.bool_(), 'int': self.pyarrow.int64(), 'float': self.pyarrow.float64(),
+             'string': self.pyarrow.string()}
+    return self.pyarrow.schema([(column, types[kind]) for column, kind in self.state['columns']] +
+                               [(EXTRA_COLUMN, self.pyarrow.string())])
+
+  def write_records(self, records):
+    self.rows.extend(flatten(record) for record in records)
+    self.pages += 1
+    return self.pages >= self.pages_per_part
+
+  def flush(self):
+    """
+    Writes the buffered pages as the next part, returns True when a part was written
+    """
+    if not self.rows and self.pages == 0:
+      return False
+    if self.state['columns'] is None:
+      columns = []
+      for row in self.rows:
+        columns.extend(key for key in row if key not in columns)
+      self.state['columns'] = [[column, _column_type([row.get(column) for row in self.rows])] for column in columns]
+    columns = self.state['columns']
+    data = {column: [] for column, kind in columns}
+    extras = []
+    for row in self.rows:
+      extra = {key: value for key, value in row.items() if key not in data}
+      for column, kind in columns:
+        value = row.get(column)
+        if _matches(value, kind):
+          data[column].append(float(value) if kind == 'float' and value is not None else value)
+        else:
+          data[column].append(None)
+          extra[column] = value
+      extras.append(json.dumps(extra, separators=(',', ':')) if extra else None)
+    data[EXTRA_COLUMN] = extras
+    table = self.pyarrow.Table.from_pydict(data, schema=self._schema())
+    name = os.path.join(self.path, 'part-{:05d}.parquet'.format(self.state['parts']))
+    self.parquet.write_table(table, name + '.tmp', compression=self.compression)
+    os.replace(name + '.tmp', name)
+    self.state['parts'] += 1
+    self.rows = []
+    self.pages = 0
+    return True
+
+  def close(self):
+    pass
+
+class Exporter:
+  """
+  Streams tenant data from the paginated API into NDJSON, CSV or Parquet
+
+  Records are written page by page, so memory use does not grow with the
+  tenant. After every page (every part for Parquet) the position is saved
+  to a state file in the output directory; when a run dies, running the
+  same export again truncates the partial page and continues from the
+  next one. The state file is removed once every kind is complete. Pages
+  are numbered, so a tenant that changes between runs can shift records
+  across the resume point.
+
+    exporter = Exporter(api, 'export', format='csv', compression='gzip')
+    exporter.run()          # {'users': 150000, 'departments': 800, ...}
+
+  Attributes
+  ----------
+  api : zia.api
+    client the data is read with
+  directory : str
+    output directory, one <kind>.ndjson / <kind>.csv file or <kind>/ Parquet
+    directory per kind plus the state file while the export is running
+  format : str
+    'ndjson', 'csv' or 'parquet'
+  compression : str
+    'gzip', 'bz2' or 'xz' for NDJSON and CSV; 'snappy' (default), 'gzip',
+    'zstd', 'brotli' or 'lz4' for Parquet; None for none
+  kinds : tuple
+    any of 'users', 'departments', 'groups', 'locations', 'sublocations'
+  flatten : bool
+    flatten nested department/group objects into columns, always on for
+    CSV and Parquet, NDJSON keeps the raw records by default
+  pages_per_part : int
+    pages written to each Parquet part file
+  """
+
+  def __init__(self, api, directory, format='ndjson', compression=None, kinds=KINDS, flatten=None, pageSize=None,
+               pages_per_part=10):
+    if format not in FORMATS:
+      raise ValueError("Unknown export format '{}', expected one of {}".format(format, FORMATS))
+    if format == 'parquet':
+      if compression is not None and compression not in _PARQUET_COMPRESSION:
+        raise ValueError("Unknown Parquet compression '{}', expected one of {}".format(compression, _PARQUET_COMPRESSION))
+    elif compression not in _COMPRESSORS:
+      raise ValueError("Unknown compression '{}', expected one of {}".format(compression, [name for name in _COMPRESSORS if name]))
+    for kind in kinds:
+      if kind not in KINDS:
+        raise ValueError("Unknown export kind '{}', expected one of {}".format(kind, KINDS))
+    self.api = api
+    self.directory = directory
+    self.format = format
+    self.compression = compression
+    self.kinds = tuple(kinds)
+    self.flatten = format != 'ndjson' if flatten is None else flatten
+    self.pageSize = api._page_size(pageSize)
+    self.pages_per_part = pages_per_part
+    self.state_path = os.path.join(directory, STATE_FILE)
+
+  def path(self, kind):
+    if self.format == 'parquet':
+      return os.path.join(self.directory, kind)
+    suffix = _COMPRESSORS[self.compression][1]
+    return os.path.join(self.directory, "{}.{}{}".format(kind, self.format, suffix))
+
+  def _load_state(self, resume):
+    settings = {'format': self.format, 'compression': self.compression, 'flatten': self.flatten, 'pageSize': self.pageSize}
+    if resume and os.path.exists(self.state_path):
+      with open(self.state_path) as f:
+        state = json.load(f)
+      if state['settings'] != settings:
+        raise ValueError("{} was written by an export with different settings {}, remove it to start over".format(
+          self.state_path, state['settings']))
+      logger.info("Zscaler Export - Resuming {}".format(self.directory))
+      return state
+    return {'settings': settings, 'kinds': {}}
+
+  def _save_state(self, state):
+    temp = self.state_path + '.tmp'
+    with open(temp, 'w') as f:
+      json.dump(state, f)
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(temp, self.state_path)
+
+  def _writer(self, kind, kind_state):
+    if self.format == 'parquet':
+      return _ParquetWriter(self.path(kind), self.compression, kind_state, self.pages_per_part)
+    if self.format == 'csv':
+      return _CsvWriter(self.path(kind), self.compression, kind_state)
+    return _NdjsonWriter(self.path(kind), self.compression, kind_state, self.api.serializer, self.flatten)
+
+  def run(self, resume=True):
+    """
+    Exports every kind, returning the number of records written per kind
+    """
+    os.makedirs(self.directory, exist_ok=True)
+    state = self._load_state(resume)
+    counts = {}
+    for kind in self.kinds:
+      kind_state = state['kinds'].setdefault(kind, {'page': 0, 'rows': 0, 'offset': 0, 'parts': 0, 'columns': None,
+                                                    'done': False})
+      if not kind_state['done']:
+        logger.info("Zscaler Export - Exporting {} from page {}".format(kind, kind_state['page'] + 1))
+        self._export(kind, kind_state, state)
+      counts[kind] = kind_state['rows']
+    os.remove(self.state_path)
+    logger.info("Zscaler Export - Complete - {}".format(counts))
+    return counts
+
+  def _units(self, kind, start):
+    """
+    Yields (unit number, records), a unit is a page or, for sublocations, one parent location
+    """
+    if kind != 'sublocations':
+      return self.api._iter_page_lists(_PATHS[kind], pageSize=self.pageSize, start=start)
+    return self._sublocation_units(start)
+
+  def _sublocation_units(self, start):
+    parents = self.api._location_parents_with_children()
+    if parents is None:
+      parents = {location['id'] for location in self.api.iter_locations(pageSize=self.pageSize)
+                 if location_tree.has_children(location)}
+    parent_ids = sorted(parents)[start - 1:]
+    pending = collections.deque()
+    with ThreadPoolExecutor(max_workers=self.api.concurrency) as executor:
+      try:
+        # parents are yielded in order, so the unit number stays a valid resume point,
+        # with at most `concurrency` parents in flight
+        for unit, parent_id in enumerate(parent_ids, start):
+          pending.append((unit, parent_id, executor.submit(self.api._get_all_sublocations, parent_id, self.pageSize)))
+          if len(pending) >= self.api.concurrency:
+            yield self._sublocation_unit(*pending.popleft())
+        while pending:
+          yield self._sublocation_unit(*pending.popleft())
+      finally:
+        for unit, parent_id, future in pending:
+          future.cancel()
+
+  def _sublocation_unit(self, unit, parent_id, future):
+    children = future.result()
+    for child in children:
+      child.setdefault('parentId', parent_id)
+    return unit, children
+
+  def _export(self, kind, kind_state, state):
+    writer = self._writer(kind, kind_state)
+    parquet = self.format == 'parquet'
+    pending_rows = 0
+    try:
+      for unit, records in self._units(kind, kind_state['page'] + 1):
+        if parquet:
+          pending_rows += len(records)
+          if not writer.write_records(records):
+            continue
+          writer.flush()
+          kind_state['rows'] += pending_rows
+          pending_rows = 0
+        else:
+          writer.write_records(records)
+          kind_state['rows'] += len(records)
+        kind_state['page'] = unit
+        self._save_state(state)
+      if parquet and writer.flush():
+        kind_state['rows'] += pending_rows
+      kind_state['done'] = True
+      self._save_state(state)
+    finally:
+      writer.close()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+import collections
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+def parent_ids(locations_lite):
+  """
+  IDs of the parents referenced by /locations/lite?includeSubLocations=true records
+  """
+  return {location['parentId'] for location in locations_lite if location.get('parentId')}
+
+def has_children(location, parents=None):
+  """
+  Whether `location` needs a /sublocations request, based on the parent IDs
+  seen in /locations/lite or, when that listing was unavailable (None), its childCount
+  """
+  if parents is not None:
+    return location['id'] in parents
+  return bool(location.get('childCount'))
+
+class LocationTree:
+  """
+  Parent locations and their sub-locations, as returned by api.get_location_tree()
+
+    tree = zia_api.get_location_tree()
+    for parent, children in tree:
+      ...
+    tree.children(parent_id)
+
+  Attributes
+  ----------
+  parents : OrderedDict
+    parent location id -> location record, in the order ZIA returned them
+  sublocations : dict
+    parent location id -> list of sub-location records, only for parents that have any
+  """
+
+  def __init__(self, items=()):
+    self.parents = collections.OrderedDict()
+    self.sublocations = {}
+    for parent, children in items:
+      self.add(parent, children)
+
+  def add(self, parent, children):
+    self.parents[parent['id']] = parent
+    if children:
+      self.sublocations[parent['id']] = children
+
+  def __iter__(self):
+    for id, parent in self.parents.items():
+      yield parent, self.sublocations.get(id, [])
+
+  def __len__(self):
+    return len(self.parents) + sum(len(children) for children in self.sublocations.values())
+
+  def __contains__(self, id):
+    return self.get(id) is not None
+
+  def children(self, parent_id):
+    return self.sublocations.get(parent_id, [])
+
+  def get(self, id):
+    """
+    Returns the parent or sub-location with `id`, None when it is not in the tree
+    """
+    if id in self.parents:
+      return self.parents[id]
+    for children in self.sublocations.values():
+      for child in children:
+        if child['id'] == id:
+          return child
+    return None
+
+  def records(self):
+    """
+    Yields every location, each parent followed by its sub-locations (with parentId set)
+    """
+    return iter_records(self)
+
+  def __repr__(self):
+    return "LocationTree(parents={}, sublocations={})".format(
+      len(self.parents), sum(len(children) for children in self.sublocations.values()))
+
+def iter_records(tree):
+  """
+  Flattens (parent, children) pairs, e.g. from api.iter_location_tree(), into location records
+  """
+  for parent, children in tree:
+    yield parent
+    for child in children:
+      child.setdefault('parentId', parent['id'])
+      yield child
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+
+import bisect
+import threading
+import collections
+
+from .ratelimit import endpoint
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class MetricEvent(collections.namedtuple('MetricEvent', ['kind', 'method', 'endpoint', 'status', 'seconds',
+                                                         'request_bytes', 'response_bytes', 'reason'])):
+  """
+  One instrumentation event passed to every listener
+
+  Attributes
+  ----------
+  kind : str
+    'request' for a completed HTTP call, 'retry' when a call is about to be
+    retried, 'throttle_wait' / 'rate_limit_wait' for time spent sleeping
+    before a request on a 429 back-off or the client-side rate limiter
+  method : str
+    HTTP method, or the client method name (e.g. 'get_users') for retries
+  endpoint : str
+    endpoint template such as '/users/{id}', None for retries
+  status : int
+    HTTP status code of a request, None when the call raised
+  seconds : float
+    request latency or time slept
+  request_bytes, response_bytes : int
+    body sizes of a request
+  reason : str
+    exception name for failed requests; for retries the retries.RetryPolicy error kind,
+    'throttle', 'session', 'connection' or 'server'
+  """
+  __slots__ = ()
+
+  def __new__(cls, kind, method, endpoint=None, status=None, seconds=0.0, request_bytes=0, response_bytes=0, reason=None):
+    return super().__new__(cls, kind, method, endpoint, status, seconds, request_bytes, response_bytes, reason)
+
+class _Series:
+  __slots__ = ('count', 'errors', 'statuses', 'buckets', 'latency_sum', 'request_bytes', 'response_bytes',
+               'throttle_wait', 'rate_limit_wait')
+
+  def __init__(self, bucket_count):
+    self.count = 0
+    self.errors = 0
+    self.statuses = collections.Counter()
+    self.buckets = [0] * (bucket_count + 1)
+    self.latency_sum = 0.0
+    self.request_bytes = 0
+    self.response_bytes = 0
+    self.throttle_wait = 0.0
+    self.rate_limit_wait = 0.0
+
+class Metrics:
+  """
+  Per endpoint and method request instrumentation for a client
+
+  Aggregates latency histograms, bytes transferred, status codes (429s and
+  401s included), retries and time spent sleeping on throttling, and
+  forwards every MetricEvent to the registered listeners so they can be
+  shipped anywhere.
+
+    metrics = Metrics()
+    metrics.add_listener(lambda event: print(event))
+    api = zia.api(cloud, username, password, apikey, metrics=metrics)
+    ...
+    print(metrics.to_prometheus())
+
+  Attributes
+  ----------
+  buckets : tuple
+    upper bounds in seconds of the latency histogram buckets
+  """
+
+  def __init__(self, buckets=DEFAULT_BUCKETS):
+    self.buckets = tuple(sorted(buckets))
+    self._lock = threading.Lock()
+    self._listeners = []
+    self.reset()
+
+  def reset(self):
+    with self._lock:
+      self._series = {}
+      self._retries = collections.Counter()
+
+  def add_listener(self, listener):
+    """
+    Registers a callable invoked with each MetricEvent, exceptions it raises are logged and ignored
+    """
+    self._listeners.append(listener)
+    return listener
+
+  def remove_listener(self, listener):
+    self._listeners.remove(listener)
+
+  def _get_series(self, method, endpoint):
+    key = (endpoint, method)
+    series = self._series.get(key)
+    if series is None:
+      series = self._series[key] = _Series(len(self.buckets))
+    return series
+
+  def _emit(self, event):
+    for listener in list(self._listeners):
+      try:
+        listener(event)
+      except Exception:
+        logger.exception("Metrics listener {!r} failed".format(listener))
+
+  def record_request(self, method, api_path, status, seconds, request_bytes=0, response_bytes=0, error=None):
+    event = MetricEvent('request', method, endpoint(api_path), status, seconds, request_bytes, response_bytes,
+                        type(error).__name__ if error is not None else None)
+    with self._lock:
+      series = self._get_series(method, event.endpoint)
+      series.count += 1
+      series.statuses[status] += 1
+      if error is not None or (status is not None and status >= 400):
+        series.errors += 1
+      series.buckets[bisect.bisect_left(self.buckets, seconds)] += 1
+      series.latency_sum += seconds
+      series.request_bytes += request_bytes
+      series.response_bytes += response_bytes
+    self._emit(event)
+
+  def record_wait(self, kind, method, api_path, seconds):
+    event = MetricEvent(kind, method, endpoint(api_path), seconds=seconds)
+    with self._lock:
+      series = self._get_series(method, event.endpoint)
+      if kind == 'throttle_wait':
+        series.throttle_wait += seconds
+      else:
+        series.rate_limit_wait += seconds
+    self._emit(event)
+
+  def record_retry(self, operation, reason):
+    with self._lock:
+      self._retries[(operation, reason)] += 1
+    self._emit(MetricEvent('retry', operation, reason=reason))
+
+  def snapshot(self):
+    """
+    Returns the aggregates as plain data, keyed by (endpoint, method) plus a 'retries' entry
+    """
+    with self._lock:
+      result = {}
+      for key, series in self._series.items():
+        result[key] = {
+          'count': series.count,
+          'errors': series.errors,
+          'statuses': dict(series.statuses),
+          'throttled': series.statuses[429],
+          'unauthorized': series.statuses[401],
+          'latency_sum': series.latency_sum,
+          'latency_buckets': dict(zip(self.buckets + (float('inf'),), series.buckets)),
+          'request_bytes': series.request_bytes,
+          'response_bytes': series.response_bytes,
+          'throttle_wait': series.throttle_wait,
+          'rate_limit_wait': series.rate_limit_wait,
+        }
+      result['retries'] = dict(self._retries)
+      return result
+
+  def to_prometheus(self, prefix='zia_client'):
+    """
+    Renders the aggregates in the Prometheus text exposition format
+    """
+    lines = []
+
+    def header(name, kind, text):
+      lines.append("# HELP {}_{} {}".format(prefix, name, text))
+      lines.append("# TYPE {}_{} {}".format(prefix, name, kind))
+
+    def labels(**values):
+      return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                            for k, v in values.items()) + '}'
+
+    with self._lock:
+      series_items = sorted(self._series.items(), key=lambda item: item[0])
+      retries = sorted(self._retries.items())
+
+      header('request_duration_seconds', 'histogram', 'Latency of ZIA API requests')
+      for (path, method), series in series_items:
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), series.buckets):
+          cumulative += count
+          le = '+Inf' if bound == float('inf') else repr(bound)
+          lines.append("{}_request_duration_seconds_bucket{} {}".format(prefix, labels(endpoint=path, method=method, le=le), cumulative))
+        lines.append("{}_request_duration_seconds_sum{} {}".format(prefix, labels(endpoint=path, method=method), series.latency_sum))
+        lines.append("{}_request_duration_seconds_count{} {}".format(prefix, labels(endpoint=path, method=method), series.count))
+
+      header('responses_total', 'counter', 'ZIA API responses by status code')
+      for (path, method), series in series_items:
+        for status, count in sorted(series.statuses.items(), key=lambda item: str(item[0])):
+          code = status if status is not None else 'error'
+          lines.append("{}_responses_total{} {}".format(prefix, labels(endpoint=path, method=method, status=code), count))
+
+      for name, attribute, text in (('request_bytes_total', 'request_bytes', 'Bytes sent in request bodies'),
+                                    ('response_bytes_total', 'response_bytes', 'Bytes received in response bodies'),
+                                    ('throttle_wait_seconds_total', 'throttle_wait', 'Seconds slept after 429 responses'),
+                                    ('rate_limit_wait_seconds_total', 'rate_limit_wait', 'Seconds slept in the client-side rate limiter')):
+        header(name, 'counter', text)
+        for (path, method), series in series_items:
+          lines.append("{}_{}{} {}".format(prefix, name, labels(endpoint=path, method=method), getattr(series, attribute)))
+
+      header('retries_total', 'counter', 'Retried client calls by reason')
+      for (operation, reason), count in retries:
+        lines.append("{}_retries_total{} {}".format(prefix, labels(operation=operation, reason=reason), count))
+
+    return '\n'.join(lines) + '\n'
+
+class OpenTelemetryListener:
+  """
+  Metrics listener that records events on OpenTelemetry instruments
+
+    metrics.add_listener(OpenTelemetryListener())
+
+  Requires the opentelemetry-api package, the meter defaults to one named
+  after this module from the global MeterProvider.
+  """
+
+  def __init__(self, meter=None):
+    try:
+      from opentelemetry import metrics as otel_metrics
+    except ImportError:
+      raise ImportError("OpenTelemetryListener requires opentelemetry-api, install it with 'pip install opentelemetry-api'")
+    meter = meter or otel_metrics.get_meter(__name__)
+    self.duration = meter.create_histogram('zia.client.request.duration', unit='s', description='Latency of ZIA API requests')
+    self.request_bytes = meter.create_counter('zia.client.request.bytes', unit='By', description='Bytes sent in request bodies')
+    self.response_bytes = meter.create_counter('zia.client.response.bytes', unit='By', description='Bytes received in response bodies')
+    self.waits = meter.create_counter('zia.client.wait', unit='s', description='Seconds slept on throttling and rate limiting')
+    self.retries = meter.create_counter('zia.client.retries', description='Retried client calls')
+
+  def __call__(self, event):
+    if event.kind == 'request':
+      attributes = {'endpoint': event.endpoint, 'method': event.method, 'status': str(event.status)}
+      self.duration.record(event.seconds, attributes)
+      self.request_bytes.add(event.request_bytes, attributes)
+      self.response_bytes.add(event.response_bytes, attributes)
+    elif event.kind == 'retry':
+      self.retries.add(1, {'operation': event.method, 'reason': event.reason})
+    else:
+      self.waits.add(event.seconds, {'endpoint': event.endpoint, 'method': event.method, 'kind': event.kind})
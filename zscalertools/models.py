@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+
+import collections
+from array import array
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+_NONE = -1
+
+# user fields kept in columns, everything else is interned as a shared "extras" dict
+_USER_COLUMNS = ('id', 'name', 'email', 'department', 'groups')
+
+_HAS_DEPARTMENT = 1
+_HAS_GROUPS = 2
+
+def _freeze(value):
+  """
+  Hashable key for a JSON value, so equal records intern to the same object
+  """
+  if isinstance(value, dict):
+    return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+  if isinstance(value, list):
+    return ('__list__',) + tuple(_freeze(item) for item in value)
+  # True == 1 and 0 == 0.0, keep them apart so records round-trip exactly
+  return value.__class__, value
+
+class _Record:
+  """
+  Immutable, interned department or group, shared by every user that references it
+  """
+  __slots__ = ('id', 'name', '_record')
+
+  def __init__(self, record):
+    self.id = record.get('id')
+    self.name = record.get('name')
+    self._record = record
+
+  def to_dict(self):
+    return dict(self._record)
+
+  def __getitem__(self, key):
+    return self._record[key]
+
+  def get(self, key, default=None):
+    return self._record.get(key, default)
+
+  def __eq__(self, other):
+    if isinstance(other, _Record):
+      return self._record == other._record
+    return self._record == other
+
+  def __hash__(self):
+    return hash(self.id)
+
+  def __repr__(self):
+    return "{}(id={!r}, name={!r})".format(type(self).__name__, self.id, self.name)
+
+class Department(_Record):
+  __slots__ = ()
+
+class Group(_Record):
+  __slots__ = ()
+
+class _Interner:
+  """
+  Returns one shared object per distinct record content
+  """
+
+  def __init__(self, factory):
+    self.factory = factory
+    self.objects = []
+    self._index = {}
+
+  def __len__(self):
+    return len(self.objects)
+
+  def index(self, record):
+    key = _freeze(record)
+    i = self._index.get(key)
+    if i is None:
+      i = self._index[key] = len(self.objects)
+      self.objects.append(self.factory(record))
+    return i
+
+  def intern(self, record):
+    return self.objects[self.index(record)]
+
+class User:
+  """
+  Lightweight view of one row of a UserTable
+
+  Supports the read side of the dict API (user['email'], user.get('groups'))
+  so existing code keeps working, to_dict() materializes the raw record.
+  """
+  __slots__ = ('_table', '_row')
+
+  def __init__(self, table, row):
+    self._table = table
+    self._row = row
+
+  @property
+  def id(self):
+    return self._table._ids[self._row]
+
+  @property
+  def name(self):
+    return self._table._names[self._row]
+
+  @property
+  def email(self):
+    return self._table._emails[self._row]
+
+  @property
+  def department(self):
+    i = self._table._departments[self._row]
+    return self._table._department_refs.objects[i] if i != _NONE else None
+
+  @property
+  def groups(self):
+    table = self._table
+    objects = table._group_refs.objects
+    return tuple(objects[i] for i in table._group_ids[table._group_offsets[self._row]:table._group_offsets[self._row + 1]])
+
+  def to_dict(self):
+    return self._table._materialize(self._row)
+
+  def __getitem__(self, key):
+    if key == 'id':
+      return self.id
+    if key in ('name', 'email'):
+      value = getattr(self, key)
+      if value is not None:
+        return value
+    return self.to_dict()[key]
+
+  def get(self, key, default=None):
+    try:
+      return self[key]
+    except KeyError:
+      return default
+
+  def __contains__(self, key):
+    return self.get(key, self) is not self
+
+  def __eq__(self, other):
+    if isinstance(other, User):
+      return self.to_dict() == other.to_dict()
+    return self.to_dict() == other
+
+  def __repr__(self):
+    return "User(id={!r}, name={!r}, email={!r})".format(self.id, self.name, self.email)
+
+def to_dicts(records):
+  """
+  Yields raw record dicts from a UserTable, a list of Department/Group views
+  or plain dicts, for code that needs the JSON form (hashing, serializing)
+  """
+  if isinstance(records, UserTable):
+    yield from records.to_dicts()
+    return
+  for record in records:
+    yield record.to_dict() if isinstance(record, (User, _Record)) else record
+
+class UserTable:
+  """
+  Column oriented, array backed store for large user lists
+
+  Each user costs a few array slots plus its name and email strings,
+  instead of a dict with its own copies of the nested department and group
+  dicts. Departments, groups and the remaining fields (comments, adminUser,
+  ...) are interned, so users that share them point at one object.
+
+    table = UserTable(api.iter_users())
+    user = table.by_id(12345)
+    user.department.name, [group.name for group in user.groups]
+    user.to_dict()
+
+  Attributes
+  ----------
+  departments : list of Department
+    distinct departments interned by the table
+  groups : list of Group
+    distinct groups interned by the table
+  """
+
+  def __init__(self, users=()):
+    self._ids = array('q')
+    self._names = []
+    self._emails = []
+    self._departments = array('l')
+    self._group_offsets = array('L', [0])
+    self._group_ids = array('l')
+    self._flags = bytearray()
+    self._extras = array('l')
+    self._department_refs = _Interner(Department)
+    self._group_refs = _Interner(Group)
+    self._extra_refs = _Interner(dict)
+    self._by_id = None
+    self.extend(users)
+
+  @property
+  def departments(self):
+    return list(self._department_refs.objects)
+
+  @property
+  def groups(self):
+    return list(self._group_refs.objects)
+
+  def append(self, user):
+    flags = 0
+    name = user.get('name')
+    email = user.get('email')
+    extras = {key: value for key, value in user.items() if key not in _USER_COLUMNS}
+    # only strings go in the name/email columns, anything else round-trips through extras
+    if name is not None and not isinstance(name, str):
+      extras['name'], name = name, None
+    if email is not None and not isinstance(email, str):
+      extras['email'], email = email, None
+    self._ids.append(user['id'])
+    self._names.append(name)
+    self._emails.append(email)
+    if 'department' in user:
+      flags |= _HAS_DEPARTMENT
+    department = user.get('department')
+    self._departments.append(self._department_refs.index(department) if department is not None else _NONE)
+    if 'groups' in user:
+      flags |= _HAS_GROUPS
+    for group in user.get('groups') or ():
+      self._group_ids.append(self._group_refs.index(group))
+    self._group_offsets.append(len(self._group_ids))
+    self._flags.append(flags)
+    self._extras.append(self._extra_refs.index(extras) if extras else _NONE)
+    if self._by_id is not None:
+      self._by_id[user['id']] = len(self._ids) - 1
+
+  def extend(self, users):
+    for user in users:
+      self.append(user)
+    return self
+
+  def __len__(self):
+    return len(self._ids)
+
+  def __getitem__(self, row):
+    if isinstance(row, slice):
+      return [User(self, i) for i in range(*row.indices(len(self)))]
+    if row < 0:
+      row += len(self)
+    if not 0 <= row < len(self):
+      raise IndexError("user row out of range")
+    return User(self, row)
+
+  def __iter__(self):
+    for row in range(len(self._ids)):
+      yield User(self, row)
+
+  def by_id(self, id):
+    """
+    Returns the User with `id`, None when it is not in the table
+    """
+    if self._by_id is None:
+      self._by_id = {id: row for row, id in enumerate(self._ids)}
+    row = self._by_id.get(id)
+    return User(self, row) if row is not None else None
+
+  def in_department(self, department_id):
+    return [User(self, row) for row, i in enumerate(self._departments)
+            if i != _NONE and self._department_refs.objects[i].id == department_id]
+
+  def in_group(self, group_id):
+    refs = {i for i, group in enumerate(self._group_refs.objects) if group.id == group_id}
+    offsets = self._group_offsets
+    return [User(self, row) for row in range(len(self._ids))
+            if any(i in refs for i in self._group_ids[offsets[row]:offsets[row + 1]])]
+
+  def _materialize(self, row):
+    user = {'id': self._ids[row]}
+    if self._names[row] is not None:
+      user['name'] = self._names[row]
+    if self._emails[row] is not None:
+      user['email'] = self._emails[row]
+    if self._extras[row] != _NONE:
+      user.update(self._extra_refs.objects[self._extras[row]])
+    flags = self._flags[row]
+    if flags & _HAS_DEPARTMENT:
+      i = self._departments[row]
+      user['department'] = self._department_refs.objects[i].to_dict() if i != _NONE else None
+    if flags & _HAS_GROUPS:
+      objects = self._group_refs.objects
+      user['groups'] = [objects[i].to_dict() for i in self._group_ids[self._group_offsets[row]:self._group_offsets[row + 1]]]
+    return user
+
+  def to_dicts(self):
+    """
+    Yields every user as the raw record dict, one at a time
+    """
+    for row in range(len(self._ids)):
+      yield self._materialize(row)
+
+  def __repr__(self):
+    return "UserTable(users={}, departments={}, groups={})".format(len(self), len(self._department_refs), len(self._group_refs))
+
+class UserData(collections.namedtuple('UserData', ['users', 'departments', 'groups'])):
+  """
+  Compact result of api.pull_all_user_data(compact=True), unpacks like the list form
+
+    users, departments, groups = api.pull_all_user_data(compact=True)
+
+  Attributes
+  ----------
+  users : UserTable
+  departments : list of Department
+    every department in the tenant, interned with the ones the users reference
+  groups : list of Group
+    every group in the tenant, interned with the ones the users reference
+  """
+  __slots__ = ()
+
+  @classmethod
+  def from_records(cls, users, departments, groups):
+    return cls.from_table(UserTable(users), departments, groups)
+
+  @classmethod
+  def from_table(cls, table, departments, groups):
+    """
+    Wraps an already filled UserTable, interning the department and group
+    records with the ones its users reference
+    """
+    return cls(table, [table._department_refs.intern(department) for department in departments],
+               [table._group_refs.intern(group) for group in groups])
+
+  def to_lists(self):
+    """
+    Materializes the three lists of raw dicts returned by pull_all_user_data()
+    """
+    return list(self.users.to_dicts()), [department.to_dict() for department in self.departments], \
+           [group.to_dict() for group in self.groups]
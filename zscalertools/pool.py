@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+
+import time
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Tenant:
+  """
+  Connection details of one ZIA tenant
+
+  Attributes
+  ----------
+  name : str
+    label used to key results, defaults to 'username@cloud'
+  cloud, username, password, apikey : str
+    passed to zia.api
+  options : dict
+    extra zia.api keyword arguments (page_size, concurrency, cache, ...),
+    they must be picklable when the pool runs in processes
+  """
+  __slots__ = ('name', 'cloud', 'username', 'password', 'apikey', 'options')
+
+  def __init__(self, cloud, username, password, apikey, name=None, **options):
+    self.cloud = cloud
+    self.username = username
+    self.password = password
+    self.apikey = apikey
+    self.name = name or "{}@{}".format(username, cloud)
+    self.options = options
+
+  @classmethod
+  def coerce(cls, tenant):
+    """
+    Accepts a Tenant or a dict with cloud, username, password, apikey and optionally name and api options
+    """
+    if isinstance(tenant, cls):
+      return tenant
+    return cls(**tenant)
+
+  @property
+  def key(self):
+    return self.cloud, self.username
+
+  def client(self):
+    from .zia import api
+    return api(self.cloud, self.username, self.password, self.apikey, **self.options)
+
+  def __getstate__(self):
+    return {attribute: getattr(self, attribute) for attribute in self.__slots__}
+
+  def __setstate__(self, state):
+    for attribute, value in state.items():
+      setattr(self, attribute, value)
+
+  def __repr__(self):
+    return "Tenant({!r})".format(self.name)
+
+class TenantResult:
+  """
+  Outcome of one operation on one tenant
+
+  Attributes
+  ----------
+  tenant : str
+    tenant name
+  value : object
+    return value of the operation, None when it raised
+  error : Exception
+    the exception raised, None on success
+  seconds : float
+    time the operation took on this tenant
+  """
+  __slots__ = ('tenant', 'value', 'error', 'seconds')
+
+  def __init__(self, tenant, value=None, error=None, seconds=0.0):
+    self.tenant = tenant
+    self.value = value
+    self.error = error
+    self.seconds = seconds
+
+  @property
+  def ok(self):
+    return self.error is None
+
+  def __repr__(self):
+    return "TenantResult({!r}, ok={!r}, seconds={:.3f})".format(self.tenant, self.ok, self.seconds)
+
+class PoolResult(collections.OrderedDict):
+  """
+  tenant name -> TenantResult for one TenantPool.run(), in tenant order
+  """
+
+  @property
+  def ok(self):
+    return all(result.ok for result in self.values())
+
+  def succeeded(self):
+    return collections.OrderedDict((name, result.value) for name, result in self.items() if result.ok)
+
+  def failed(self):
+    return collections.OrderedDict((name, result.error) for name, result in self.items() if not result.ok)
+
+  def raise_for_errors(self):
+    """
+    Re-raises the first tenant error, with every failed tenant named in the log
+    """
+    failed = self.failed()
+    for name, error in failed.items():
+      logger.error("Tenant Pool - {} failed - {!r}".format(name, error))
+    if failed:
+      raise next(iter(failed.values()))
+    return self
+
+  def __repr__(self):
+    failed = list(self.failed())
+    return "PoolResult(tenants={}, failed={})".format(len(self), failed)
+
+def _call(client, operation, args, kwargs):
+  if isinstance(operation, str):
+    return getattr(client, operation)(*args, **kwargs)
+  return operation(client, *args, **kwargs)
+
+def _close_client(client):
+  """
+  Logs the client out when it holds a session and closes its connections
+  """
+  try:
+    if client.session_manager.session_id is not None:
+      client.logout()
+  except Exception as e:
+    logger.warning("Tenant Pool - logout failed - {}".format(e))
+  client.session.close()
+
+def _run_in_process(tenant, operation, args, kwargs):
+  """
+  Process pool entry point, clients can not be pickled so each call builds
+  one from the Tenant and logs it out again
+  """
+  started = time.perf_counter()
+  try:
+    client = tenant.client()
+    try:
+      value = _call(client, operation, args, kwargs)
+    finally:
+      _close_client(client)
+    return TenantResult(tenant.name, value, seconds=time.perf_counter() - started)
+  except Exception as e:
+    return TenantResult(tenant.name, error=e, seconds=time.perf_counter() - started)
+
+class TenantPool:
+  """
+  Runs the same operation against many ZIA tenants in parallel
+
+  Holds one zia.api per (cloud, username), each with its own connection
+  pool, session, throttle state and rate limiter, so a 429 on one tenant
+  never slows down another. Results and errors are collected per tenant
+  instead of stopping at the first failure.
+
+    pool = TenantPool([
+      {'name': 'prod', 'cloud': 'admin.zscaler.net', 'username': ..., 'password': ..., 'apikey': ...},
+      {'name': 'beta', 'cloud': 'admin.zscalerbeta.net', 'username': ..., 'password': ..., 'apikey': ...},
+    ])
+    results = pool.run('pull_all_user_data')
+    for name, (users, departments, groups) in results.succeeded().items():
+      ...
+    pool.run(lambda api: len(api.get_locations()))
+
+  Attributes
+  ----------
+  tenants : OrderedDict
+    tenant name -> Tenant
+  max_workers : int
+    tenants processed at once (default: one per tenant, at most 16)
+  processes : bool
+    run operations in worker processes instead of threads, for CPU heavy
+    post-processing. Each call then builds its own client in the worker, so
+    operations must be method names or picklable top level functions and
+    return picklable values.
+  """
+
+  def __init__(self, tenants, max_workers=None, processes=False):
+    self.tenants = collections.OrderedDict()
+    for tenant in tenants:
+      tenant = Tenant.coerce(tenant)
+      if tenant.name in self.tenants:
+        raise ValueError("Duplicate tenant name {}".format(tenant.name))
+      self.tenants[tenant.name] = tenant
+    self.max_workers = max_workers or min(16, max(1, len(self.tenants)))
+    self.processes = processes
+    self._clients = {}
+    self._lock = threading.Lock()
+    self._executor = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    self.close()
+
+  def client(self, name):
+    """
+    Returns the client of a tenant, tenants that share a cloud and username share one client
+    """
+    tenant = self.tenants[name]
+    with self._lock:
+      client = self._clients.get(tenant.key)
+      if client is None:
+        client = self._clients[tenant.key] = tenant.client()
+      return client
+
+  def _get_executor(self):
+    if self._executor is None:
+      executor = ProcessPoolExecutor if self.processes else ThreadPoolExecutor
+      self._executor = executor(max_workers=self.max_workers)
+    return self._executor
+
+  def _run_in_thread(self, name, operation, args, kwargs):
+    started = time.perf_counter()
+    try:
+      value = _call(self.client(name), operation, args, kwargs)
+      return TenantResult(name, value, seconds=time.perf_counter() - started)
+    except Exception as e:
+      logger.error("Tenant Pool - {} failed - {}".format(name, e))
+      return TenantResult(name, error=e, seconds=time.perf_counter() - started)
+
+  def run(self, operation, *args, tenants=None, **kwargs):
+    """
+    Calls `operation` on every tenant (or the named `tenants`) in parallel
+    and returns a PoolResult. `operation` is an api method name, called with
+    args and kwargs, or a callable taking the client first.
+    """
+    names = list(tenants) if tenants is not None else list(self.tenants)
+    logger.info("Tenant Pool - Running {} on {} tenants".format(getattr(operation, '__name__', operation), len(names)))
+    executor = self._get_executor()
+    if self.processes:
+      futures = [(name, executor.submit(_run_in_process, self.tenants[name], operation, args, kwargs)) for name in names]
+    else:
+      futures = [(name, executor.submit(self._run_in_thread, name, operation, args, kwargs)) for name in names]
+    results = PoolResult()
+    for name, future in futures:
+      try:
+        results[name] = future.result()
+      except Exception as e:
+        # e.g. an operation, option or result that could not be pickled for a worker process
+        logger.error("Tenant Pool - {} failed - {}".format(name, e))
+        results[name] = TenantResult(name, error=e)
+    logger.info("Tenant Pool - Complete - {!r}".format(results))
+    return results
+
+  def login(self):
+    return self.run('login')
+
+  def close(self):
+    """
+    Logs out every client that has logged in and shuts the workers down
+    """
+    with self._lock:
+      clients = list(self._clients.values())
+      self._clients.clear()
+    for client in clients:
+      _close_client(client)
+    if self._executor is not None:
+      self._executor.shutdown()
+      self._executor = None
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+import os
+import re
+import json
+import time
+import bisect
+import threading
+from collections import namedtuple
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+class RateLimit(namedtuple('RateLimit', ['method', 'path', 'calls', 'period', 'burst'])):
+  """
+  A quota of `calls` per `period` seconds
+
+  Quotas over CAP_PERIOD seconds (hourly caps) are enforced as a sliding
+  window, so all `calls` can be sent at once and the next one waits until
+  the oldest leaves the window. Shorter quotas are paced by a token bucket.
+
+  Attributes
+  ----------
+  method : str
+    HTTP method the quota applies to, None for every method
+  path : str
+    endpoint template the quota applies to (e.g. '/users/{id}'), None for every endpoint
+  calls : int
+    number of calls allowed per period
+  period : float
+    length of the quota window in seconds
+  burst : int
+    number of calls that may be sent back to back before pacing starts (default 1),
+    ignored for caps
+  """
+  __slots__ = ()
+
+  def __new__(cls, method, path, calls, period, burst=1):
+    return super().__new__(cls, method, path, calls, period, burst)
+
+# quotas with a longer period are caps counted over a sliding window instead of paced
+CAP_PERIOD = 60
+
+# Published ZIA quotas are per admin across every endpoint of a method, add
+# endpoint specific entries (e.g. hourly caps) through the RateLimiter constructor
+DEFAULT_RATE_LIMITS = (
+  RateLimit('GET', None, 20, 10),
+  RateLimit('POST', None, 1, 1),
+  RateLimit('PUT', None, 1, 1),
+  RateLimit('DELETE', None, 1, 1),
+)
+
+_ID_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+def endpoint(api_path):
+  """
+  Normalizes an API path to the template quotas are keyed on,
+  '/users/1234?page=2' becomes '/users/{id}'.
+  """
+  path = api_path.split('?', 1)[0].rstrip('/')
+  return _ID_SEGMENT.sub('/{id}', path) or '/'
+
+class RateLimiter:
+  """
+  Proactive limiter shared by every method of a client
+
+  A short RateLimit is one token bucket holding up to `burst` tokens
+  refilled at calls/period tokens per second, so no window of `period`
+  seconds ever carries more than `calls` requests. A RateLimit over
+  CAP_PERIOD keeps the send times of the calls in its window instead, so a
+  burst can use the whole cap at once. reserve() takes a slot from every
+  limit matching a request and returns how long the caller must wait before
+  sending it, which lets the synchronous client sleep and the asyncio client
+  await without the limiter ever blocking.
+
+  Passing `lock_file` keeps the limiter state in that file under an
+  exclusive flock, so separate processes using the same credentials share
+  one budget.
+
+  Attributes
+  ----------
+  limits : iterable of RateLimit
+    quotas to enforce (default DEFAULT_RATE_LIMITS), pass () to disable limiting
+  lock_file : str
+    optional path used to share bucket state across processes (POSIX only)
+  """
+
+  def __init__(self, limits=DEFAULT_RATE_LIMITS, lock_file=None):
+    self.limits = tuple(limits)
+    self.lock_file = lock_file
+    self._lock = threading.Lock()
+    self._buckets = {}
+    if lock_file and fcntl is None:
+      raise RuntimeError("Sharing a rate limiter across processes requires fcntl")
+
+  def _matching(self, method, template):
+    for limit in self.limits:
+      if limit.method is not None and limit.method != method:
+        continue
+      if limit.path is not None and limit.path != template:
+        continue
+      yield limit
+
+  def _key(self, limit):
+    return "{} {} {}/{}".format(limit.method or '*', limit.path or '*', limit.calls, limit.period)
+
+  def _take(self, buckets, limit, now):
+    key = self._key(limit)
+    rate = float(limit.calls) / limit.period
+    tokens, last = buckets.get(key, (limit.burst, now))
+    tokens = min(limit.burst, tokens + (now - last) * rate) - 1
+    buckets[key] = (tokens, now)
+    return -tokens / rate if tokens < 0 else 0
+
+  def _window_delay(self, buckets, limit, now):
+    times = buckets.setdefault(self._key(limit), [])
+    del times[:bisect.bisect_right(times, now - limit.period)]
+    if len(times) < limit.calls:
+      return 0
+    return times[len(times) - limit.calls] + limit.period - now
+
+  def _reserve(self, buckets, limits):
+    now = time.time()
+    caps = [limit for limit in limits if limit.period > CAP_PERIOD]
+    delay = max([self._window_delay(buckets, limit, now) for limit in caps] +
+                [self._take(buckets, limit, now) for limit in limits if limit.period <= CAP_PERIOD])
+    for limit in caps:
+      bisect.insort(buckets[self._key(limit)], now + delay)
+    return delay
+
+  def reserve(self, method, api_path):
+    """
+    Takes a slot for the request and returns the seconds to wait before sending it
+    """
+    limits = list(self._matching(method.upper(), endpoint(api_path)))
+    if not limits:
+      return 0
+    with self._lock:
+      if self.lock_file:
+        return self._reserve_shared(limits)
+      return self._reserve(self._buckets, limits)
+
+  def _reserve_shared(self, limits):
+    fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+      fcntl.flock(fd, fcntl.LOCK_EX)
+      with os.fdopen(os.dup(fd), 'r+') as f:
+        content = f.read()
+        buckets = json.loads(content) if content else {}
+        delay = self._reserve(buckets, limits)
+        f.seek(0)
+        f.truncate()
+        f.write(json.dumps(buckets))
+      return delay
+    finally:
+      fcntl.flock(fd, fcntl.LOCK_UN)
+      os.close(fd)
+
+  def acquire(self, method, api_path):
+    """
+    Blocks until the request may be sent
+    """
+    delay = self.reserve(method, api_path)
+    if delay > 0:
+      logger.debug("Rate limit - delaying {} {} by {:.2f} seconds".format(method, api_path, delay))
+      time.sleep(delay)
+    return delay
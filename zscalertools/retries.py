@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+import random
+import asyncio
+import threading
+from requests.exceptions import ConnectionError, ConnectTimeout, Timeout, HTTPError, ChunkedEncodingError
+from urllib3.exceptions import NewConnectionError, ConnectTimeoutError
+
+try:
+  import aiohttp
+except ImportError:
+  aiohttp = None
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# error kinds returned by RetryPolicy.classify()
+THROTTLE = 'throttle'
+SESSION = 'session'
+CONNECTION = 'connection'
+SERVER = 'server'
+CLIENT = 'client'
+FATAL = 'fatal'
+
+class RetryBudget:
+  """
+  Caps retries to a share of the requests made, so an outage does not turn
+  every call into `tries` calls
+
+  Each request deposits `ratio` tokens and each retry spends one, the
+  balance never exceeds `reserve`. At the defaults at most 20% of requests
+  are retried once the initial reserve of 10 retries is spent.
+  """
+
+  def __init__(self, ratio=0.2, reserve=10):
+    self.ratio = ratio
+    self.reserve = reserve
+    self._tokens = float(reserve)
+    self._lock = threading.Lock()
+    self.exhausted = 0
+
+  def deposit(self):
+    with self._lock:
+      self._tokens = min(self.reserve, self._tokens + self.ratio)
+
+  def withdraw(self):
+    """
+    Takes a token for one retry, False when the budget is spent
+    """
+    with self._lock:
+      if self._tokens >= 1:
+        self._tokens -= 1
+        return True
+      self.exhausted += 1
+      return False
+
+  @property
+  def tokens(self):
+    return self._tokens
+
+def _not_sent(error):
+  """
+  Whether the request failed before it reached ZIA, making any method safe to retry
+  """
+  if isinstance(error, (ConnectTimeout, NewConnectionError, ConnectTimeoutError)):
+    return True
+  if aiohttp is not None and isinstance(error, aiohttp.ClientConnectorError):
+    return True
+  reason = error.args[0] if error.args else None
+  reason = getattr(reason, 'reason', reason)
+  return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+def _status(error):
+  response = getattr(error, 'response', None)
+  if response is not None:
+    return getattr(response, 'status_code', None)
+  return getattr(error, 'status', None)
+
+class RetryPolicy:
+  """
+  Decides whether and when a failed api call is retried
+
+  Errors are classified as throttle (429), session (401), connection,
+  server (5xx), client (other 4xx) or fatal (anything else, e.g. a bug in
+  the caller). Client and fatal errors are never retried. Connection and
+  server errors are retried for idempotent calls, while POSTs that create
+  records (add_user, add_location) are only retried when the request never
+  reached ZIA. Those retries wait with decorrelated jitter, so parallel
+  workers spread out instead of retrying in lockstep, and draw on a retry
+  budget. Every policy has a budget of its own unless one is passed, so an
+  outage on one tenant never spends the retries of another; share a
+  RetryBudget between policies to cap retries across clients. 429s wait for
+  Retry-After and 401s log in again without touching the budget.
+
+    policy = RetryPolicy(tries=5, max_delay=10, budget=RetryBudget(ratio=0.1))
+    api = zia.api(cloud, username, password, apikey, retry_policy=policy)
+
+  Attributes
+  ----------
+  tries : int
+    attempts per call, including the first
+  base_delay : float
+    smallest delay in seconds between attempts
+  max_delay : float
+    largest delay in seconds between attempts
+  budget : RetryBudget
+    retry allowance, a new RetryBudget for this policy by default
+  retry_non_idempotent : bool
+    also retry creates after connection and server errors, at the risk of duplicate records
+  """
+
+  def __init__(self, tries=3, base_delay=0.5, max_delay=20.0, budget=None, retry_non_idempotent=False):
+    self.tries = tries
+    self.base_delay = base_delay
+    self.max_delay = max_delay
+    self.budget = budget if budget is not None else RetryBudget()
+    self.retry_non_idempotent = retry_non_idempotent
+
+  def classify(self, error):
+    from .zia import ZiaThrottleException, ZiaSessionException
+    if isinstance(error, ZiaThrottleException):
+      return THROTTLE
+    if isinstance(error, ZiaSessionException):
+      return SESSION
+    status = _status(error) if isinstance(error, HTTPError) or (
+      aiohttp is not None and isinstance(error, aiohttp.ClientResponseError)) else None
+    if status is not None:
+      if status == 429:
+        return THROTTLE
+      if status == 401:
+        return SESSION
+      return SERVER if status >= 500 else CLIENT
+    if isinstance(error, (ConnectionError, Timeout, ChunkedEncodingError, asyncio.TimeoutError)):
+      return CONNECTION
+    if aiohttp is not None and isinstance(error, aiohttp.ClientError):
+      return CONNECTION
+    return FATAL
+
+  def should_retry(self, error, kind, attempt, idempotent=True):
+    """
+    Whether attempt number `attempt` that failed with `error` is retried
+    """
+    if attempt >= self.tries or kind in (CLIENT, FATAL):
+      return False
+    if kind in (THROTTLE, SESSION):
+      return True
+    if not idempotent and not self.retry_non_idempotent and not _not_sent(error):
+      logger.warning("Not retrying non-idempotent call after {} error - {}".format(kind, error))
+      return False
+    if not self.budget.withdraw():
+      logger.warning("Retry budget exhausted, not retrying {} error - {}".format(kind, error))
+      return False
+    return True
+
+  def backoff(self, previous=None):
+    """
+    Next delay with decorrelated jitter: uniform between base_delay and three times the previous delay
+    """
+    previous = previous or self.base_delay
+    return min(self.max_delay, random.uniform(self.base_delay, previous * 3))
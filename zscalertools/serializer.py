@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+import json
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+_CANONICAL_ENCODER = json.JSONEncoder(sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+def _has_float(obj):
+  if isinstance(obj, float):
+    return True
+  if isinstance(obj, dict):
+    return any(_has_float(value) for value in obj.values())
+  if isinstance(obj, (list, tuple)):
+    return any(_has_float(value) for value in obj)
+  return False
+
+class JsonSerializer:
+  """
+  Standard library backend, always available
+
+  Every backend encodes to UTF-8 bytes, decodes from bytes or str without
+  an intermediate text copy where the library allows it, and produces the
+  same canonical() bytes (sorted keys, no whitespace, no ASCII escaping) so
+  content hashes do not depend on which library is installed. Backends spell
+  floats differently ('1e+16' and '1e16', NaN as NaN or null), so records
+  holding a float are always made canonical by the standard library.
+  """
+  name = 'json'
+
+  def __init__(self):
+    self._encoder = json.JSONEncoder(separators=(',', ':'))
+
+  def dumps(self, obj):
+    return self._encoder.encode(obj).encode('utf-8')
+
+  def loads(self, data):
+    # json.loads() detects the UTF-8/16/32 encoding of bytes itself
+    return json.loads(data)
+
+  def canonical(self, obj):
+    return _CANONICAL_ENCODER.encode(obj).encode('utf-8')
+
+  def __repr__(self):
+    return "{}()".format(type(self).__name__)
+
+class OrjsonSerializer(JsonSerializer):
+  """
+  orjson backend, the fastest encoder and decoder, 'pip install orjson'
+  """
+  name = 'orjson'
+
+  def __init__(self):
+    import orjson
+    self._orjson = orjson
+
+  def dumps(self, obj):
+    return self._orjson.dumps(obj)
+
+  def loads(self, data):
+    return self._orjson.loads(data)
+
+  def canonical(self, obj):
+    if _has_float(obj):
+      return JsonSerializer.canonical(self, obj)
+    try:
+      return self._orjson.dumps(obj, option=self._orjson.OPT_SORT_KEYS)
+    except TypeError:
+      # e.g. integers wider than 64 bits
+      return JsonSerializer.canonical(self, obj)
+
+class UjsonSerializer(JsonSerializer):
+  """
+  ujson backend, 'pip install ujson'
+  """
+  name = 'ujson'
+
+  def __init__(self):
+    import ujson
+    self._ujson = ujson
+
+  def dumps(self, obj):
+    return self._ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False).encode('utf-8')
+
+  def loads(self, data):
+    return self._ujson.loads(data)
+
+  def canonical(self, obj):
+    if _has_float(obj):
+      return JsonSerializer.canonical(self, obj)
+    try:
+      return self._ujson.dumps(obj, sort_keys=True, ensure_ascii=False, escape_forward_slashes=False).encode('utf-8')
+    except OverflowError:
+      return JsonSerializer.canonical(self, obj)
+
+BACKENDS = (OrjsonSerializer, UjsonSerializer, JsonSerializer)
+
+_default = None
+
+def available():
+  """
+  Names of the backends that can be imported, fastest first
+  """
+  names = []
+  for backend in BACKENDS:
+    try:
+      backend()
+    except ImportError:
+      continue
+    names.append(backend.name)
+  return names
+
+def get_serializer(serializer=None):
+  """
+  Returns a serializer instance. `serializer` may be an instance, a backend
+  name ('orjson', 'ujson', 'json') or None for the fastest installed backend.
+  """
+  global _default
+  if serializer is None:
+    if _default is None:
+      for backend in BACKENDS:
+        try:
+          _default = backend()
+          break
+        except ImportError:
+          continue
+      logger.debug("JSON serializer - using {}".format(_default.name))
+    return _default
+  if not isinstance(serializer, str):
+    return serializer
+  for backend in BACKENDS:
+    if backend.name == serializer:
+      try:
+        return backend()
+      except ImportError:
+        raise ImportError("JSON serializer '{0}' is not installed, install it with 'pip install {0}'".format(serializer))
+  raise ValueError("Unknown JSON serializer '{}', expected one of {}".format(serializer, [backend.name for backend in BACKENDS]))
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+import os
+import re
+import json
+import time
+import threading
+from urllib.parse import urlparse
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+SESSION_COOKIE = 'JSESSIONID'
+
+_COOKIE_HEADER = re.compile(SESSION_COOKIE + r'=([^;\s]+)')
+
+def request_session_id(request):
+  """
+  JSESSIONID sent with a prepared request, None when it carried no session
+  """
+  match = _COOKIE_HEADER.search(request.headers.get('Cookie', '')) if request is not None else None
+  return match.group(1) if match else None
+
+class SessionManager:
+  """
+  Owns the JSESSIONID lifecycle of one or more api clients
+
+  The first request logs in lazily, and the session is renewed before
+  ZIA's idle or absolute timeout instead of waiting for a 401. Concurrent
+  re-authentication is single-flighted: when many threads see an expired
+  or rejected session, one logs in and the rest reuse its cookie. Clients
+  constructed with the same manager share one session, and `session_file`
+  persists it so short lived CLI processes can skip the
+  /authenticatedSession round-trip.
+
+  Attributes
+  ----------
+  idle_timeout : float
+    seconds of inactivity after which ZIA drops the session (30 minutes)
+  max_age : float
+    seconds after which the session is renewed regardless of activity, None to disable
+  margin : float
+    renew this many seconds before either timeout is reached
+  session_file : str
+    optional path the session cookie is saved to and reused from (written with mode 0600)
+  """
+
+  def __init__(self, idle_timeout=1800, max_age=7200, margin=60, session_file=None):
+    self.idle_timeout = idle_timeout
+    self.max_age = max_age
+    self.margin = margin
+    self.session_file = os.path.expanduser(session_file) if session_file else None
+    self.session_id = None
+    self.logged_in_at = None
+    self.last_used = None
+    self._lock = threading.Lock()
+    self._file_checked = False
+    self._saved_at = 0
+
+  def valid(self, now=None):
+    if self.logged_in_at is None:
+      return False
+    now = now or time.time()
+    if now - self.last_used > self.idle_timeout - self.margin:
+      return False
+    if self.max_age is not None and now - self.logged_in_at > self.max_age - self.margin:
+      return False
+    return True
+
+  def ensure(self, api):
+    """
+    Makes sure `api` carries a live session cookie, logging in at most once
+    across threads when there is none
+    """
+    if not self.valid():
+      with self._lock:
+        if not self._file_checked:
+          self._file_checked = True
+          self._load(api)
+        if not self.valid():
+          self._login(api)
+    self._install(api)
+    self.last_used = time.time()
+    # keep the persisted idle clock roughly current for the next process
+    if self.session_file and self.last_used - self._saved_at > 60:
+      with self._lock:
+        self._save(api)
+
+  def login(self, api):
+    """
+    Forces a new session, returning the /authenticatedSession response
+    """
+    with self._lock:
+      return self._login(api)
+
+  def _login(self, api):
+    logger.debug("Session Manager - creating new session")
+    response = api._authenticate()
+    self.session_id = self._cookie(api)
+    self.logged_in_at = self.last_used = time.time()
+    self._save(api)
+    return response
+
+  def invalidate(self, session_id=None):
+    """
+    Marks the session expired after a 401. With a session_id only that
+    session is dropped, so threads that were rejected with a cookie another
+    thread has already replaced do not log in again.
+    """
+    with self._lock:
+      if session_id is None or session_id == self.session_id:
+        logger.debug("Session Manager - session rejected, will log in again")
+        self.logged_in_at = None
+
+  def clear(self):
+    with self._lock:
+      self.session_id = None
+      self.logged_in_at = None
+      self.last_used = None
+      if self.session_file and os.path.exists(self.session_file):
+        os.remove(self.session_file)
+
+  def _cookie(self, api):
+    session_id = None
+    for cookie in api.session.cookies:
+      if cookie.name == SESSION_COOKIE:
+        session_id = cookie.value
+    return session_id
+
+  def _install(self, api):
+    if self.session_id is None or self._cookie(api) == self.session_id:
+      return
+    jar = api.session.cookies
+    for cookie in [cookie for cookie in jar if cookie.name == SESSION_COOKIE]:
+      jar.clear(cookie.domain, cookie.path, cookie.name)
+    jar.set(SESSION_COOKIE, self.session_id, domain=urlparse(api.url).hostname, path='/')
+
+  def _save(self, api):
+    if not self.session_file or self.session_id is None:
+      return
+    state = {
+      'url': api.url,
+      'username': api.username,
+      'session_id': self.session_id,
+      'logged_in_at': self.logged_in_at,
+      'last_used': self.last_used,
+    }
+    fd = os.open(self.session_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+      json.dump(state, f)
+    self._saved_at = time.time()
+
+  def _load(self, api):
+    if not self.session_file or not os.path.exists(self.session_file):
+      return
+    try:
+      with open(self.session_file) as f:
+        state = json.load(f)
+    except ValueError:
+      logger.warning("Session Manager - ignoring unreadable session file {}".format(self.session_file))
+      return
+    if state.get('url') != api.url or state.get('username') != api.username:
+      return
+    self.session_id = state['session_id']
+    self.logged_in_at = state['logged_in_at']
+    self.last_used = state['last_used']
+    if self.valid():
+      logger.debug("Session Manager - reusing session from {}".format(self.session_file))
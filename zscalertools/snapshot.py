@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+
+import json
+import time
+import sqlite3
+import ipaddress
+import threading
+
+from .models import to_dicts
+from .locations import iter_records
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, name TEXT COLLATE NOCASE, email TEXT COLLATE NOCASE,
+                                  department_id INTEGER, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS users_name ON users (name);
+CREATE INDEX IF NOT EXISTS users_email ON users (email);
+CREATE INDEX IF NOT EXISTS users_department ON users (department_id);
+CREATE TABLE IF NOT EXISTS user_groups (group_id INTEGER NOT NULL, user_id INTEGER NOT NULL,
+                                        PRIMARY KEY (group_id, user_id)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS user_groups_user ON user_groups (user_id);
+CREATE TABLE IF NOT EXISTS departments (id INTEGER PRIMARY KEY, name TEXT COLLATE NOCASE, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS departments_name ON departments (name);
+CREATE TABLE IF NOT EXISTS groups (id INTEGER PRIMARY KEY, name TEXT COLLATE NOCASE, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS groups_name ON groups (name);
+CREATE TABLE IF NOT EXISTS locations (id INTEGER PRIMARY KEY, name TEXT COLLATE NOCASE, parent_id INTEGER,
+                                      data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS locations_name ON locations (name);
+CREATE INDEX IF NOT EXISTS locations_parent ON locations (parent_id);
+CREATE TABLE IF NOT EXISTS location_ips (start TEXT NOT NULL, end TEXT NOT NULL, location_id INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS location_ips_start ON location_ips (start, end);
+"""
+
+_BATCH_SIZE = 5000
+
+def _ip_key(address):
+  """
+  Fixed width hex key for an address so IPv4 and IPv6 ranges compare as text
+  """
+  ip = ipaddress.ip_address(address)
+  if ip.version == 4:
+    ip = ipaddress.IPv6Address('::ffff:' + str(ip))
+  return '{:032x}'.format(int(ip))
+
+def _ip_range(value):
+  """
+  Returns the (start, end) keys of a ZIA ipAddresses entry, which is a
+  single address, a 'first-last' range or a CIDR block
+  """
+  value = value.strip()
+  if '-' in value:
+    first, last = value.split('-', 1)
+    return _ip_key(first.strip()), _ip_key(last.strip())
+  if '/' in value:
+    network = ipaddress.ip_network(value, strict=False)
+    return _ip_key(network.network_address), _ip_key(network.broadcast_address)
+  return _ip_key(value), _ip_key(value)
+
+def _batched(rows, size=_BATCH_SIZE):
+  batch = []
+  for row in rows:
+    batch.append(row)
+    if len(batch) >= size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+class Snapshot:
+  """
+  Local SQLite copy of the users, departments, groups and locations of a tenant
+
+  Records are kept as their raw JSON next to indexed columns for id,
+  name/email, department, group membership, location name and location IP
+  ranges, so lookups that used to be linear scans over pull_all_user_data()
+  are single index probes.
+
+    snapshot = Snapshot('tenant.db')
+    snapshot.refresh(zia_api)
+    snapshot.find_users(dept='Finance', group='VPN Users')
+    snapshot.user_by_email('jane@example.com')
+    snapshot.locations_by_ip('10.1.2.3')
+
+  Attributes
+  ----------
+  path : str
+    SQLite database file, ':memory:' (the default) keeps the snapshot in memory
+  """
+
+  def __init__(self, path=':memory:'):
+    self.path = path
+    self._lock = threading.RLock()
+    self._conn = sqlite3.connect(path, check_same_thread=False)
+    self._conn.executescript(_SCHEMA)
+
+  def close(self):
+    self._conn.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    self.close()
+
+  @property
+  def refreshed(self):
+    """
+    Unix time of the last refresh()/load(), None for an empty snapshot
+    """
+    row = self._query_one("SELECT value FROM meta WHERE key = 'refreshed'")
+    return float(row[0]) if row else None
+
+  def refresh(self, api, locations=True):
+    """
+    Replaces the snapshot with the current tenant data, pulled page by page
+    through the api iter_* methods so the full dataset is never held in memory
+    """
+    logger.info("Zscaler Snapshot - Refreshing {}".format(self.path))
+    location_records = iter_records(api.iter_location_tree()) if locations else None
+    self.load(api.iter_users(), api.iter_departments(), api.iter_groups(), location_records)
+    logger.info("Zscaler Snapshot - Refresh Complete - {}".format(self.counts()))
+    return self
+
+  def load(self, users, departments, groups, locations=None):
+    """
+    Replaces the snapshot with the given records, e.g. the three lists
+    returned by api.pull_all_user_data() (compact or not), in a single transaction
+    """
+    with self._lock, self._conn:
+      self._conn.execute("DELETE FROM users")
+      self._conn.execute("DELETE FROM user_groups")
+      self._conn.execute("DELETE FROM departments")
+      self._conn.execute("DELETE FROM groups")
+      for batch in _batched(to_dicts(users)):
+        self._conn.executemany("INSERT OR REPLACE INTO users (id, name, email, department_id, data) VALUES (?, ?, ?, ?, ?)",
+                               [(user['id'], user.get('name'), user.get('email'), (user.get('department') or {}).get('id'),
+                                 json.dumps(user)) for user in batch])
+        self._conn.executemany("INSERT OR IGNORE INTO user_groups (group_id, user_id) VALUES (?, ?)",
+                               [(group['id'], user['id']) for user in batch for group in user.get('groups') or []])
+      for batch in _batched(to_dicts(departments)):
+        self._conn.executemany("INSERT OR REPLACE INTO departments (id, name, data) VALUES (?, ?, ?)",
+                               [(department['id'], department.get('name'), json.dumps(department)) for department in batch])
+      for batch in _batched(to_dicts(groups)):
+        self._conn.executemany("INSERT OR REPLACE INTO groups (id, name, data) VALUES (?, ?, ?)",
+                               [(group['id'], group.get('name'), json.dumps(group)) for group in batch])
+      if locations is not None:
+        self._conn.execute("DELETE FROM locations")
+        self._conn.execute("DELETE FROM location_ips")
+        for batch in _batched(locations):
+          self._conn.executemany("INSERT OR REPLACE INTO locations (id, name, parent_id, data) VALUES (?, ?, ?, ?)",
+                                 [(location['id'], location.get('name'), location.get('parentId'), json.dumps(location))
+                                  for location in batch])
+          self._conn.executemany("INSERT INTO location_ips (start, end, location_id) VALUES (?, ?, ?)",
+                                 list(self._location_ip_rows(batch)))
+      self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('refreshed', ?)", (str(time.time()),))
+    return self
+
+  def _location_ip_rows(self, locations):
+    for location in locations:
+      for value in location.get('ipAddresses') or []:
+        try:
+          start, end = _ip_range(value)
+        except ValueError:
+          logger.warning("Zscaler Snapshot - Skipping invalid IP {} on location {}".format(value, location['id']))
+          continue
+        yield start, end, location['id']
+
+  def _query(self, sql, params=()):
+    with self._lock:
+      return self._conn.execute(sql, params).fetchall()
+
+  def _query_one(self, sql, params=()):
+    with self._lock:
+      return self._conn.execute(sql, params).fetchone()
+
+  def _records(self, sql, params=()):
+    return [json.loads(row[0]) for row in self._query(sql, params)]
+
+  def _record(self, sql, params=()):
+    row = self._query_one(sql, params)
+    return json.loads(row[0]) if row else None
+
+  def counts(self):
+    return {table: self._query_one("SELECT COUNT(*) FROM {}".format(table))[0]
+            for table in ('users', 'departments', 'groups', 'locations')}
+
+  def _department_id(self, dept):
+    if isinstance(dept, int):
+      return dept
+    row = self._query_one("SELECT id FROM departments WHERE name = ?", (dept,))
+    return row[0] if row else None
+
+  def _group_id(self, group):
+    if isinstance(group, int):
+      return group
+    row = self._query_one("SELECT id FROM groups WHERE name = ?", (group,))
+    return row[0] if row else None
+
+  def find_users(self, dept=None, group=None, name=None, email=None):
+    """
+    Returns the users matching every given filter. dept and group accept an
+    ID or a name, name and email match exactly (case insensitive)
+    """
+    sql = "SELECT users.data FROM users"
+    where, params = [], []
+    if group is not None:
+      sql += " JOIN user_groups ON user_groups.user_id = users.id"
+      where.append("user_groups.group_id = ?")
+      params.append(self._group_id(group))
+    if dept is not None:
+      where.append("users.department_id = ?")
+      params.append(self._department_id(dept))
+    if name is not None:
+      where.append("users.name = ?")
+      params.append(name)
+    if email is not None:
+      where.append("users.email = ?")
+      params.append(email)
+    if where:
+      sql += " WHERE " + " AND ".join(where)
+    return self._records(sql + " ORDER BY users.id", params)
+
+  def user(self, id):
+    return self._record("SELECT data FROM users WHERE id = ?", (id,))
+
+  def user_by_email(self, email):
+    return self._record("SELECT data FROM users WHERE email = ?", (email,))
+
+  def user_groups(self, user_id):
+    return self._records("SELECT groups.data FROM user_groups JOIN groups ON groups.id = user_groups.group_id "
+                         "WHERE user_groups.user_id = ? ORDER BY groups.id", (user_id,))
+
+  def department(self, id):
+    return self._record("SELECT data FROM departments WHERE id = ?", (id,))
+
+  def department_by_name(self, name):
+    return self._record("SELECT data FROM departments WHERE name = ?", (name,))
+
+  def group(self, id):
+    return self._record("SELECT data FROM groups WHERE id = ?", (id,))
+
+  def group_by_name(self, name):
+    return self._record("SELECT data FROM groups WHERE name = ?", (name,))
+
+  def location(self, id):
+    return self._record("SELECT data FROM locations WHERE id = ?", (id,))
+
+  def location_by_name(self, name):
+    return self._record("SELECT data FROM locations WHERE name = ?", (name,))
+
+  def sublocations(self, parent_id):
+    return self._records("SELECT data FROM locations WHERE parent_id = ? ORDER BY id", (parent_id,))
+
+  def locations_by_ip(self, address):
+    """
+    Returns the locations whose ipAddresses contain `address`, most specific
+    range (sub-locations) first
+    """
+    key = _ip_key(address)
+    return self._records("SELECT locations.data FROM location_ips JOIN locations ON locations.id = location_ips.location_id "
+                         "WHERE location_ips.start <= ? AND location_ips.end >= ? "
+                         "GROUP BY locations.id ORDER BY MAX(location_ips.start) DESC, MIN(location_ips.end)", (key, key))
+
+  def users(self):
+    return self._records("SELECT data FROM users ORDER BY id")
+
+  def departments(self):
+    return self._records("SELECT data FROM departments ORDER BY id")
+
+  def groups(self):
+    return self._records("SELECT data FROM groups ORDER BY id")
+
+  def locations(self):
+    return self._records("SELECT data FROM locations ORDER BY id")
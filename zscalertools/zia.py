@@ -4,74 +4,337 @@ import time
 import datetime
 import re
 import json
+import codecs
+import asyncio
+import threading
+import collections
 import requests
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from functools import wraps
 from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectionError, HTTPError
+from .ratelimit import RateLimiter
+from . import bulk
+from .cache import cache_scope, invalidation_match
+from .snapshot import Snapshot
+from .export import Exporter, KINDS as EXPORT_KINDS
+from . import delta
+from . import locations as location_tree
+from . import models
+from .serializer import get_serializer
+from .activation import ActivationCoordinator
+from .retries import RetryPolicy, THROTTLE, SESSION
+from .session import SessionManager, request_session_id
 
-import logging
+try:
+  import aiohttp
+except ImportError:
+  aiohttp = None
 
-zapi_adapter = HTTPAdapter(max_retries=3)
+import logging
 
 logger = logging.getLogger(__name__)
 
+# largest pageSize ZIA honours, bigger pages are silently truncated to it
+MAX_PAGE_SIZE = 1000
+
 class ZiaThrottleException(Exception):
-  def __init__(self, text):
+  def __init__(self, text, retry_after=None):
     self.text = text
+    self.retry_after = retry_after
 
 class ZiaSessionException(Exception):
-  def __init__(self, text):
+  def __init__(self, text, session_generation=None):
     self.text = text
+    # AsyncApi login count when the rejected request was sent, see AsyncApi._reauthenticate
+    self.session_generation = session_generation
 
-def retry(exceptions, tries=4, delay=3, backoff=2):
+def _retry_after(e, default=1):
   """
-  Retry calling the decorated function using an exponential backoff.
+  Seconds to wait after a 429, read from the Retry-After header or the
+  'Retry-After' field of the body (e.g. "12 seconds"), plus one.
+  """
+  value = e.retry_after
+  if value is None:
+    try:
+      value = json.loads(e.text).get('Retry-After')
+    except (ValueError, TypeError, AttributeError):
+      value = None
+  match = re.search(r'\d+', str(value)) if value is not None else None
+  return (int(match.group()) if match else default) + 1
+
+def _record_retry(args, f, reason):
+  metrics = getattr(args[0], 'metrics', None) if args else None
+  if metrics is not None:
+    metrics.record_retry(f.__name__, reason)
+
+def _body_size(data):
+  if data is None:
+    return 0
+  return len(data.encode('utf-8') if isinstance(data, str) else data)
+
+def _retry_policy(args):
+  policy = getattr(args[0], 'retry_policy', None) if args else None
+  return policy if policy is not None else RetryPolicy()
+
+def retry(exceptions, idempotent=True):
+  """
+  Retry calling the decorated method as decided by the client's RetryPolicy,
+  which sets the number of tries and the delays.
 
   Args:
       exceptions: The exception to check. may be a tuple of
           exceptions to check.
-      tries: Number of times to try (not retry) before giving up.
-      delay: Initial delay between retries in seconds.
-      backoff: Backoff multiplier (e.g. value of 2 will double the delay
-          each retry).
+      idempotent: False for calls that must not be repeated after they
+          may have reached ZIA (creates), see RetryPolicy.
   """
   def deco_retry(f):
     @wraps(f)
     def f_retry(*args, **kwargs):
-      mtries, mdelay = tries, delay
-      while mtries > 1:
+      policy = _retry_policy(args)
+      attempt, mdelay = 1, None
+      while True:
+        policy.budget.deposit()
         try:
           return f(*args, **kwargs)
-        except ZiaThrottleException as e:
-          retry_after = int(json.loads(e.text)['Retry-After'][0]) + 1
-          logger.info("{}, Retrying in {} seconds...".format(e, retry_after))
-          time.sleep(retry_after)
-          mtries -= 1
-        except ZiaSessionException as e:
-          logger.error("Error Received - {}.  Need to re-generate session".format(e))
         except exceptions as e:
-          logger.info("{}, Retrying in {} seconds...".format(e, mdelay))
-          time.sleep(mdelay)
-          mtries -= 1
-          mdelay *= backoff
-      return f(*args, **kwargs)
+          kind = policy.classify(e)
+          if not policy.should_retry(e, kind, attempt, idempotent):
+            raise
+          if kind == THROTTLE:
+            retry_after = _retry_after(e)
+            logger.info("{}, Retrying in {} seconds...".format(e, retry_after))
+            # close the client wide gate so parallel workers back off together
+            throttle = getattr(args[0], '_throttle', None) if args else None
+            if throttle:
+              throttle(retry_after)
+            else:
+              time.sleep(retry_after)
+          elif kind == SESSION:
+            logger.error("Error Received - {}.  Need to re-generate session".format(e))
+          else:
+            mdelay = policy.backoff(mdelay)
+            logger.info("{}, Retrying in {:.2f} seconds...".format(e, mdelay))
+            time.sleep(mdelay)
+          _record_retry(args, f, kind)
+          attempt += 1
     return f_retry  # true decorator
   return deco_retry
+
+def async_retry(exceptions, idempotent=True):
+  """
+  asyncio equivalent of retry for coroutine methods on AsyncApi.
+  """
+  def deco_retry(f):
+    @wraps(f)
+    async def f_retry(*args, **kwargs):
+      policy = _retry_policy(args)
+      attempt, mdelay = 1, None
+      while True:
+        policy.budget.deposit()
+        try:
+          return await f(*args, **kwargs)
+        except exceptions as e:
+          kind = policy.classify(e)
+          if not policy.should_retry(e, kind, attempt, idempotent):
+            raise
+          if kind == THROTTLE:
+            retry_after = _retry_after(e)
+            logger.info("{}, Retrying in {} seconds...".format(e, retry_after))
+            throttle = getattr(args[0], '_throttle', None) if args else None
+            if throttle:
+              throttle(retry_after)
+            else:
+              await asyncio.sleep(retry_after)
+          elif kind == SESSION:
+            logger.error("Error Received - {}.  Need to re-generate session".format(e))
+            reauthenticate = getattr(args[0], '_reauthenticate', None) if args else None
+            if reauthenticate:
+              await reauthenticate(getattr(e, 'session_generation', None))
+          else:
+            mdelay = policy.backoff(mdelay)
+            logger.info("{}, Retrying in {:.2f} seconds...".format(e, mdelay))
+            await asyncio.sleep(mdelay)
+          _record_retry(args, f, kind)
+          attempt += 1
+    return f_retry
+  return deco_retry
+
+def _iter_json_array(response, chunk_size=65536):
+  """
+  Incrementally decode a top level JSON array from a streamed response,
+  yielding one element at a time so a large page is never decoded at once.
+  """
+  decoder = json.JSONDecoder()
+  text_decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')()
+  buffer = ''
+  pos = 0
+  started = False
+  try:
+    chunks = response.iter_content(chunk_size=chunk_size)
+    finished = False
+    while not finished:
+      chunk = next(chunks, None)
+      if chunk is None:
+        buffer += text_decoder.decode(b'', final=True)
+        finished = True
+      else:
+        buffer += text_decoder.decode(chunk)
+      while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+          pos += 1
+        if pos >= len(buffer):
+          break
+        if not started:
+          if buffer[pos] != '[':
+            raise ValueError("Expected a JSON array in response body")
+          started = True
+          pos += 1
+          continue
+        if buffer[pos] == ']':
+          return
+        try:
+          record, end = decoder.raw_decode(buffer, pos)
+        except ValueError:
+          if finished:
+            raise
+          break
+        # a scalar is only complete once a delimiter follows it, '12.' or '1e' may continue in the next chunk
+        if not finished and not isinstance(record, (dict, list)) and (end == len(buffer) or buffer[end] not in ' \t\r\n,]'):
+          break
+        pos = end
+        yield record
+      buffer = buffer[pos:]
+      pos = 0
+    if not started:
+      raise ValueError("Expected a JSON array in response body")
+    raise ValueError("Truncated JSON array in response body")
+  finally:
+    response.close()
  
-class api:
+class _ZiaBase:
+  """
+  State and URL helpers shared by the synchronous and asyncio clients
+  """
+
+  def __init__(self, cloud, username, password, apikey, page_size=1000, concurrency=4, rate_limiter=None, metrics=None,
+               serializer=None, retry_policy=None, max_page_size=MAX_PAGE_SIZE):
+    # a cloud with a scheme (e.g. 'http://127.0.0.1:8080') is used as is, for the mock server in test/
+    self.url = "{}/api/v1".format(cloud.rstrip('/')) if '://' in cloud else "https://{}/api/v1".format(cloud)
+    self.username = username
+    self.password = password
+    self.apikey = apikey
+    self.page_size = page_size
+    self.max_page_size = max_page_size
+    self.concurrency = max(1, concurrency)
+    self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter()
+    self.metrics = metrics
+    self.serializer = get_serializer(serializer)
+    self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+
+    self._throttle_lock = threading.Lock()
+    self._throttled_until = 0
+    self._throttle_count = 0
+
+    self.jsessionid = None
+
+  def obfuscateApiKey (self):
+    seed = self.apikey
+    now = int(time.time() * 1000)
+    n = str(now)[-6:]
+    r = str(int(n) >> 1).zfill(6)
+    key = ""
+    for i in range(0, len(str(n)), 1):
+      key += seed[int(str(n)[i])]
+    for j in range(0, len(str(r)), 1):
+      key += seed[int(str(r)[j])+2]
+
+    return now, key
+
+  def _url(self, path):
+
+    return self.url + path
+  
+  def _append_url_query(self, current_path, attribute, value):
+    if current_path.endswith('?'):
+      return "{}{}={}".format(current_path, attribute, value)
+    else:
+      return "{}&{}={}".format(current_path, attribute, value)
+
+  def _throttle(self, retry_after):
+    with self._throttle_lock:
+      self._throttled_until = max(self._throttled_until, time.time() + retry_after)
+      self._throttle_count += 1
+
+  def _page_size(self, pageSize=None):
+    """
+    pageSize actually served, a short page only marks the end of a listing
+    when the request did not ask for more than the server returns
+    """
+    return min(pageSize or self.page_size, self.max_page_size)
+
+  def _decode(self, body):
+    """
+    Decodes a response body straight from its bytes, None for an empty body (e.g. a 204)
+    """
+    if not body or body.isspace():
+      return None
+    return self.serializer.loads(body)
+
+  def _query_path(self, api_path, **params):
+    for attribute, value in params.items():
+      if value is None:
+        continue
+      if isinstance(value, bool):
+        value = str(value).lower()
+      api_path = self._append_url_query(api_path, attribute, value)
+    return api_path
+
+
+class api(_ZiaBase):
   """
   Class to represent Zscaler Internet Security Instance
   
   Attributes
   ----------
   cloud : str
-    a string containing the zscaler cloud to use
+    a string containing the zscaler cloud to use, or a full base URL such as 'http://127.0.0.1:8080'
   username : str
     the username of the account to connect to the zscaler cloud
   password : str
     the password for the username string
   apikey : str
     apikey needed to connect to zscaler cloud
+  page_size : int
+    number of records requested per page by the iter_* methods (default 1000)
+  max_page_size : int
+    largest pageSize the server honours (default MAX_PAGE_SIZE), larger
+    page_size/pageSize values are clamped to it
+  concurrency : int
+    number of pages prefetched in parallel during bulk reads (default 4)
+  rate_limiter : ratelimit.RateLimiter
+    token bucket limiter every request waits on before it is sent, defaults to
+    the published ZIA quotas (ratelimit.DEFAULT_RATE_LIMITS)
+  cache : cache.MemoryCache or cache.SqliteCache
+    opt-in response cache for get_user, get_department, get_group, get_location
+    and get_locations_lite, entries are dropped when a write touches the same resource.
+    Keys are scoped to the cloud and username, so a cache can be shared or persisted safely
+  session_manager : session.SessionManager
+    logs in lazily on the first request and renews the session before it times
+    out, pass one with a session_file to reuse the session between processes
+  metrics : metrics.Metrics
+    optional instrumentation receiving latency, bytes, status, retry and
+    throttling wait events per endpoint and method
+  serializer : str or serializer.JsonSerializer
+    JSON backend for request and response bodies, 'orjson', 'ujson', 'json'
+    or an instance (default: the fastest one installed)
+  retry_policy : retries.RetryPolicy
+    classifies failures and decides which calls are retried, with jittered
+    delays and a retry budget (default: 3 tries and a budget of this client's own)
+  activation : activation.ActivationCoordinator
+    debounces request_activation() calls from every thread (and every client of
+    the same cloud and username sharing it) into one /status/activate and polls
+    /status until it is ACTIVE
     
   Zscaler Methods
   ---------------
@@ -79,7 +342,7 @@ class api:
     API Authentication
     ------------------
     login()
-      Attempts to create a web session to Zscaler API
+      Creates a new web session to Zscaler API (called automatically before the first request)
     logout()
       Delete's existing web session to Zscaler API
     
@@ -89,19 +352,27 @@ class api:
       Gets the activation status for a configuration change
     activate_status()
       Activates configuration changes
+    request_activation(wait=True, timeout=None)
+      Queues a debounced activation shared with other threads and waits until /status is ACTIVE
 
     User Management
     ---------------
     get_users(name=None, dept=None, group=None, page=None, pageSize=None)
       Gets a list of all users and allows user filtering by name, department, or group
+    iter_users(name=None, dept=None, group=None, pageSize=None, stream=False)
+      Yields every user one at a time, walking page/pageSize automatically
     get_user(id)
       Gets the user information for the specified ID
     get_groups(search=None, page=None, pageSize=None)
       Gets a list of groups
+    iter_groups(search=None, pageSize=None, stream=False)
+      Yields every group one at a time, walking page/pageSize automatically
     get_group(id)
       Gets the group for the specified ID
     get_departments(search=None, name=None, page=None, pageSize=None)
       Gets a list of departments
+    iter_departments(search=None, name=None, pageSize=None, stream=False)
+      Yields every department one at a time, walking page/pageSize automatically
     get_department(id)
       Gets the department for the specified ID
     add_user(user_object)
@@ -117,10 +388,14 @@ class api:
     -------------------
     get_locations(search=None, sslScanEnabled=None, xffEnabled=None, authRequired=None, bwEnforced=None, page=None, pageSize=None)
       Gets information on locations
+    iter_locations(search=None, sslScanEnabled=None, xffEnabled=None, authRequired=None, bwEnforced=None, pageSize=None, stream=False)
+      Yields every location one at a time, walking page/pageSize automatically
     get_location(id)
       Gets the location information for the specified ID
     get_sublocations(id, search=None, sslScanEnabled=None, xffEnabled=None, authRequired=None, bwEnforced=None, page=None, pageSize=None, enforceAup=None, enableFirewall=None)
       Gets the sub-location information for the location with the specified ID. These are the sub-locations associated to the parent location
+    iter_sublocations(id, search=None, sslScanEnabled=None, xffEnabled=None, authRequired=None, bwEnforced=None, pageSize=None, enforceAup=None, enableFirewall=None, stream=False)
+      Yields every sub-location of the specified location one at a time
     add_location(location_object)
       Adds new locations and sub-locations
     get_locations_lite(includeSubLocations=None, includeParentLocations=None, sslScanEnabled=None, search=None, page=None, pageSize=None)
@@ -134,59 +409,149 @@ class api:
 
   Custom Methods
   -------
-  pull_all_user_data()
-    Pulls all users, departments and groups and returns 3 arrays (up to 999,999 entries a piece)
+  pull_all_user_data(pageSize=None, stream=False, compact=False)
+    Pulls all users, departments and groups page by page and returns 3 arrays, or a compact models.UserData
+  bulk_sync_users(desired_users, delete_missing=False, activate=True)
+    Creates, updates and (optionally) deletes users so ZIA matches desired_users and returns a bulk.BulkSyncReport
+  bulk_delete_users_chunked(ids)
+    Bulk deletes any number of users in requests of 500
+  bulk_delete_locations_chunked(ids)
+    Bulk deletes any number of locations in requests of 100
+  cache_stats()
+    Returns hit/miss/revalidation/invalidation counts of the response cache, None when caching is off
+  snapshot(path=':memory:', locations=True)
+    Pulls users, departments, groups and locations into an indexed snapshot.Snapshot
+  iter_location_tree(pageSize=None)
+    Yields (parent, sub-locations) for every location, fetching sub-locations of parents that have any in parallel
+  get_location_tree(pageSize=None)
+    Collects iter_location_tree() into a locations.LocationTree (parent -> children)
+  iter_changes(previous=None, state=None)
+    Yields (kind, action, record or id) for every record added, changed or removed since the previous delta.DeltaState
+  pull_changes(previous=None)
+    Collects iter_changes() into a delta.Changes whose state is the baseline for the next run
+  export(directory, format='ndjson', compression=None, kinds=None, flatten=None, pageSize=None, resume=True)
+    Streams users, departments, groups, locations and sub-locations to NDJSON, CSV or Parquet files, resuming an interrupted export
+
+  Paging
+  ------
+  The iter_* methods request pages of `page_size` records (1000 unless
+  overridden in the constructor, and never more than `max_page_size`) until a
+  short or empty page is returned.
+  Passing stream=True decodes each page incrementally from the socket instead
+  of loading the whole response body at once.
+
+  When `concurrency` is greater than 1 and the first page comes back full,
+  the next pages are prefetched on a bounded thread pool while the caller
+  consumes the current one. A 429 on any
+  request closes a client wide gate that every request waits on, and shrinks
+  the prefetch window of running iterators to a single page.
   """
 
-  def __init__(self, cloud, username, password, apikey):
+  def __init__(self, cloud, username, password, apikey, page_size=1000, concurrency=4, rate_limiter=None, cache=None,
+               session_manager=None, metrics=None, serializer=None, activation=None, retry_policy=None,
+               max_page_size=MAX_PAGE_SIZE):
 
     logger.debug('Calling Init method called for zia class')
-    self.url = "https://{}/api/v1".format(cloud)
-    self.username = username
-    self.password = password
-    self.apikey = apikey
+    super().__init__(cloud, username, password, apikey, page_size=page_size, concurrency=concurrency,
+                     rate_limiter=rate_limiter, metrics=metrics, serializer=serializer, retry_policy=retry_policy,
+                     max_page_size=max_page_size)
+    self.cache = cache
+    self._cache_scope = cache_scope(self.url, self.username)
+    self.session_manager = session_manager if session_manager is not None else SessionManager()
+    self.activation = activation if activation is not None else ActivationCoordinator()
     
-    zapi_adapter = HTTPAdapter(max_retries=3)
+    # retries are left to retry_policy, adapter level retries would multiply the attempts per call
+    zapi_adapter = HTTPAdapter(max_retries=0, pool_maxsize=max(10, self.concurrency))
     self.session = requests.Session()
     self.session.mount(self.url, zapi_adapter)
+    self.session.headers.update({ 'Content-Type' :  'application/json',
+                                  'cache-control': 'no-cache'})
 
+  def _wait_for_throttle(self):
+    waited = 0
+    while True:
+      with self._throttle_lock:
+        remaining = self._throttled_until - time.time()
+      if remaining <= 0:
+        return waited
+      time.sleep(remaining)
+      waited += remaining
 
-    self.jsessionid = None
-
-  def obfuscateApiKey (self):
-    seed = self.apikey
-    now = int(time.time() * 1000)
-    n = str(now)[-6:]
-    r = str(int(n) >> 1).zfill(6)
-    key = ""
-    for i in range(0, len(str(n)), 1):
-      key += seed[int(str(n)[i])]
-    for j in range(0, len(str(r)), 1):
-      key += seed[int(str(r)[j])+2]
+  def _request(self, method, api_path, **kwargs):
+    if api_path != '/authenticatedSession':
+      self.session_manager.ensure(self)
+    throttle_wait = self._wait_for_throttle()
+    rate_limit_wait = self.rate_limiter.acquire(method, api_path)
+    if self.metrics is None:
+      response = self.session.request(method, self._url(api_path), **kwargs)
+    else:
+      response = self._instrumented_request(method, api_path, throttle_wait, rate_limit_wait, **kwargs)
+    if self.cache is not None and method != 'GET':
+      self.cache.invalidate(invalidation_match(api_path, self._cache_scope))
+    return response
 
-    return now, key
+  def _instrumented_request(self, method, api_path, throttle_wait, rate_limit_wait, **kwargs):
+    if throttle_wait > 0:
+      self.metrics.record_wait('throttle_wait', method, api_path, throttle_wait)
+    if rate_limit_wait > 0:
+      self.metrics.record_wait('rate_limit_wait', method, api_path, rate_limit_wait)
+    request_bytes = _body_size(kwargs.get('data'))
+    started = time.perf_counter()
+    try:
+      response = self.session.request(method, self._url(api_path), **kwargs)
+    except Exception as e:
+      self.metrics.record_request(method, api_path, None, time.perf_counter() - started, request_bytes, error=e)
+      raise
+    if kwargs.get('stream'):
+      # streamed bodies are not read yet, fall back to the advertised size
+      response_bytes = int(response.headers.get('Content-Length') or 0)
+    else:
+      response_bytes = len(response.content)
+    self.metrics.record_request(method, api_path, response.status_code, time.perf_counter() - started,
+                                request_bytes, response_bytes)
+    return response
 
-  def _url(self, path):
+  def _get_cached(self, api_path):
+    if self.cache is None:
+      return self._handle_response(self._request('GET', api_path))
+    key = self._cache_scope + api_path
+    entry = self.cache.get(key)
+    if entry is not None and entry.fresh:
+      self.cache.incr('hits')
+      return entry.value
+    headers = {}
+    if entry is not None and entry.etag:
+      headers['If-None-Match'] = entry.etag
+    response = self._request('GET', api_path, headers=headers)
+    if response.status_code == 304 and entry is not None:
+      self.cache.incr('revalidations')
+      self.cache.touch(key)
+      return entry.value
+    self.cache.incr('misses')
+    result = self._handle_response(response)
+    self.cache.set(key, result, response.headers.get('ETag'))
+    return result
 
-    return self.url + path
-  
-  def _append_url_query(self, current_path, attribute, value):
-    if current_path.endswith('?'):
-      return "{}{}={}".format(current_path, attribute, value)
-    else:
-      return "{}&{}={}".format(current_path, attribute, value)
+  def cache_stats(self):
+    if self.cache is None:
+      return None
+    return self.cache.stats()
 
-  def _handle_response(self, response):
+  def _handle_response(self, response, stream=False):
     try:
       if response.ok:
-        return response.json()
+        if stream:
+          return _iter_json_array(response)
+        return self._decode(response.content)
       else:
         response.raise_for_status()
     except HTTPError as e:
       if response.status_code == 429:
-        raise ZiaThrottleException(response.text)
+        raise ZiaThrottleException(response.text, response.headers.get('Retry-After'))
       elif response.status_code == 401:
-        self.login()
+        # a rejected login must not trigger another login, the retry budget ends it
+        if not response.request.path_url.endswith('/authenticatedSession'):
+          self.session_manager.invalidate(request_session_id(response.request))
         raise ZiaSessionException(response.text)
       else:
         logger.error("Response - {} - {}".format(response.status_code, response.text))
@@ -194,209 +559,910 @@ class api:
     
   def login(self):
     logger.debug("login module called")
+
+    return self.session_manager.login(self)
+
+  def _authenticate(self):
     api_path = '/authenticatedSession'
     timestamp, obf_key = self.obfuscateApiKey()
-    self.session.headers.update({ 'Content-Type' :  'application/json',
-                                  'cache-control': 'no-cache'})
     body = {
       'apiKey': obf_key,
       'username': self.username,
       'password': self.password,
       'timestamp': timestamp,
     }
-    data = json.dumps(body)
+    data = self.serializer.dumps(body)
 
-    return self._handle_response(self.session.post(self._url(api_path), data=data))
+    return self._handle_response(self._request('POST', api_path, data=data))
   
   def logout(self):
     logger.debug("logout module called")
     api_path = '/authenticatedSession'
+    response = self._handle_response(self._request('DELETE', api_path))
+    self.session_manager.clear()
 
-    return self._handle_response(self.session.delete(self._url(api_path)))
+    return response
   
-  @retry(Exception, tries=3)
+  @retry(Exception)
   def get_users(self, name=None, dept=None, group=None, page=None, pageSize=None):
-    api_path = '/users?'
-    if name:
-      api_path = self._append_url_query(api_path, 'name', name)
-    if dept:
-      api_path = self._append_url_query(api_path, 'dept', dept)
-    if group:
-      api_path = self._append_url_query(api_path, 'page', page)
-    if pageSize:
-      api_path = self._append_url_query(api_path, 'pageSize', pageSize)
-
-    return self._handle_response(self.session.get(self._url(api_path)))
-    #return self.session.get(self._url(api_path))
-
-  @retry(Exception, tries=3)
+    api_path = self._query_path('/users?', name=name, dept=dept, group=group, page=page, pageSize=pageSize)
+
+    return self._handle_response(self._request('GET', api_path))
+
+  def iter_users(self, name=None, dept=None, group=None, pageSize=None, stream=False):
+    api_path = self._query_path('/users?', name=name, dept=dept, group=group)
+
+    return self._iter_pages(api_path, pageSize=pageSize, stream=stream)
+
+  @retry(Exception)
   def get_user(self, id):
     api_path = '/users/{}'.format(id)
 
-    return self._handle_response(self.session.get(self._url(api_path)))
+    return self._get_cached(api_path)
   
-  @retry(Exception, tries=3)
+  @retry(Exception)
   def get_groups(self, search=None, page=None, pageSize=None):
     logger.debug("get_groups module called")
-    api_path = '/groups'
+    api_path = self._query_path('/groups?', search=search, page=page, pageSize=pageSize)
     
-    return self._handle_response(self.session.get(self._url(api_path)))
+    return self._handle_response(self._request('GET', api_path))
+
+  def iter_groups(self, search=None, pageSize=None, stream=False):
+    api_path = self._query_path('/groups?', search=search)
 
-  @retry(Exception, tries=3)
+    return self._iter_pages(api_path, pageSize=pageSize, stream=stream)
+
+  @retry(Exception)
   def get_group(self, id):
-    api_path = '/group/{}'.format(id)
+    api_path = '/groups/{}'.format(id)
 
-    return self._handle_response(self.session.get(self._url(api_path)))
+    return self._get_cached(api_path)
 
-  @retry(Exception, tries=3)
-  def get_departments(self, name=None, page=None, pageSize=None):
+  @retry(Exception)
+  def get_departments(self, search=None, name=None, page=None, pageSize=None):
     logger.debug("get_departments module called")
-    api_path = '/departments?'
-    if pageSize:
-      api_path = api_path + "pageSize={}".format(pageSize)
+    api_path = self._query_path('/departments?', search=search, name=name, page=page, pageSize=pageSize)
     
-    return self._handle_response(self.session.get(self._url(api_path)))
+    return self._handle_response(self._request('GET', api_path))
+
+  def iter_departments(self, search=None, name=None, pageSize=None, stream=False):
+    api_path = self._query_path('/departments?', search=search, name=name)
+
+    return self._iter_pages(api_path, pageSize=pageSize, stream=stream)
   
-  @retry(Exception, tries=3)
+  @retry(Exception)
   def get_department(self, id):
     api_path = '/departments/{}'.format(id)
 
-    return self._handle_response(self.session.get(self._url(api_path)))
+    return self._get_cached(api_path)
   
-  @retry(Exception, tries=3)
+  @retry(Exception, idempotent=False)
   def add_user(self, user_object):
     api_path = '/users/'
-    data = json.dumps(user_object)
+    data = self.serializer.dumps(user_object)
     
-    return self._handle_response(self.session.post(self._url(api_path), data=data))
+    return self._handle_response(self._request('POST', api_path, data=data))
   
-  @retry(Exception, tries=3)
+  @retry(Exception)
   def update_user(self, id, user_object):
     api_path = '/users/{}'.format(id)
-    data = json.dumps(user_object)
+    data = self.serializer.dumps(user_object)
 
-    return self._handle_response(self.session.put(self._url(api_path), data=data))
+    return self._handle_response(self._request('PUT', api_path, data=data))
 
-  @retry(Exception, tries=3)
+  @retry(Exception)
   def delete_user(self, id):
     api_path = '/users/{}'.format(id)
 
-    return self._handle_response(self.session.delete(self._url(api_path)))
+    return self._handle_response(self._request('DELETE', api_path))
 
-  @retry(Exception, tries=3)
+  @retry(Exception)
   def bulk_delete_users(self, ids=[]):
     api_path = '/users/bulkDelete'
     body = {}
     body['ids'] = ids
-    data = json.dumps(body)
+    data = self.serializer.dumps(body)
     
-    return self._handle_response(self.session.post(self._url(api_path), data=data))
+    return self._handle_response(self._request('POST', api_path, data=data))
 
-  @retry(Exception, tries=3)
+  @retry(Exception)
   def get_status(self):
     api_path = '/status'
     
-    return self._handle_response(self.session.get(self._url(api_path)))
+    return self._handle_response(self._request('GET', api_path))
   
-  @retry(Exception, tries=3)
+  @retry(Exception)
   def activate_status(self):
     api_path = '/status/activate'
 
-    return self._handle_response(self.session.post(self._url(api_path)))
+    return self._handle_response(self._request('POST', api_path))
+
+  def request_activation(self, wait=True, timeout=None):
+    """
+    Queues an activation with the coordinator, returning the final /status
+    once the coalesced activation is ACTIVE (a Future with wait=False).
+    Raises activation.ActivationPending when it finished but newer changes
+    are still pending.
+    """
+    return self.activation.request(self, wait=wait, timeout=timeout)
   
-  @retry(Exception, tries=3)
+  @retry(Exception)
   def get_locations(self, search=None, sslScanEnabled=None, xffEnabled=None, authRequired=None, bwEnforced=None, page=None, pageSize=None):
-    api_path = '/locations?'
-    
-    if search:
-      api_path = self._append_url_query(api_path, 'search', search)
-    if sslScanEnabled:
-      api_path = self._append_url_query(api_path, 'sslScanEnabled', sslScanEnabled)
-    if xffEnabled:
-      api_path = self._append_url_query(api_path, 'xffEnabled', xffEnabled)
-    if authRequired:
-      api_path = self._append_url_query(api_path, 'authRequired', authRequired)
-    if bwEnforced:
-      api_path = self._append_url_query(api_path, 'bwEnforced', bwEnforced)
-    if page:
-      api_path = self._append_url_query(api_path, 'page', page)
-    if pageSize:
-      api_path = self._append_url_query(api_path, 'pageSize', pageSize)
-
-    return self._handle_response(self.session.get(self._url(api_path)))
+    api_path = self._query_path('/locations?', search=search, sslScanEnabled=sslScanEnabled, xffEnabled=xffEnabled,
+                                authRequired=authRequired, bwEnforced=bwEnforced, page=page, pageSize=pageSize)
+
+    return self._handle_response(self._request('GET', api_path))
+
+  def iter_locations(self, search=None, sslScanEnabled=None, xffEnabled=None, authRequired=None, bwEnforced=None, pageSize=None, stream=False):
+    api_path = self._query_path('/locations?', search=search, sslScanEnabled=sslScanEnabled, xffEnabled=xffEnabled,
+                                authRequired=authRequired, bwEnforced=bwEnforced)
+
+    return self._iter_pages(api_path, pageSize=pageSize, stream=stream)
   
-  @retry(Exception, tries=3)
+  @retry(Exception)
   def get_location(self, id):
     api_path = '/locations/{}'.format(id)
 
-    return self._handle_response(self.session.get(self._url(api_path)))
+    return self._get_cached(api_path)
   
-  @retry(Exception, tries=3)
+  @retry(Exception)
   def get_sublocations(self, id, search=None, sslScanEnabled=None, xffEnabled=None, authRequired=None, bwEnforced=None, page=None, pageSize=None, enforceAup=None, enableFirewall=None):
-    api_path = '/locations/{}/sublocations?'.format(id)
-    
-    if search:
-      api_path = self._append_url_query(api_path, 'search', search)
-    if sslScanEnabled:
-      api_path = self._append_url_query(api_path, 'sslScanEnabled', sslScanEnabled)
-    if xffEnabled:
-      api_path = self._append_url_query(api_path, 'xffEnabled', xffEnabled)
-    if authRequired:
-      api_path = self._append_url_query(api_path, 'authRequired', authRequired)
-    if bwEnforced:
-      api_path = self._append_url_query(api_path, 'bwEnforced', bwEnforced)
-    if page:
-      api_path = self._append_url_query(api_path, 'page', page)
-    if pageSize:
-      api_path = self._append_url_query(api_path, 'pageSize', pageSize)
-    if enforceAup:
-      api_path = self._append_url_query(api_path, 'enforceAup', enforceAup)
-    if enableFirewall:
-      api_path = self._append_url_query(api_path, 'enableFirewall', enableFirewall)
-
-
-    return self._handle_response(self.session.get(self._url(api_path)))
+    api_path = self._query_path('/locations/{}/sublocations?'.format(id), search=search, sslScanEnabled=sslScanEnabled,
+                                xffEnabled=xffEnabled, authRequired=authRequired, bwEnforced=bwEnforced, page=page,
+                                pageSize=pageSize, enforceAup=enforceAup, enableFirewall=enableFirewall)
+
+    return self._handle_response(self._request('GET', api_path))
+
+  def iter_sublocations(self, id, search=None, sslScanEnabled=None, xffEnabled=None, authRequired=None, bwEnforced=None, pageSize=None, enforceAup=None, enableFirewall=None, stream=False):
+    api_path = self._query_path('/locations/{}/sublocations?'.format(id), search=search, sslScanEnabled=sslScanEnabled,
+                                xffEnabled=xffEnabled, authRequired=authRequired, bwEnforced=bwEnforced,
+                                enforceAup=enforceAup, enableFirewall=enableFirewall)
+
+    return self._iter_pages(api_path, pageSize=pageSize, stream=stream)
+
+  def _location_parents_with_children(self):
+    """
+    Parent IDs taken from /locations/lite?includeSubLocations=true, None
+    when the lite listing can not be read so childCount is used instead
+    """
+    try:
+      api_path = self._query_path('/locations/lite?', includeSubLocations=True)
+      return location_tree.parent_ids(self._iter_pages_sequential(api_path, self.page_size, False))
+    except Exception as e:
+      logger.warning("Zscaler Helper - locations lite unavailable, using childCount - {}".format(e))
+      return None
+
+  def _get_all_sublocations(self, id, pageSize):
+    # one parent rarely has more than a page, so pages are not prefetched within the fan-out
+    return list(self._iter_pages_sequential('/locations/{}/sublocations?'.format(id), pageSize, False))
+
+  def iter_location_tree(self, pageSize=None):
+    """
+    Yields (parent, sub-locations) for every location as soon as its
+    sub-locations arrive. Parents without children (per /locations/lite, or
+    childCount) are yielded straight away, the others are fetched on up to
+    `concurrency` workers, a window that drops to one request after a 429.
+    """
+    pageSize = self._page_size(pageSize)
+    parents = self._location_parents_with_children()
+    window = self.concurrency
+    throttle_count = self._throttle_count
+    pending = {}
+    with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+      try:
+        for parent in self.iter_locations(pageSize=pageSize):
+          if not location_tree.has_children(parent, parents):
+            yield parent, []
+            continue
+          while len(pending) >= window:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+              yield pending.pop(future), future.result()
+            if self._throttle_count != throttle_count:
+              window = 1
+          pending[executor.submit(self._get_all_sublocations, parent['id'], pageSize)] = parent
+        while pending:
+          done, _ = wait(pending, return_when=FIRST_COMPLETED)
+          for future in done:
+            yield pending.pop(future), future.result()
+      finally:
+        for future in pending:
+          future.cancel()
+
+  def get_location_tree(self, pageSize=None):
+    logger.info("Zscaler Helper - Pulling Location Tree")
+    tree = location_tree.LocationTree(self.iter_location_tree(pageSize=pageSize))
+    logger.info("Zscaler Helper - Location Tree Complete - {!r}".format(tree))
+    return tree
   
-  @retry(Exception, tries=3)
+  @retry(Exception, idempotent=False)
   def add_location(self, location_object):
     api_path = '/locations'
-    data = json.dumps(location_object)
+    data = self.serializer.dumps(location_object)
     
-    return self._handle_response(self.session.post(self._url(api_path), data=data))
+    return self._handle_response(self._request('POST', api_path, data=data))
   
-  @retry(Exception, tries=3)
+  @retry(Exception)
   def get_locations_lite(self, includeSubLocations=None, includeParentLocations=None, sslScanEnabled=None, search=None, page=None, pageSize=None):
-    api_path = "/locations/lite" 
+    api_path = self._query_path('/locations/lite?', includeSubLocations=includeSubLocations, includeParentLocations=includeParentLocations,
+                                sslScanEnabled=sslScanEnabled, search=search, page=page, pageSize=pageSize)
     
-    return self._handle_response(self.session.get(self._url(api_path)))
+    return self._get_cached(api_path)
   
-  @retry(Exception, tries=3)
+  @retry(Exception)
   def update_location(self, id, location_object):
     api_path = '/locations/{}'.format(id)
-    data = json.dumps(location_object)
+    data = self.serializer.dumps(location_object)
 
-    return self._handle_response(self.session.put(self._url(api_path), data=data))
+    return self._handle_response(self._request('PUT', api_path, data=data))
   
-  @retry(Exception, tries=3)
+  @retry(Exception)
   def delete_location(self, id):
     api_path = '/locations/{}'.format(id)
 
-    return self._handle_response(self.session.delete(self._url(api_path), data=data))
+    return self._handle_response(self._request('DELETE', api_path))
   
-  @retry(Exception, tries=3)
+  @retry(Exception)
   def bulk_delete_locations(self, ids=[]):
     api_path = '/locations/bulkDelete'
     body = {}
     body['ids'] = ids
-    data = json.dumps(body)
+    data = self.serializer.dumps(body)
     
-    return self._handle_response(self.session.post(self._url(api_path), data=data))
+    return self._handle_response(self._request('POST', api_path, data=data))
 
-  def pull_all_user_data(self):
+  @retry(Exception)
+  def _get_page(self, api_path, stream=False):
+    return self._handle_response(self._request('GET', api_path, stream=stream), stream=stream)
+
+  def _iter_pages(self, api_path, pageSize=None, stream=False):
+    pageSize = self._page_size(pageSize)
+    # streamed pages are decoded off an open socket, so they are never prefetched
+    if self.concurrency > 1 and not stream:
+      return self._prefetch_pages(api_path, pageSize)
+    return self._iter_pages_sequential(api_path, pageSize, stream)
+
+  def _prefetch_pages(self, api_path, pageSize):
+    for page, records in self._prefetch_page_lists(api_path, pageSize):
+      for record in records:
+        yield record
+
+  def _prefetch_page_lists(self, api_path, pageSize, start=1):
+    pageSize = self._page_size(pageSize)
+    # the first page is fetched alone, most listings (departments, groups,
+    # sub-locations) fit in one page and must not cost `concurrency` requests
+    window = 1
+    throttle_count = self._throttle_count
+    pending = collections.deque()
+    next_page = start
+    with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+      try:
+        while True:
+          while len(pending) < window:
+            page_path = self._query_path(api_path, page=next_page, pageSize=pageSize)
+            pending.append((next_page, executor.submit(self._get_page, page_path)))
+            next_page += 1
+          page, future = pending.popleft()
+          records = future.result()
+          yield page, records
+          if len(records) < pageSize:
+            return
+          window = self.concurrency if self._throttle_count == throttle_count else 1
+      finally:
+        for page, future in pending:
+          future.cancel()
+
+  def _iter_page_lists(self, api_path, pageSize=None, start=1):
+    """
+    Yields (page number, records) from page `start` on, prefetched like the iter_* methods
+    """
+    pageSize = self._page_size(pageSize)
+    if self.concurrency > 1:
+      return self._prefetch_page_lists(api_path, pageSize, start)
+    return self._iter_page_lists_sequential(api_path, pageSize, start)
+
+  def _iter_page_lists_sequential(self, api_path, pageSize, start):
+    pageSize = self._page_size(pageSize)
+    page = start
+    while True:
+      records = self._get_page(self._query_path(api_path, page=page, pageSize=pageSize))
+      yield page, records
+      if len(records) < pageSize:
+        return
+      page += 1
+
+  def _iter_pages_sequential(self, api_path, pageSize, stream):
+    pageSize = self._page_size(pageSize)
+    page = 1
+    while True:
+      page_path = self._query_path(api_path, page=page, pageSize=pageSize)
+      count = 0
+      for record in self._get_page(page_path, stream=stream):
+        count += 1
+        yield record
+      if count < pageSize:
+        return
+      page += 1
+
+  def pull_all_user_data(self, pageSize=None, stream=False, compact=False):
+    """
+    Returns every user, department and group. With compact a models.UserData
+    is returned instead of three lists: users are loaded page by page into a
+    UserTable, with departments and groups interned rather than copied per user.
+    """
     logger.info("Zscaler Helper -  Pulling All User/Group Data")
-    zscaler_users = self.get_users(pageSize=999999)
-    zscaler_departments = self.get_departments(pageSize=999999)
-    zscaler_groups = self.get_groups(pageSize=999999)
+    if compact:
+      user_data = models.UserData.from_records(
+        self.iter_users(pageSize=pageSize, stream=stream), self.iter_departments(pageSize=pageSize, stream=stream),
+        self.iter_groups(pageSize=pageSize, stream=stream))
+      zscaler_users, zscaler_departments, zscaler_groups = user_data
+    else:
+      zscaler_users = list(self.iter_users(pageSize=pageSize, stream=stream))
+      zscaler_departments = list(self.iter_departments(pageSize=pageSize, stream=stream))
+      zscaler_groups = list(self.iter_groups(pageSize=pageSize, stream=stream))
     print("Users - {}, Deparments - {}, Groups - {}".format(len(zscaler_users), len(zscaler_departments), len(zscaler_groups)))
     logger.info("Zscaler API - Data Pull Complete")
-    return zscaler_users, zscaler_departments, zscaler_groups
\ No newline at end of file
+    if compact:
+      return user_data
+    return zscaler_users, zscaler_departments, zscaler_groups
+
+  def snapshot(self, path=':memory:', locations=True):
+    return Snapshot(path).refresh(self, locations=locations)
+
+  def iter_changes(self, previous=None, state=None):
+    """
+    Diffs the tenant against `previous` (a delta.DeltaState, a file written by
+    DeltaState.save() or the tuple returned by pull_all_user_data()) using a
+    content hash per record. Records are hashed as the pages stream in, so
+    only the previous hashes and one page are held in memory. The hashes of
+    the current records are written to `state` when one is given. Kinds
+    missing from a partial baseline yield nothing but are still hashed into
+    `state`, so the next run diffs them.
+    """
+    previous = delta.DeltaState.coerce(previous)
+    state = state if state is not None else delta.DeltaState()
+    sources = (('users', self.iter_users), ('departments', self.iter_departments),
+               ('groups', self.iter_groups), ('locations', self.iter_locations))
+    for kind, iter_records in sources:
+      if previous.indexes and kind not in previous:
+        delta.baseline(iter_records(), state[kind])
+        continue
+      for action, item in delta.diff(previous[kind], iter_records(), state[kind]):
+        yield kind, action, item
+
+  def pull_changes(self, previous=None):
+    logger.info("Zscaler Helper -  Pulling Changed User/Group/Location Data")
+    previous = delta.DeltaState.coerce(previous)
+    baselined = [kind for kind in delta.KINDS if previous.indexes and kind not in previous]
+    changes = delta.Changes(delta.DeltaState(), baselined)
+    for kind, action, item in self.iter_changes(previous, changes.state):
+      changes.add(kind, action, item)
+    logger.info("Zscaler API - Change Pull Complete - {!r}".format(changes))
+    return changes
+
+  def export(self, directory, format='ndjson', compression=None, kinds=None, flatten=None, pageSize=None, resume=True):
+    """
+    Writes every record of `kinds` (all by default) page by page to `directory`,
+    continuing from the last completed page when a previous run was interrupted.
+    Returns the number of records exported per kind.
+    """
+    logger.info("Zscaler Helper -  Exporting to {} as {}".format(directory, format))
+    exporter = Exporter(self, directory, format=format, compression=compression, kinds=kinds or EXPORT_KINDS,
+                        flatten=flatten, pageSize=pageSize)
+    return exporter.run(resume=resume)
+
+  def bulk_delete_users_chunked(self, ids):
+    return [self.bulk_delete_users(chunk) for chunk in bulk.chunks(ids, bulk.USER_BULK_DELETE_LIMIT)]
+
+  def bulk_delete_locations_chunked(self, ids):
+    return [self.bulk_delete_locations(chunk) for chunk in bulk.chunks(ids, bulk.LOCATION_BULK_DELETE_LIMIT)]
+
+  def bulk_sync_users(self, desired_users, delete_missing=False, activate=True):
+    """
+    Makes the ZIA users match `desired_users`, matched on email (or name).
+
+    Users that differ are updated and missing ones created on a pool of
+    `concurrency` workers that share the client throttle gate and rate
+    limiter, so they back off together on a 429. With delete_missing, users
+    not in `desired_users` (other than admin users) are deleted in chunks of
+    500. When anything changed a request_activation() is made at the end,
+    coalesced with the activations requested by other workers.
+    """
+    logger.info("Zscaler Helper - Syncing {} users".format(len(desired_users)))
+    report = bulk.BulkSyncReport()
+    current = {bulk.user_key(user): user for user in self.iter_users()}
+
+    writes = []
+    for desired in desired_users:
+      key = bulk.user_key(desired)
+      existing = current.pop(key, None)
+      if existing is None:
+        writes.append(('create', key, None, desired))
+      elif bulk.user_changes(existing, desired):
+        user_object = dict(existing)
+        user_object.update(desired)
+        user_object['id'] = existing['id']
+        writes.append(('update', key, existing['id'], user_object))
+      else:
+        report.unchanged.append(key)
+
+    with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+      futures = []
+      for action, key, id, user_object in writes:
+        if action == 'create':
+          future = executor.submit(self.add_user, user_object)
+        else:
+          future = executor.submit(self.update_user, id, user_object)
+        futures.append((future, action, key, id))
+      for future, action, key, id in futures:
+        try:
+          response = future.result()
+          if id is None and isinstance(response, dict):
+            id = response.get('id')
+          report.add(bulk.BulkResult(action, key, id, response=response))
+        except Exception as e:
+          logger.error("Bulk sync - {} {} failed - {}".format(action, key, e))
+          report.add(bulk.BulkResult(action, key, id, error=e))
+
+    if delete_missing:
+      stale = [user for user in current.values() if not user.get('adminUser')]
+      for chunk in bulk.chunks(stale, bulk.USER_BULK_DELETE_LIMIT):
+        ids = [user['id'] for user in chunk]
+        try:
+          response = self.bulk_delete_users(ids)
+        except Exception as e:
+          logger.error("Bulk sync - deleting {} users failed - {}".format(len(ids), e))
+          for user in chunk:
+            report.add(bulk.BulkResult('delete', bulk.user_key(user), user['id'], error=e))
+          continue
+        deleted = set(response.get('ids', ids)) if isinstance(response, dict) else set(ids)
+        for user in chunk:
+          if user['id'] in deleted:
+            report.add(bulk.BulkResult('delete', bulk.user_key(user), user['id'], response=response))
+          else:
+            report.add(bulk.BulkResult('delete', bulk.user_key(user), user['id'], error=Exception("User was not deleted")))
+
+    if activate and report.succeeded:
+      try:
+        report.activation = bulk.BulkResult('activate', None, response=self.request_activation())
+      except Exception as e:
+        report.activation = bulk.BulkResult('activate', None, error=e)
+
+    logger.info("Zscaler Helper - User Sync Complete - {}".format(dict(report.summary())))
+    return report
+
+class AsyncApi(_ZiaBase):
+  """
+  asyncio client for the Zscaler Internet Security API
+
+  Mirrors every method on api as a coroutine (iter_* methods are async
+  generators) on top of a single aiohttp.ClientSession whose connector keeps
+  up to `concurrency` keep-alive connections open. Requires aiohttp.
+  Requests rejected with a 401 are retried after one new login, shared by
+  every request that failed with the same session; a rejected login itself
+  is never retried.
+
+    async with zia.AsyncApi(cloud, username, password, apikey) as client:
+      await client.login()
+      users = await client.get_users_by_ids([1, 2, 3])
+
+  Bulk Methods
+  ------------
+  gather(*aws, return_exceptions=False)
+    Awaits coroutines like asyncio.gather, running at most `concurrency` at once
+  get_users_by_ids(ids)
+    Gets the users for the specified IDs concurrently
+  add_users(user_objects)
+    Adds the users concurrently
+  update_users(user_objects)
+    Updates the users concurrently, each object must contain its id
+  delete_users(ids)
+    Deletes the users for the specified IDs concurrently
+  get_sublocations_by_ids(ids)
+    Gets the sub-locations of the specified locations concurrently
+  """
+
+  def __init__(self, cloud, username, password, apikey, page_size=1000, concurrency=4, rate_limiter=None, metrics=None,
+               serializer=None, retry_policy=None, max_page_size=MAX_PAGE_SIZE):
+
+    logger.debug('Calling Init method called for zia AsyncApi class')
+    if aiohttp is None:
+      raise ImportError("AsyncApi requires aiohttp, install it with 'pip install aiohttp'")
+    super().__init__(cloud, username, password, apikey, page_size=page_size, concurrency=concurrency,
+                     rate_limiter=rate_limiter, metrics=metrics, serializer=serializer, retry_policy=retry_policy,
+                     max_page_size=max_page_size)
+
+    self.session = None
+    self._semaphore = None
+    self._login_lock = None
+    self._session_generation = 0
+
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, exc_type, exc, tb):
+    await self.close()
+
+  def _get_session(self):
+    if self.session is None or self.session.closed:
+      connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60)
+      self.session = aiohttp.ClientSession(connector=connector,
+                                           cookie_jar=aiohttp.CookieJar(unsafe=True),
+                                           headers={ 'Content-Type' :  'application/json',
+                                                     'cache-control': 'no-cache'})
+    return self.session
+
+  async def close(self):
+    if self.session is not None and not self.session.closed:
+      await self.session.close()
+
+  async def _wait_for_throttle(self):
+    waited = 0
+    while True:
+      with self._throttle_lock:
+        remaining = self._throttled_until - time.time()
+      if remaining <= 0:
+        return waited
+      await asyncio.sleep(remaining)
+      waited += remaining
+
+  async def _request(self, method, api_path, **kwargs):
+    generation = self._session_generation
+    throttle_wait = await self._wait_for_throttle()
+    delay = self.rate_limiter.reserve(method, api_path)
+    if delay > 0:
+      await asyncio.sleep(delay)
+    if self.metrics is None:
+      async with self._get_session().request(method, self._url(api_path), **kwargs) as response:
+        return await self._handle_response(response, generation)
+
+    if throttle_wait > 0:
+      self.metrics.record_wait('throttle_wait', method, api_path, throttle_wait)
+    if delay > 0:
+      self.metrics.record_wait('rate_limit_wait', method, api_path, delay)
+    request_bytes = _body_size(kwargs.get('data'))
+    started = time.perf_counter()
+    try:
+      async with self._get_session().request(method, self._url(api_path), **kwargs) as response:
+        body = await response.read()
+    except aiohttp.ClientError as e:
+      self.metrics.record_request(method, api_path, None, time.perf_counter() - started, request_bytes, error=e)
+      raise
+    self.metrics.record_request(method, api_path, response.status, time.perf_counter() - started,
+                                request_bytes, len(body))
+    # the body is already buffered, so it can be decoded after the connection is released
+    return await self._handle_response(response, generation)
+
+  async def _handle_response(self, response, generation=None):
+    if response.status < 400:
+      return self._decode(await response.read())
+    text = await response.text()
+    if response.status == 429:
+      raise ZiaThrottleException(text, response.headers.get('Retry-After'))
+    elif response.status == 401:
+      # logging in again is left to async_retry, so a rejected login never triggers another one
+      raise ZiaSessionException(text, generation)
+    else:
+      logger.error("Response - {} - {}".format(response.status, text))
+      response.raise_for_status()
+
+  async def gather(self, *aws, return_exceptions=False):
+    if self._semaphore is None:
+      self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def bounded(aw):
+      async with self._semaphore:
+        return await aw
+
+    return await asyncio.gather(*[bounded(aw) for aw in aws], return_exceptions=return_exceptions)
+
+  async def login(self):
+    logger.debug("login module called")
+    api_path = '/authenticatedSession'
+    timestamp, obf_key = self.obfuscateApiKey()
+    body = {
+      'apiKey': obf_key,
+      'username': self.username,
+      'password': self.password,
+      'timestamp': timestamp,
+    }
+    data = self.serializer.dumps(body)
+
+    response = await self._request('POST', api_path, data=data)
+    self._session_generation += 1
+    return response
+
+  async def _reauthenticate(self, generation=None):
+    """
+    Logs in again after a 401. Requests rejected with the same session
+    share one login, the others find the generation moved on and return.
+    """
+    if self._login_lock is None:
+      self._login_lock = asyncio.Lock()
+    async with self._login_lock:
+      if generation is not None and generation != self._session_generation:
+        return
+      await self.login()
+
+  async def logout(self):
+    logger.debug("logout module called")
+    api_path = '/authenticatedSession'
+
+    return await self._request('DELETE', api_path)
+
+  @async_retry(Exception)
+  async def get_users(self, name=None, dept=None, group=None, page=None, pageSize=None):
+    api_path = self._query_path('/users?', name=name, dept=dept, group=group, page=page, pageSize=pageSize)
+
+    return await self._request('GET', api_path)
+
+  def iter_users(self, name=None, dept=None, group=None, pageSize=None):
+    api_path = self._query_path('/users?', name=name, dept=dept, group=group)
+
+    return self._iter_pages(api_path, pageSize=pageSize)
+
+  @async_retry(Exception)
+  async def get_user(self, id):
+    api_path = '/users/{}'.format(id)
+
+    return await self._request('GET', api_path)
+
+  @async_retry(Exception)
+  async def get_groups(self, search=None, page=None, pageSize=None):
+    logger.debug("get_groups module called")
+    api_path = self._query_path('/groups?', search=search, page=page, pageSize=pageSize)
+
+    return await self._request('GET', api_path)
+
+  def iter_groups(self, search=None, pageSize=None):
+    api_path = self._query_path('/groups?', search=search)
+
+    return self._iter_pages(api_path, pageSize=pageSize)
+
+  @async_retry(Exception)
+  async def get_group(self, id):
+    api_path = '/groups/{}'.format(id)
+
+    return await self._request('GET', api_path)
+
+  @async_retry(Exception)
+  async def get_departments(self, search=None, name=None, page=None, pageSize=None):
+    logger.debug("get_departments module called")
+    api_path = self._query_path('/departments?', search=search, name=name, page=page, pageSize=pageSize)
+
+    return await self._request('GET', api_path)
+
+  def iter_departments(self, search=None, name=None, pageSize=None):
+    api_path = self._query_path('/departments?', search=search, name=name)
+
+    return self._iter_pages(api_path, pageSize=pageSize)
+
+  @async_retry(Exception)
+  async def get_department(self, id):
+    api_path = '/departments/{}'.format(id)
+
+    return await self._request('GET', api_path)
+
+  @async_retry(Exception, idempotent=False)
+  async def add_user(self, user_object):
+    api_path = '/users/'
+    data = self.serializer.dumps(user_object)
+
+    return await self._request('POST', api_path, data=data)
+
+  @async_retry(Exception)
+  async def update_user(self, id, user_object):
+    api_path = '/users/{}'.format(id)
+    data = self.serializer.dumps(user_object)
+
+    return await self._request('PUT', api_path, data=data)
+
+  @async_retry(Exception)
+  async def delete_user(self, id):
+    api_path = '/users/{}'.format(id)
+
+    return await self._request('DELETE', api_path)
+
+  @async_retry(Exception)
+  async def bulk_delete_users(self, ids=[]):
+    api_path = '/users/bulkDelete'
+    body = {}
+    body['ids'] = ids
+    data = self.serializer.dumps(body)
+
+    return await self._request('POST', api_path, data=data)
+
+  @async_retry(Exception)
+  async def get_status(self):
+    api_path = '/status'
+
+    return await self._request('GET', api_path)
+
+  @async_retry(Exception)
+  async def activate_status(self):
+    api_path = '/status/activate'
+
+    return await self._request('POST', api_path)
+
+  @async_retry(Exception)
+  async def get_locations(self, search=None, sslScanEnabled=None, xffEnabled=None, authRequired=None, bwEnforced=None, page=None, pageSize=None):
+    api_path = self._query_path('/locations?', search=search, sslScanEnabled=sslScanEnabled, xffEnabled=xffEnabled,
+                                authRequired=authRequired, bwEnforced=bwEnforced, page=page, pageSize=pageSize)
+
+    return await self._request('GET', api_path)
+
+  def iter_locations(self, search=None, sslScanEnabled=None, xffEnabled=None, authRequired=None, bwEnforced=None, pageSize=None):
+    api_path = self._query_path('/locations?', search=search, sslScanEnabled=sslScanEnabled, xffEnabled=xffEnabled,
+                                authRequired=authRequired, bwEnforced=bwEnforced)
+
+    return self._iter_pages(api_path, pageSize=pageSize)
+
+  @async_retry(Exception)
+  async def get_location(self, id):
+    api_path = '/locations/{}'.format(id)
+
+    return await self._request('GET', api_path)
+
+  @async_retry(Exception)
+  async def get_sublocations(self, id, search=None, sslScanEnabled=None, xffEnabled=None, authRequired=None, bwEnforced=None, page=None, pageSize=None, enforceAup=None, enableFirewall=None):
+    api_path = self._query_path('/locations/{}/sublocations?'.format(id), search=search, sslScanEnabled=sslScanEnabled,
+                                xffEnabled=xffEnabled, authRequired=authRequired, bwEnforced=bwEnforced, page=page,
+                                pageSize=pageSize, enforceAup=enforceAup, enableFirewall=enableFirewall)
+
+    return await self._request('GET', api_path)
+
+  def iter_sublocations(self, id, search=None, sslScanEnabled=None, xffEnabled=None, authRequired=None, bwEnforced=None, pageSize=None, enforceAup=None, enableFirewall=None):
+    api_path = self._query_path('/locations/{}/sublocations?'.format(id), search=search, sslScanEnabled=sslScanEnabled,
+                                xffEnabled=xffEnabled, authRequired=authRequired, bwEnforced=bwEnforced,
+                                enforceAup=enforceAup, enableFirewall=enableFirewall)
+
+    return self._iter_pages(api_path, pageSize=pageSize)
+
+  async def _location_parents_with_children(self):
+    try:
+      api_path = self._query_path('/locations/lite?', includeSubLocations=True)
+      return location_tree.parent_ids(await self._get_all_pages(api_path, self.page_size))
+    except Exception as e:
+      logger.warning("Zscaler Helper - locations lite unavailable, using childCount - {}".format(e))
+      return None
+
+  async def _get_all_pages(self, api_path, pageSize):
+    pageSize = self._page_size(pageSize)
+    records = []
+    page = 1
+    while True:
+      page_records = await self._get_page(self._query_path(api_path, page=page, pageSize=pageSize))
+      records.extend(page_records)
+      if len(page_records) < pageSize:
+        return records
+      page += 1
+
+  async def iter_location_tree(self, pageSize=None):
+    """
+    Yields (parent, sub-locations) as each parent's sub-locations arrive, see api.iter_location_tree()
+    """
+    pageSize = self._page_size(pageSize)
+    parents = await self._location_parents_with_children()
+    window = self.concurrency
+    throttle_count = self._throttle_count
+    pending = {}
+    try:
+      async for parent in self.iter_locations(pageSize=pageSize):
+        if not location_tree.has_children(parent, parents):
+          yield parent, []
+          continue
+        while len(pending) >= window:
+          done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+          for task in done:
+            yield pending.pop(task), task.result()
+          if self._throttle_count != throttle_count:
+            window = 1
+        api_path = '/locations/{}/sublocations?'.format(parent['id'])
+        pending[asyncio.ensure_future(self._get_all_pages(api_path, pageSize))] = parent
+      while pending:
+        done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+          yield pending.pop(task), task.result()
+    finally:
+      for task in pending:
+        task.cancel()
+
+  async def get_location_tree(self, pageSize=None):
+    return location_tree.LocationTree([item async for item in self.iter_location_tree(pageSize=pageSize)])
+
+  @async_retry(Exception, idempotent=False)
+  async def add_location(self, location_object):
+    api_path = '/locations'
+    data = self.serializer.dumps(location_object)
+
+    return await self._request('POST', api_path, data=data)
+
+  @async_retry(Exception)
+  async def get_locations_lite(self, includeSubLocations=None, includeParentLocations=None, sslScanEnabled=None, search=None, page=None, pageSize=None):
+    api_path = self._query_path('/locations/lite?', includeSubLocations=includeSubLocations, includeParentLocations=includeParentLocations,
+                                sslScanEnabled=sslScanEnabled, search=search, page=page, pageSize=pageSize)
+
+    return await self._request('GET', api_path)
+
+  @async_retry(Exception)
+  async def update_location(self, id, location_object):
+    api_path = '/locations/{}'.format(id)
+    data = self.serializer.dumps(location_object)
+
+    return await self._request('PUT', api_path, data=data)
+
+  @async_retry(Exception)
+  async def delete_location(self, id):
+    api_path = '/locations/{}'.format(id)
+
+    return await self._request('DELETE', api_path)
+
+  @async_retry(Exception)
+  async def bulk_delete_locations(self, ids=[]):
+    api_path = '/locations/bulkDelete'
+    body = {}
+    body['ids'] = ids
+    data = self.serializer.dumps(body)
+
+    return await self._request('POST', api_path, data=data)
+
+  @async_retry(Exception)
+  async def _get_page(self, api_path):
+    return await self._request('GET', api_path)
+
+  async def _iter_pages(self, api_path, pageSize=None):
+    pageSize = self._page_size(pageSize)
+    # page 1 alone, the window only opens once a full page shows there is more
+    window = 1
+    throttle_count = self._throttle_count
+    pending = collections.deque()
+    next_page = 1
+    try:
+      while True:
+        while len(pending) < window:
+          page_path = self._query_path(api_path, page=next_page, pageSize=pageSize)
+          pending.append(asyncio.ensure_future(self._get_page(page_path)))
+          next_page += 1
+        records = await pending.popleft()
+        for record in records:
+          yield record
+        if len(records) < pageSize:
+          return
+        window = self.concurrency if self._throttle_count == throttle_count else 1
+    finally:
+      for task in pending:
+        task.cancel()
+
+  async def get_users_by_ids(self, ids):
+    return await self.gather(*[self.get_user(id) for id in ids])
+
+  async def add_users(self, user_objects):
+    return await self.gather(*[self.add_user(user_object) for user_object in user_objects], return_exceptions=True)
+
+  async def update_users(self, user_objects):
+    return await self.gather(*[self.update_user(user_object['id'], user_object) for user_object in user_objects], return_exceptions=True)
+
+  async def delete_users(self, ids):
+    return await self.gather(*[self.delete_user(id) for id in ids], return_exceptions=True)
+
+  async def get_sublocations_by_ids(self, ids):
+    return await self.gather(*[self.get_sublocations(id) for id in ids])
+
+  async def pull_all_user_data(self, pageSize=None, compact=False):
+    logger.info("Zscaler Helper -  Pulling All User/Group Data")
+    table = models.UserTable() if compact else None
+    zscaler_users, zscaler_departments, zscaler_groups = await asyncio.gather(
+      self._collect(self.iter_users(pageSize=pageSize), table),
+      self._collect(self.iter_departments(pageSize=pageSize)),
+      self._collect(self.iter_groups(pageSize=pageSize)))
+    logger.info("Zscaler API - Data Pull Complete")
+    if compact:
+      return models.UserData.from_table(table, zscaler_departments, zscaler_groups)
+    return zscaler_users, zscaler_departments, zscaler_groups
+
+  async def _collect(self, records, table=None):
+    if table is not None:
+      async for record in records:
+        table.append(record)
+      return table
+    return [record async for record in records]